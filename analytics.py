@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+analytics.py
+
+Comparisons between sensors and rooms (e.g. for layout studies), using the
+database through DatabasePlotter(). The readings of the chosen sensors are
+put on a shared grid of minutes, as one 2-D NumPy array (time x sensor) per
+parameter, with NaN where a sensor has no reading. Correlation, lagged
+correlation, and co-occupancy matrices are then worked out for all pairs of
+sensors at once with matrix products, rather than pair by pair.
+
+For example, the correlation of occupancy between all sensors in May:
+
+    from analytics import Analytics
+
+    analytics = Analytics()
+    times, sensor_numbers, grids = analytics.minute_grid(
+        time_from=1588291200000, time_to=1590969600000,
+        parameters=['occupancy', 'co2'])
+    correlation = Analytics.correlation(grids['occupancy'])
+
+Row and column i of each matrix is sensor_numbers[i]. Use
+Analytics.room_grid() to compare rooms instead of sensors.
+
+"""
+from databaseplot import DatabasePlotter
+import numpy as np
+from scraper import Scraper
+import sqlite3
+
+
+class Analytics():
+    '''Puts readings from the database on a shared grid of minutes and
+    compares the sensors (or rooms) with each other.
+    '''
+
+    def __init__(self, plotter=None):
+
+        # reads the database through DatabasePlotter
+        if plotter is None:
+            plotter = DatabasePlotter()
+        self.plotter = plotter
+
+    def minute_grid(self, sensors=None, rooms=None, time_from=None,
+                    time_to=None, parameters=None, chunksize=1000000):
+        '''
+        Reads the readings of the sensors onto a shared grid of minutes. The
+        readings are read in chunks of 'chunksize' rows, one parameter at a
+        time, so only one grid is being built at once, and readings in the
+        same minute for a sensor are averaged. Where the database has been
+        downsampled, hourly means are at the start of each hour.
+
+        Parameters
+        ----------
+        sensors, rooms, parameters :
+            As for DatabasePlotter.plot_from_database(). Default is all.
+        time_from : time from in ms format, optional
+            Default will use the first reading of the sensors
+        time_to : time to in ms format, optional
+            Default will use the last reading of the sensors
+
+        Returns
+        -------
+        times : array of the start of each minute (datetime64[ms])
+        sensor_numbers : list of the sensor in each column
+        grids : dict of parameter to a float32 array (time x sensor), with
+            NaN where there is no reading
+        '''
+
+        plotter = self.plotter
+        sensor_numbers, _, _, _ = plotter.get_names_and_numbers(
+            sensors=sensors, rooms=rooms)
+        if sensor_numbers is None:
+            sensor_numbers = sorted(plotter.all_sensor_numbers)
+        if parameters is None:
+            parameters = plotter.param_list
+        elif isinstance(parameters, str):
+            parameters = [parameters]
+        if time_from is None or time_to is None:
+            first_reading, last_reading = self._time_range(sensor_numbers)
+            if time_from is None:
+                time_from = first_reading
+            if time_to is None:
+                time_to = last_reading
+
+        first_minute = time_from // 60000
+        n_minutes = time_to // 60000 - first_minute + 1
+        n_sensors = len(sensor_numbers)
+
+        # column of each sensor number
+        columns = np.full(max(sensor_numbers) + 1, -1)
+        columns[sensor_numbers] = np.arange(n_sensors)
+
+        grids = {}
+        for parameter in parameters:
+            # float32 sums and small counts, as the grid can be large
+            sums = np.zeros(n_minutes * n_sensors, dtype=np.float32)
+            counts = np.zeros(n_minutes * n_sensors, dtype=np.uint16)
+
+            for chunk in plotter.retrieve_data_chunks(sensor_numbers, 
+                                                      time_from, time_to, 
+                                                      [parameter], chunksize):
+                values = chunk[parameter].to_numpy(dtype=float)
+                valid = ~np.isnan(values)
+                cells = ((chunk['timestampms'].to_numpy()[valid] // 60000 -
+                          first_minute) * n_sensors +
+                         columns[chunk['sensor_number'].to_numpy()[valid]])
+                # add up each cell in the chunk, then add to the grid
+                cells, positions = np.unique(cells, return_inverse=True)
+                sums[cells] += np.bincount(positions, weights=values[valid],
+                                           minlength=len(cells))
+                counts[cells] += np.bincount(
+                    positions, minlength=len(cells)).astype(np.uint16)
+
+            # the mean in each cell, in place of the sums (NaN if empty)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                np.divide(sums, counts, out=sums)
+            del counts
+            grids[parameter] = sums.reshape(n_minutes, n_sensors)
+
+        times = (first_minute + np.arange(n_minutes)) * 60000
+        return (times.astype('datetime64[ms]'), list(sensor_numbers), grids)
+
+    def _time_range(self, sensor_numbers):
+        ''' Returns the ms times of the first and last readings of the
+        sensors, from the coverage recorded by database.py (see
+        Database.find_gaps()), without reading the readings. If it has not
+        been recorded, returns the time of the first sensor reading and the
+        current time.'''
+
+        sensor_ids = self.plotter.sensor_location_info['sensor_id'].loc[
+            sensor_numbers].tolist()
+        try:
+            self.plotter.c.execute(
+                'SELECT MIN(time_from), MAX(time_to) FROM sensor_coverage '
+                'WHERE sensorlocation IN ({});'
+                .format(', '.join('?' * len(sensor_ids))), sensor_ids)
+            first_reading, last_reading = self.plotter.c.fetchone()
+        except sqlite3.OperationalError:
+            first_reading = None
+        if first_reading is None:
+            return (1580920305102, Scraper._time_now())
+        return (first_reading, last_reading)
+
+    def room_grid(self, grid, sensor_numbers, parameter):
+        '''
+        Combines the columns of a grid from Analytics.minute_grid() into one
+        column per room, in the same way as DatabasePlotter.aggregate_data():
+        the sum of occupancy and the mean of every other parameter over the
+        sensors in each room with a reading in that minute.
+
+        Returns
+        -------
+        room_grid : float32 array (time x room)
+        room_names : list of the room in each column
+        '''
+
+        room_of_sensor = [self.plotter.room_name_by_sensor_number.get(
+            sensor_number) for sensor_number in sensor_numbers]
+        room_names = sorted({room_name for room_name in room_of_sensor
+                             if room_name is not None})
+
+        # which sensors are in which room (sensor x room)
+        membership = np.zeros((len(sensor_numbers), len(room_names)),
+                              dtype=np.float32)
+        for i, room_name in enumerate(room_of_sensor):
+            if room_name is not None:
+                membership[i, room_names.index(room_name)] = 1
+
+        valid = ~np.isnan(grid)
+        totals = np.where(valid, grid, 0) @ membership
+        counts = valid.astype(np.float32) @ membership
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if parameter == 'occupancy':
+                combined = np.where(counts > 0, totals, np.nan)
+            else:
+                combined = totals / counts
+
+        return (combined.astype(np.float32), room_names)
+
+    @staticmethod
+    def _pairwise_correlation(x, y):
+        ''' Returns the Pearson correlation of every column of x with every
+        column of y (columns x rows), each over the minutes in which both
+        have values, using matrix products. NaN where there are fewer than
+        two shared minutes or no variation. The products are worked out in
+        float32 (as the grids), and only the small results in float64.'''
+
+        x_valid = ~np.isnan(x)
+        y_valid = ~np.isnan(y)
+
+        # centre each column first, so the sums stay small
+        with np.errstate(invalid='ignore'):
+            x = np.where(x_valid, x - np.nanmean(x, axis=0), 0)
+            y = np.where(y_valid, y - np.nanmean(y, axis=0), 0)
+        x = np.nan_to_num(x)
+        y = np.nan_to_num(y)
+        x_valid = x_valid.astype(np.float32)
+        y_valid = y_valid.astype(np.float32)
+
+        # sums over the minutes shared by each pair of columns
+        n = (x_valid.T @ y_valid).astype(float)
+        sum_x = (x.T @ y_valid).astype(float)
+        sum_y = (x_valid.T @ y).astype(float)
+        sum_xx = (np.square(x).T @ y_valid).astype(float)
+        sum_yy = (x_valid.T @ np.square(y)).astype(float)
+        sum_xy = (x.T @ y).astype(float)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = sum_xy - sum_x * sum_y / n
+            variance_x = sum_xx - sum_x * sum_x / n
+            variance_y = sum_yy - sum_y * sum_y / n
+            correlation = covariance / np.sqrt(variance_x * variance_y)
+        correlation[(n < 2) | (variance_x <= 0) | (variance_y <= 0)] = np.nan
+
+        return (np.clip(correlation, -1, 1))
+
+    @staticmethod
+    def correlation(grid):
+        ''' Returns the correlation matrix (sensor x sensor) of the columns
+        of a grid from Analytics.minute_grid() or Analytics.room_grid().'''
+        return (Analytics._pairwise_correlation(grid, grid))
+
+    @staticmethod
+    def lagged_correlation(grid, lags):
+        ''' Returns an array (lag x sensor x sensor) where [k, i, j] is the
+        correlation of column i with column j 'lags[k]' minutes later, e.g.
+        how well occupancy at an entrance predicts occupancy in a room
+        afterwards.'''
+
+        n_minutes = grid.shape[0]
+        matrices = []
+        for lag in lags:
+            if lag >= 0:
+                matrices.append(Analytics._pairwise_correlation(
+                    grid[:n_minutes - lag], grid[lag:]))
+            else:
+                matrices.append(Analytics._pairwise_correlation(
+                    grid[-lag:], grid[:n_minutes + lag]))
+        return (np.stack(matrices))
+
+    @staticmethod
+    def co_occupancy(occupancy_grid):
+        '''
+        Returns the co-occupancy matrix (sensor x sensor) of an occupancy
+        grid from Analytics.minute_grid() or Analytics.room_grid(): for each
+        pair, the fraction of the minutes in which both have a reading that
+        both are occupied. The diagonal is the fraction of minutes each is
+        occupied.
+        '''
+
+        valid = (~np.isnan(occupancy_grid)).astype(np.float32)
+        occupied = np.nan_to_num(occupancy_grid) > 0
+        occupied = occupied.astype(np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return ((occupied.T @ occupied).astype(float) / 
+                    (valid.T @ valid))
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+anomalies.py
+
+Detection of unusual readings as they are inserted by database.py. For each
+sensor and parameter, an exponentially weighted moving average (EWMA) of the
+mean and variance is kept, which only needs the previous values, so each new
+reading takes constant time and memory and no old readings are read. A
+reading is flagged when it is outside the fixed limits for the parameter
+(e.g. CO2 above 1500 ppm), or when it is more than 'z_limit' standard
+deviations from the moving mean for that sensor.
+
+An event is written to the 'events' table when a reading starts a breach (the
+reading before it was not in the same breach), so a long excursion gives one
+event rather than one per minute. The moving statistics are kept in the
+'sensor_statistics' table so they carry on from one run of database.py to
+the next.
+
+Events can be read with e.g.:
+
+    SELECT * FROM events WHERE timestampms > 1588590000000;
+
+"""
+import math
+
+
+class AnomalyDetector():
+    '''Keeps the moving statistics of each sensor and writes events for
+    readings outside the limits to the database.
+    '''
+
+    # parameters checked for unusual readings
+    parameters = ['co2', 'voc', 'noise', 'temperature']
+
+    # fixed (lower, upper) limits. VOC is only checked against its moving
+    # statistics, as its scale depends on the sensor.
+    thresholds = {'co2': (None, 1500),  # ppm
+                  'noise': (None, 75),  # dB
+                  'temperature': (16, 28)}  # °C
+
+    # weight of each new reading in the moving mean and variance
+    alpha = 0.05
+
+    # number of standard deviations from the moving mean to flag
+    z_limit = 4
+
+    # readings needed before the moving statistics are used
+    warmup = 30
+
+    def __init__(self, conn):
+
+        self.conn = conn
+        self.c = conn.cursor()
+        AnomalyDetector.create_tables(self.c)
+
+        # (sensorlocation, parameter) to [mean, variance, count,
+        # timestampms of last reading, breach of last reading]
+        self.c.execute('SELECT sensorlocation, parameter, mean, variance, '
+                       'count, timestampms, breach '
+                       'FROM sensor_statistics;')
+        self.statistics = {(row[0], row[1]): list(row[2:])
+                           for row in self.c.fetchall()}
+
+    @staticmethod
+    def create_tables(c):
+        ''' Creates the 'sensor_statistics' and 'events' tables and the
+        indexes on 'events' (if they do not exist).'''
+        c.execute('CREATE TABLE IF NOT EXISTS sensor_statistics('
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'parameter VARCHAR(255) NOT NULL, '
+                  'mean FLOAT, '
+                  'variance FLOAT, '
+                  'count INTEGER, '  # readings included
+                  'timestampms INTEGER, '  # time of last reading
+                  'breach VARCHAR(255), '  # breach of last reading, if any
+                  'PRIMARY KEY (sensorlocation, parameter)) WITHOUT ROWID;')
+        c.execute('CREATE TABLE IF NOT EXISTS events('
+                  'event_id INTEGER PRIMARY KEY, '
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'sensor_number INTEGER, '
+                  'parameter VARCHAR(255) NOT NULL, '
+                  'timestampms INTEGER NOT NULL, '  # time of reading
+                  'kind VARCHAR(255) NOT NULL, '  # 'above', 'below' or 'z'
+                  'value FLOAT, '
+                  'limit_value FLOAT, '  # threshold, or the z-score limit
+                  'mean FLOAT, '  # moving mean before the reading
+                  'std FLOAT, '  # moving standard deviation
+                  'UNIQUE (sensorlocation, parameter, timestampms, kind));')
+        c.execute('CREATE INDEX IF NOT EXISTS events_time '
+                  'ON events(timestampms);')
+        c.execute('CREATE INDEX IF NOT EXISTS events_sensor '
+                  'ON events(sensor_number, timestampms);')
+
+    @staticmethod
+    def _breach(parameter, value, mean, variance, count):
+        ''' Returns the kind of breach of the reading ('above', 'below', or
+        'z'), and the limit, or (None, None).'''
+
+        lower, upper = AnomalyDetector.thresholds.get(parameter,
+                                                      (None, None))
+        if upper is not None and value > upper:
+            return ('above', upper)
+        if lower is not None and value < lower:
+            return ('below', lower)
+        if count >= AnomalyDetector.warmup and variance > 0 and \
+                abs(value - mean) > AnomalyDetector.z_limit * \
+                math.sqrt(variance):
+            return ('z', AnomalyDetector.z_limit)
+        return (None, None)
+
+    def check(self, readings):
+        ''' Updates the moving statistics with the readings (a dataframe from
+        the API with sensorlocation, sensornumber, timestampms and the
+        parameters), and writes an event for each reading which starts a
+        breach. Readings older than the last reading seen for a sensor (e.g.
+        gaps filled in later) are skipped. Returns the number of events.'''
+
+        columns = [column for column in AnomalyDetector.parameters
+                   if column in readings.columns]
+        if readings.empty or not columns:
+            return (0)
+
+        readings = readings.sort_values('timestampms')
+        events = []
+        changed = set()
+        for row in readings[['sensorlocation', 'sensornumber', 'timestampms']
+                            + columns].itertuples(index=False):
+            sensorlocation, sensor_number, timestampms = row[:3]
+            for parameter, value in zip(columns, row[3:]):
+                if value is None or value != value:  # missing (NaN)
+                    continue
+                key = (sensorlocation, parameter)
+                state = self.statistics.get(key)
+                if state is None:
+                    state = self.statistics[key] = [float(value), 0.0, 0,
+                                                    None, None]
+                mean, variance, count, last_time, last_breach = state
+                if last_time is not None and timestampms <= last_time:
+                    continue
+
+                breach, limit = AnomalyDetector._breach(
+                    parameter, value, mean, variance, count)
+                if breach is not None and breach != last_breach:
+                    events.append((sensorlocation, int(sensor_number),
+                                   parameter, int(timestampms), breach,
+                                   float(value), limit, mean,
+                                   math.sqrt(variance)))
+
+                # update the moving mean and variance
+                difference = value - mean
+                increment = AnomalyDetector.alpha * difference
+                state[0] = mean + increment
+                state[1] = (1 - AnomalyDetector.alpha) * \
+                    (variance + difference * increment)
+                state[2] = count + 1
+                state[3] = int(timestampms)
+                state[4] = breach
+                changed.add(key)
+
+        with self.conn:
+            self.c.executemany(
+                'INSERT INTO sensor_statistics (sensorlocation, parameter, '
+                'mean, variance, count, timestampms, breach) '
+                'VALUES(?,?,?,?,?,?,?) '
+                'ON CONFLICT (sensorlocation, parameter) DO UPDATE SET '
+                'mean = excluded.mean, variance = excluded.variance, '
+                'count = excluded.count, timestampms = excluded.timestampms, '
+                'breach = excluded.breach;',
+                [key + tuple(self.statistics[key]) for key in changed])
+            self.c.executemany(
+                'INSERT OR IGNORE INTO events (sensorlocation, sensor_number, '
+                'parameter, timestampms, kind, value, limit_value, mean, '
+                'std) VALUES(?,?,?,?,?,?,?,?,?)', events)
+
+        if events:
+            print('{} event(s) written to the events table.'
+                  .format(len(events)))
+        return (len(events))
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+archive.py
+
+Compressed cold storage for old readings. Readings older than a number of
+days can be moved out of database.db (python database.py -A DAYS) into
+blocks in 'archive.db', one block per sensor per (UTC) day. Nothing is lost:
+DatabasePlotter reads the blocks back, decoded straight into NumPy arrays, in
+place of the rows they replaced.
+
+Most parameters change slowly from minute to minute, and readings are about
+one minute apart, so each block stores differences rather than values:
+
+  - timestamps as the first ms time, then the change in the interval between
+    readings (delta-of-delta), which is usually zero or small
+  - whole number parameters (e.g. co2, occupancy) as the change from the
+    previous reading
+  - decimal parameters (e.g. temperature to 0.01 °C) scaled to whole numbers
+    and then stored as changes, or, if they are not short decimals, as the
+    XOR of their bits with the previous reading
+
+Each of these whole number streams is written as zigzag varints (small
+changes of either sign take one byte) with runs of zeros (e.g. unchanged
+occupancy) written as one varint for the length of the run. Missing values
+are kept by a mask stored the same way. All encoding and decoding is done on
+whole arrays with NumPy.
+
+"""
+import numpy as np
+import os
+import sqlite3
+
+
+class Archive():
+    '''Encodes and decodes blocks of readings, and reads and writes them in
+    archive.db. Each block holds the readings of one sensor on one day.
+    '''
+
+    # file holding the blocks, next to database.db
+    file_name = './archive.db'
+
+    # parameters in each block, in order
+    param_list = ['occupancy', 'voc', 'co2', 'temperature', 'pressure',
+                  'humidity', 'lux', 'noise']
+
+    # first byte of each block, for the version of the format
+    version = 1
+
+    # kinds of stream for a parameter
+    EMPTY = 0  # all missing
+    DELTA = 1  # whole numbers, stored as changes
+    DECIMAL = 2  # decimals scaled by 10 ** places, stored as changes
+    XOR = 3  # float64 bits XOR the previous reading
+    HAS_MISSING = 0x10  # added to the kind if a mask of missing values follows
+
+    # most decimal places tried before using XOR
+    max_places = 6
+
+    ms_per_day = 86400000
+
+    def __init__(self, read_only=False):
+
+        if read_only:
+            self.conn = sqlite3.connect(
+                'file:{}?mode=ro'.format(Archive.file_name), uri=True,
+                check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(Archive.file_name)
+        self.c = self.conn.cursor()
+        if not read_only:
+            Archive.create_table(self.c)
+
+    @staticmethod
+    def exists():
+        ''' Returns True if archive.db has been created.'''
+        return (os.path.exists(Archive.file_name))
+
+    @staticmethod
+    def create_table(c):
+        ''' Creates the 'archive_blocks' table (if it does not exist).'''
+        c.execute('CREATE TABLE IF NOT EXISTS archive_blocks('
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'day INTEGER NOT NULL, '  # ms time of start of the day
+                  'readings INTEGER, '
+                  'time_from INTEGER, '  # ms time of first reading
+                  'time_to INTEGER, '  # ms time of last reading
+                  'block BLOB, '
+                  'PRIMARY KEY (sensorlocation, day)) WITHOUT ROWID;')
+
+    # %% whole number streams
+
+    @staticmethod
+    def _zigzag(values):
+        ''' Maps int64 values to uint64 so that small values of either sign
+        are small (0, -1, 1, -2 ... to 0, 1, 2, 3 ...).'''
+        values = values.astype(np.int64)
+        return (((values << 1) ^ (values >> 63)).view(np.uint64))
+
+    @staticmethod
+    def _unzigzag(values):
+        ''' Reverses Archive._zigzag().'''
+        values = values.astype(np.uint64)
+        return ((values >> np.uint64(1)).view(np.int64) ^
+                -(values & np.uint64(1)).view(np.int64))
+
+    @staticmethod
+    def _varints(values):
+        ''' Returns uint64 values as LEB128 varints (7 bits per byte, with
+        the top bit set on all but the last byte of each value).'''
+        values = values.astype(np.uint64)
+        if not len(values):
+            return (b'')
+        groups = np.stack([(values >> np.uint64(7 * i)) & np.uint64(0x7f)
+                           for i in range(10)], axis=1).astype(np.uint8)
+        bits = np.zeros(len(values), dtype=np.int64)
+        remaining = values.copy()
+        while remaining.any():
+            bits += remaining > 0
+            remaining >>= np.uint64(7)
+        lengths = np.maximum(bits, 1)
+        used = np.arange(10) < lengths[:, None]
+        groups[np.arange(10) < lengths[:, None] - 1] |= 0x80
+        return (groups[used].tobytes())
+
+    @staticmethod
+    def _from_varints(data):
+        ''' Reverses Archive._varints().'''
+        data = np.frombuffer(data, dtype=np.uint8)
+        if not len(data):
+            return (np.zeros(0, dtype=np.uint64))
+        ends = np.flatnonzero(data < 0x80)
+        starts = np.concatenate([[0], ends[:-1] + 1])
+        lengths = ends - starts + 1
+        positions = np.arange(len(data)) - np.repeat(starts, lengths)
+        parts = (data & 0x7f).astype(np.uint64) << \
+            (7 * positions).astype(np.uint64)
+        return (np.bitwise_or.reduceat(parts, starts))
+
+    @staticmethod
+    def _encode_stream(values):
+        ''' Returns uint64 values as varints, with each run of zeros written
+        as one varint of (length << 1) | 1 and other values as value << 1.'''
+        values = values.astype(np.uint64)
+        if not len(values):
+            return (b'')
+        zero = values == 0
+        # start of each run of zeros, and of each other value
+        starts = np.flatnonzero(~zero | np.concatenate(
+            [[True], ~zero[:-1]]))
+        lengths = np.diff(np.append(starts, len(values)))
+        tokens = np.where(zero[starts],
+                          (lengths.astype(np.uint64) << np.uint64(1)) |
+                          np.uint64(1),
+                          values[starts] << np.uint64(1))
+        return (Archive._varints(tokens))
+
+    @staticmethod
+    def _decode_stream(data):
+        ''' Reverses Archive._encode_stream().'''
+        tokens = Archive._from_varints(data)
+        run = (tokens & np.uint64(1)).astype(bool)
+        lengths = np.where(run, tokens >> np.uint64(1), 1).astype(np.int64)
+        values = np.where(run, 0, tokens >> np.uint64(1)).astype(np.uint64)
+        return (np.repeat(values, lengths))
+
+    # %% blocks
+
+    @staticmethod
+    def _decimal_places(values):
+        ''' Returns the fewest decimal places (up to Archive.max_places)
+        which hold every value exactly, or None.'''
+        for places in range(Archive.max_places + 1):
+            scaled = np.round(values * 10 ** places)
+            if np.abs(scaled).max() < 2 ** 52 and \
+                    np.array_equal(scaled / 10 ** places, values):
+                return (places)
+        return (None)
+
+    @staticmethod
+    def _sections(*sections):
+        ''' Joins byte strings, each after its length as a varint.'''
+        return (b''.join(
+            Archive._varints(np.array([len(section)])) + section
+            for section in sections))
+
+    @staticmethod
+    def encode(timestamps, values):
+        '''
+        Encodes the readings of one sensor as a block.
+
+        Parameters
+        ----------
+        timestamps : ms times of the readings (int), in increasing order
+        values : dict of parameter to an array of the readings (float, with
+            NaN where missing). Parameters not given are stored as missing.
+
+        Returns
+        -------
+        The block (bytes).
+        '''
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        n = len(timestamps)
+        header = Archive._varints(np.array([Archive.version, n]))
+        if not n:
+            return (header)
+
+        deltas = np.diff(timestamps)
+        delta_of_deltas = np.diff(deltas, prepend=0)
+        blocks = [header, Archive._sections(
+            Archive._varints(np.array([timestamps[0]])),
+            Archive._encode_stream(Archive._zigzag(delta_of_deltas)))]
+
+        for parameter in Archive.param_list:
+            column = values.get(parameter)
+            if column is None:
+                blocks.append(bytes([Archive.EMPTY]))
+                continue
+            column = np.asarray(column, dtype=float)
+            missing = np.isnan(column)
+            present = column[~missing]
+            if not len(present):
+                blocks.append(bytes([Archive.EMPTY]))
+                continue
+
+            places = Archive._decimal_places(present)
+            if places == 0:
+                kind, extra = Archive.DELTA, b''
+                stream = Archive._zigzag(np.diff(
+                    present.astype(np.int64), prepend=0))
+            elif places is not None:
+                kind, extra = Archive.DECIMAL, bytes([places])
+                stream = Archive._zigzag(np.diff(np.round(
+                    present * 10 ** places).astype(np.int64), prepend=0))
+            else:
+                kind, extra = Archive.XOR, b''
+                bits = present.view(np.uint64)
+                stream = bits ^ np.concatenate(
+                    [np.zeros(1, dtype=np.uint64), bits[:-1]])
+
+            sections = [Archive._encode_stream(stream)]
+            if missing.any():
+                kind |= Archive.HAS_MISSING
+                sections.append(Archive._encode_stream(Archive._zigzag(
+                    np.diff(missing.astype(np.int64), prepend=0))))
+            blocks.append(bytes([kind]) + extra + Archive._sections(
+                *sections))
+
+        return (b''.join(blocks))
+
+    @staticmethod
+    def decode(block, parameters=None):
+        '''
+        Decodes a block from Archive.encode().
+
+        Parameters
+        ----------
+        block : bytes
+        parameters : list of str, optional
+            Parameters to decode. Default will decode all parameters.
+
+        Returns
+        -------
+        timestamps : int64 array of ms times
+        values : dict of parameter to a float64 array, NaN where missing
+        '''
+
+        if parameters is None:
+            parameters = Archive.param_list
+        data = memoryview(block)
+        position = 0
+
+        def read_varint():
+            nonlocal position
+            start = position
+            while data[position] >= 0x80:
+                position += 1
+            position += 1
+            return (int(Archive._from_varints(data[start:position])[0]))
+
+        def read_section():
+            nonlocal position
+            length = read_varint()
+            position += length
+            return (data[position - length:position])
+
+        version = read_varint()
+        if version != Archive.version:
+            raise ValueError('Archive block version {} not recognised.'
+                             .format(version))
+        n = read_varint()
+        if not n:
+            return (np.zeros(0, dtype=np.int64),
+                    {parameter: np.zeros(0) for parameter in parameters})
+
+        first = Archive._from_varints(read_section()).view(np.int64)[0]
+        deltas = np.cumsum(Archive._unzigzag(Archive._decode_stream(
+            read_section())))
+        timestamps = first + np.concatenate([[0], np.cumsum(deltas)])
+
+        values = {}
+        for parameter in Archive.param_list:
+            kind = data[position]
+            position += 1
+            if kind == Archive.EMPTY:
+                if parameter in parameters:
+                    values[parameter] = np.full(n, np.nan)
+                continue
+            places = 0
+            if kind & ~Archive.HAS_MISSING == Archive.DECIMAL:
+                places = data[position]
+                position += 1
+            stream = read_section()
+            mask = read_section() if kind & Archive.HAS_MISSING else None
+            if parameter not in parameters:
+                continue
+
+            stream = Archive._decode_stream(stream)
+            kind &= ~Archive.HAS_MISSING
+            if kind == Archive.XOR:
+                present = np.bitwise_xor.accumulate(stream).view(np.float64)
+            else:
+                present = np.cumsum(Archive._unzigzag(stream)).astype(float)
+                if kind == Archive.DECIMAL:
+                    present = present / 10 ** places
+
+            if mask is None:
+                values[parameter] = present
+            else:
+                missing = np.cumsum(Archive._unzigzag(
+                    Archive._decode_stream(mask))).astype(bool)
+                column = np.full(n, np.nan)
+                column[~missing] = present
+                values[parameter] = column
+
+        return (timestamps, values)
+
+    # %% reading and writing archive.db
+
+    @staticmethod
+    def day_of(timestampms):
+        ''' Returns the ms time of the start of the UTC day of 'timestampms'.
+        '''
+        return (int(timestampms) // Archive.ms_per_day * Archive.ms_per_day)
+
+    def write(self, sensorlocation, readings):
+        '''
+        Adds readings of one sensor to its blocks, one per day, merging with
+        any readings already archived for those days (readings already in a
+        block are kept). Commits once all days are written. Returns the
+        number of readings which were not archived before.
+
+        Parameters
+        ----------
+        sensorlocation : sensor id
+        readings : dataframe with timestampms and any of the parameters
+        '''
+
+        if readings.empty:
+            return (0)
+        readings = readings.assign(
+            day=readings['timestampms'].astype('int64') //
+            Archive.ms_per_day * Archive.ms_per_day)
+
+        added = 0
+        with self.conn:
+            for day, day_readings in readings.groupby('day'):
+                timestamps = day_readings['timestampms'].to_numpy(
+                    dtype=np.int64)
+                values = {parameter: day_readings[parameter].to_numpy(
+                    dtype=float) for parameter in Archive.param_list
+                    if parameter in day_readings.columns}
+
+                self.c.execute('SELECT block FROM archive_blocks '
+                               'WHERE sensorlocation = ? AND day = ?;',
+                               [sensorlocation, int(day)])
+                stored = self.c.fetchone()
+                if stored is not None:
+                    old_timestamps, old_values = Archive.decode(stored[0])
+                    new = ~np.isin(timestamps, old_timestamps)
+                    timestamps = np.concatenate(
+                        [old_timestamps, timestamps[new]])
+                    values = {parameter: np.concatenate(
+                        [old_values[parameter],
+                         values.get(parameter, np.full(len(new), np.nan))
+                         [new]]) for parameter in Archive.param_list}
+                else:
+                    new = np.ones(len(timestamps), dtype=bool)
+
+                # one reading per time, in time order
+                timestamps, first = np.unique(timestamps, return_index=True)
+                values = {parameter: column[first]
+                          for parameter, column in values.items()}
+                added += int(new.sum())
+
+                self.c.execute('INSERT OR REPLACE INTO archive_blocks '
+                               '(sensorlocation, day, readings, time_from, '
+                               'time_to, block) VALUES(?,?,?,?,?,?)',
+                               [sensorlocation, int(day), len(timestamps),
+                                int(timestamps[0]), int(timestamps[-1]),
+                                Archive.encode(timestamps, values)])
+        return (added)
+
+    def read(self, sensorlocations, time_from, time_to, parameters=None):
+        '''
+        Reads the archived readings of the sensors between 'time_from' and
+        'time_to' (ms time epoch, inclusive).
+
+        Returns
+        -------
+        sensors : int array of the position in 'sensorlocations' of the
+            sensor of each reading
+        timestamps : int64 array of ms times
+        values : dict of parameter to a float64 array, NaN where missing
+        The readings of each sensor are together and in time order.
+        '''
+
+        if parameters is None:
+            parameters = Archive.param_list
+        sensors, timestamps = [], []
+        values = {parameter: [] for parameter in parameters}
+        for i, sensorlocation in enumerate(sensorlocations):
+            self.c.execute('SELECT block FROM archive_blocks '
+                           'WHERE sensorlocation = ? AND time_to >= ? '
+                           'AND time_from <= ? ORDER BY day;',
+                           [sensorlocation, time_from, time_to])
+            for (block,) in self.c.fetchall():
+                block_timestamps, block_values = Archive.decode(
+                    block, parameters)
+                keep = (block_timestamps >= time_from) & \
+                    (block_timestamps <= time_to)
+                timestamps.append(block_timestamps[keep])
+                sensors.append(np.full(keep.sum(), i))
+                for parameter in parameters:
+                    values[parameter].append(block_values[parameter][keep])
+
+        if not timestamps:
+            return (np.zeros(0, dtype=int), np.zeros(0, dtype=np.int64),
+                    {parameter: np.zeros(0) for parameter in parameters})
+        return (np.concatenate(sensors), np.concatenate(timestamps),
+                {parameter: np.concatenate(columns)
+                 for parameter, columns in values.items()})
+
+    def blocks(self, parameters=None):
+        ''' Decodes every block in turn. Yields the sensor id, timestamps,
+        and values of each (as Archive.decode()).'''
+        self.c.execute('SELECT sensorlocation, day FROM archive_blocks '
+                       'ORDER BY sensorlocation, day;')
+        for sensorlocation, day in self.c.fetchall():
+            block = self.conn.execute(
+                'SELECT block FROM archive_blocks '
+                'WHERE sensorlocation = ? AND day = ?;',
+                [sensorlocation, day]).fetchone()[0]
+            timestamps, values = Archive.decode(block, parameters)
+            yield (sensorlocation, timestamps, values)
+
+    def size(self):
+        ''' Returns the number of blocks, readings, and bytes of blocks.'''
+        self.c.execute('SELECT COUNT(*), IFNULL(SUM(readings), 0), '
+                       'IFNULL(SUM(LENGTH(block)), 0) FROM archive_blocks;')
+        return (self.c.fetchone())
+
+    def close(self):
+        self.conn.close()
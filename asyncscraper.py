@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+asyncscraper.py
+
+Asynchronous version of the Scraper() class in scraper.py. The API calls for
+different sensors or managed spaces are made at the same time over one shared
+HTTP session (up to 'max_concurrency' at once), instead of one after the
+other, and the outputs are the same dataframes as those from Scraper().
+
+Requires the 'aiohttp' package:
+    pip install aiohttp
+
+Use it as an async context manager, which logs in and closes the session:
+
+    import asyncio
+    from asyncscraper import AsyncScraper
+
+    async def get_data():
+        async with AsyncScraper() as smart_building:
+            return (await smart_building.sensor_reading_after())
+
+    sensor_reading_after_data, sensor_numbers = asyncio.run(get_data())
+
+"""
+import asyncio
+import datetime as dt
+import pandas as pd
+from scraper import Scraper
+import sys
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncScraper(Scraper):
+    '''Obtains login details and stores data associated with the account, as
+    Scraper() does, with coroutines in place of the methods which call the
+    API. The plotting methods of Scraper() can be used with data passed in.
+    '''
+
+    def __init__(self, login=True, max_concurrency=16):
+
+        if aiohttp is None:
+            raise ImportError("AsyncScraper requires the 'aiohttp' package "
+                              "(pip install aiohttp).")
+
+        self.login = login
+        self.max_concurrency = max_concurrency
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return (self)
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        ''' Logs in, then gets the contract, customer, managed space, sensor
+        location, and room info at the same time. If anything fails, the
+        session is closed before the error is raised (__aexit__() is not
+        called when __aenter__() raises).'''
+
+        self.username, self.password = Scraper._ask_login(self.login)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self.username, self.password),
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+
+        try:
+            # Use 'building' API function to check username and password.
+            status_code, building_json = await self._get_json('building/')
+            if not 200 <= status_code < 300:
+                raise Exception(
+                    'Problem logging in. Response code: {} (success = 200).'
+                    .format(status_code))
+            self.building_info = Scraper._building_info(building_json)
+
+            self.contract_info, self.customer_info, \
+                self.managed_space_info, self.sensor_location_info, \
+                self.room_info = await asyncio.gather(
+                    self.get_contract_info(), self.get_customer_info(),
+                    self.get_managed_space_info(),
+                    self.get_sensor_location_info(), self.get_room_info())
+        except BaseException:
+            await self.close()
+            raise
+        print("Contract, customer, managed space, sensor location, and room "
+              "data retrieved successfully.")
+
+        # lookups of API ids to managed space and sensor numbers
+        self.space_number_by_id = dict(zip(
+            self.managed_space_info['id'], self.managed_space_info.index))
+        self.sensor_number_by_id = dict(zip(
+            self.sensor_location_info['id'], self.sensor_location_info.index))
+
+    async def close(self):
+        ''' Closes the HTTP session.'''
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _get_json(self, function_name):
+        ''' Calls the API function and returns the status code and the json
+        (None if the call failed).'''
+        url = 'https://console.beringar.co.uk/api/{}'.format(function_name)
+        async with self.semaphore:
+            async with self.session.get(url) as response:
+                if 200 <= response.status < 300:
+                    return (response.status,
+                            Scraper._decode_json(await response.read()))
+                return (response.status, None)
+
+    async def _call_API(self, function_name):
+        ''' As Scraper._call_API(): returns the json as a dataframe, or raises
+        an IOError if the call failed.'''
+        status_code, response_json = await self._get_json(function_name)
+        if 200 <= status_code < 300:
+            return (Scraper._response_to_dataframe(response_json))
+
+        print('API call failed with code: {}.'.format(status_code))
+        raise IOError("Call to the API failed ({}) on url: '{}'".format(
+            status_code, function_name))
+
+    async def _get_info(self, function_name, index_name):
+        ''' Returns the info from the API function with the index named.'''
+        info = await self._call_API(function_name)
+        info.index.name = index_name
+        return (info)
+
+    async def get_contract_info(self):
+        '''Get all contract info associated with account.'''
+        return (await self._get_info("contract", "contractnumber"))
+
+    async def get_customer_info(self):
+        '''Get all customer info associated with account.'''
+        return (await self._get_info("customer", "customernumber"))
+
+    async def get_sensor_location_info(self):
+        '''Get all sensor location info associated with your account.'''
+        return (await self._get_info("sensorlocation", "sensornumber"))
+
+    async def get_room_info(self):
+        '''Get all room info associated with your account.'''
+        return (await self._get_info("room", "roomnumber"))
+
+    async def get_managed_space_info(self, building_number=1):
+        ''' Get all managed spaces associated with your account. Requires
+        building number from self.building_info - default = 1.'''
+        building_id = self.building_info['id'].loc[building_number]
+        return (await self._get_info(
+            'managedspace/building/{0}'.format(building_id), "spacenumber"))
+
+    @staticmethod
+    def _after_inputs(numbers, all_numbers, timestamp_epoch_millisec,
+                      info_name):
+        ''' Checks the numbers and sets the defaults for the 'after'
+        functions, as Scraper.sensor_reading_after() does.'''
+
+        if isinstance(numbers, int):
+            numbers = [numbers]
+
+        if numbers is None:
+            numbers = all_numbers
+
+        for i in numbers:
+            if i not in all_numbers:
+                sys.exit('\nBad index in input list: {}. Check self.{} for '
+                         'list.'.format(str(i), info_name))
+
+        # Default time is 1100 minutes from when call was made. This is usually
+        # enough to get 1000 data points for each sensor.
+        if timestamp_epoch_millisec is None:
+            timestamp_epoch_millisec = Scraper._time_now()-66000000
+
+        return (numbers, timestamp_epoch_millisec)
+
+    async def _gather_API(self, function_names):
+        ''' Calls the API functions at the same time. Returns the dataframes
+        (or exceptions) in the same order.'''
+        return (await asyncio.gather(
+            *[self._call_API(function_name)
+              for function_name in function_names],
+            return_exceptions=True))
+
+    async def managed_space_after(self, managed_space_numbers=None,
+                                  timestamp_epoch_millisec=None):
+        ''' As Scraper.managed_space_after(), with the calls for all managed
+        spaces made at the same time.'''
+
+        managed_space_numbers, timestamp_epoch_millisec = \
+            AsyncScraper._after_inputs(managed_space_numbers,
+                                       list(self.managed_space_info.index),
+                                       timestamp_epoch_millisec,
+                                       'managed_space_info')
+
+        print('\nGetting managed space after data from API.\nMs time epoch '
+              'used for input: {}. Input in ISO format: {}.'
+              .format(timestamp_epoch_millisec,
+                      dt.datetime.utcfromtimestamp(
+                          int(timestamp_epoch_millisec / 1000)).isoformat()))
+
+        spaces = self.managed_space_info.loc[managed_space_numbers]
+        responses = await self._gather_API(
+            ["beta/managedspace/spacelocation/{}/after/{}"
+             .format(space_id, timestamp_epoch_millisec)
+             for space_id in spaces['id']])
+
+        managed_space_after_data = []
+        managed_spaces = []
+        for space_num, space_name, response in zip(
+                managed_space_numbers, spaces['name'], responses):
+            if isinstance(response, Exception):
+                print('Managed space number {}: {}. PROBLEM AQUIRING '
+                      'DATA. Error: {}'.format(space_num, space_name,
+                                               str(response)))
+            elif not isinstance(response, pd.DataFrame):
+                print('Managed space number {}: {}. NO DATA RETURNED.'
+                      .format(space_num, space_name))
+            else:
+                response['spacenumber'] = space_num
+                managed_space_after_data.append(response)
+                managed_spaces.append(space_num)
+                print('Managed space number {}: {}. Successfully aquired'
+                      ' {} rows of data.'
+                      .format(space_num, space_name, len(response)))
+
+        print('Data successfully aquired from {} of {} possible managed '
+              'space(s).'
+              .format(len(managed_spaces), len(managed_space_numbers)))
+
+        return (managed_space_after_data, managed_spaces)
+
+    async def managed_space_latest(self, building_number=1):
+        ''' As Scraper.managed_space_latest().'''
+
+        print('\nGetting latest managed space data from API.')
+        managed_space_latest_data = await self._call_API(
+            "managedspace/latest/building/{}".format(
+                self.building_info['id'].loc[building_number]))
+
+        return (self._managed_space_latest_frame(managed_space_latest_data))
+
+    async def sensor_reading_after(self, sensor_numbers=None,
+                                   timestamp_epoch_millisec=None):
+        ''' As Scraper.sensor_reading_after(), with the calls for all sensors
+        made at the same time.'''
+
+        sensor_numbers, timestamp_epoch_millisec = \
+            AsyncScraper._after_inputs(sensor_numbers,
+                                       list(self.sensor_location_info.index),
+                                       timestamp_epoch_millisec,
+                                       'sensor_location_info')
+
+        print('\nGetting sensor reading after data from API.\nMs time epoch '
+              'used for input: {}. Input in ISO format: {}.'
+              .format(timestamp_epoch_millisec,
+                      dt.datetime.utcfromtimestamp(
+                          int(timestamp_epoch_millisec / 1000)).isoformat()))
+
+        sensors = self.sensor_location_info.loc[sensor_numbers]
+        responses = await self._gather_API(
+            ["beta/sensorreading/sensorlocation/{}/after/{}"
+             .format(sensor_id, timestamp_epoch_millisec)
+             for sensor_id in sensors['id']])
+
+        sensor_reading_after_data = []
+        sensor_locations = []
+        for sensor_num, sensor_name, response in zip(
+                sensor_numbers, sensors['name'], responses):
+            if isinstance(response, Exception):
+                print("Sensor number {}: {}. PROBLEM AQUIRING "
+                      "DATA. Error: {}".format(sensor_num, sensor_name,
+                                               str(response)))
+            elif not isinstance(response, pd.DataFrame):
+                print('Sensor number {}: {}. NO DATA RETURNED.'
+                      .format(sensor_num, sensor_name))
+            else:
+                sensor_reading_after_data.append(
+                    self._sensor_reading_after_frame(response, sensor_num))
+                sensor_locations.append(sensor_num)
+                print('Sensor number {}: {}. Successfully aquired'
+                      ' {} rows of data.'
+                      .format(sensor_num, sensor_name, len(response)))
+
+        print('Data successfully aquired from {} of {} possible sensor '
+              'location(s).'
+              .format(len(sensor_locations), len(sensor_numbers)))
+
+        return (sensor_reading_after_data, sensor_locations)
+
+    async def sensor_reading_latest(self, building_number=1):
+        ''' As Scraper.sensor_reading_latest().'''
+
+        print('\nGetting latest sensor reading data from API.')
+        sensor_reading_latest_data = await self._call_API(
+            "sensorreading/latest/building/{}".format(
+                self.building_info['id'].loc[building_number]))
+
+        return (self._sensor_reading_latest_frame(sensor_reading_latest_data))
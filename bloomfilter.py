@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+bloomfilter.py
+
+A Bloom filter of the readings in the database, keyed on (sensorlocation,
+timestampms), used by database.py to find duplicates as readings are
+inserted. Checking a reading against the filter takes the same time however
+many readings are stored. A reading which is not in the filter is certainly
+not in the database, so it can go straight to the insert. A reading which is
+in the filter is probably in the database (about 1% of new readings are
+false hits), so only these are checked against the database.
+
+The filter is saved next to database.db as 'database.bloom', with the ingest
+watermark of the database at the time (see Database._mark_ingest()). When
+database.py starts, the file is mapped into memory rather than read, so only
+the parts of it used to check and add readings are read or written, and
+saving after each insert writes back only those parts and the watermark. The
+filter is only rebuilt from the readings if the file is missing, is full, or
+was saved at a different watermark (i.e. readings were inserted without it).
+A rebuild is sized from the number of readings stored, and hashes the keys in
+whole arrays with NumPy, reading them in chunks rather than keeping them in
+memory.
+
+"""
+import hashlib
+import mmap
+import numpy as np
+import os
+import struct
+
+
+class BloomFilter():
+    '''Bit array and hashing of the Bloom filter, and saving and loading it.
+    '''
+
+    # file holding the filter, next to database.db
+    file_name = './database.bloom'
+
+    # bits per reading and number of hashes, for about 1% false hits
+    bits_per_key = 10
+    hashes = 7
+
+    # smallest number of readings the filter is sized for
+    min_capacity = 1000000
+
+    # header of the file: format name, bits, hashes, readings added,
+    # capacity, and ingest watermark
+    header = struct.Struct('<8sQQQQq')
+    magic = b'SBBLOOM1'
+
+    def __init__(self, capacity=None):
+
+        capacity = max(capacity or 0, BloomFilter.min_capacity)
+        self.capacity = capacity
+        self.bits = capacity * BloomFilter.bits_per_key
+        self.array = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+        self.watermark = 0
+
+        # the open file and its mapping, once saved or loaded
+        self.file = None
+        self.mapping = None
+
+    @staticmethod
+    def _sensor_hashes(sensorlocations):
+        ''' Returns a stable 64 bit hash of each sensor id (uint64 array).
+        Each different id is only hashed once.'''
+        ids, positions = np.unique(np.asarray(sensorlocations, dtype=str),
+                                   return_inverse=True)
+        hashes = np.array([int.from_bytes(hashlib.blake2b(
+            sensor_id.encode('utf-8'), digest_size=8).digest(), 'little')
+            for sensor_id in ids], dtype=np.uint64)
+        return (hashes[positions.reshape(-1)])
+
+    @staticmethod
+    def _mix(values):
+        ''' Mixes the bits of uint64 values (the splitmix64 finaliser).'''
+        values = values ^ (values >> np.uint64(30))
+        values = values * np.uint64(0xbf58476d1ce4e5b9)
+        values = values ^ (values >> np.uint64(27))
+        values = values * np.uint64(0x94d049bb133111eb)
+        return (values ^ (values >> np.uint64(31)))
+
+    def _positions(self, sensorlocations, timestamps):
+        ''' Returns the bit positions (keys x hashes) of each key, by double
+        hashing.'''
+        keys = BloomFilter._sensor_hashes(sensorlocations) ^ \
+            (np.asarray(timestamps, dtype=np.int64).view(np.uint64) *
+             np.uint64(0x9e3779b97f4a7c15))
+        first = BloomFilter._mix(keys)
+        step = BloomFilter._mix(first ^ np.uint64(0x632be59bd9b4e019)) | \
+            np.uint64(1)
+        hashes = np.arange(BloomFilter.hashes, dtype=np.uint64)
+        return ((first[:, None] + hashes * step[:, None]) %
+                np.uint64(self.bits))
+
+    def add(self, sensorlocations, timestamps):
+        ''' Adds the readings with the sensor ids and ms times (arrays).'''
+        if not len(timestamps):
+            return
+        positions = self._positions(sensorlocations, timestamps).reshape(-1)
+        np.bitwise_or.at(self.array, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7))
+                         .astype(np.uint8))
+        self.count += len(timestamps)
+
+    def might_contain(self, sensorlocations, timestamps):
+        ''' Returns a boolean array which is False for each reading which is
+        certainly not in the filter, and True for readings which probably
+        are.'''
+        if not len(timestamps):
+            return (np.zeros(0, dtype=bool))
+        positions = self._positions(sensorlocations, timestamps)
+        set_bits = self.array[positions >> np.uint64(3)] & \
+            np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return ((set_bits != 0).all(axis=1))
+
+    def is_full(self):
+        ''' Returns True if more readings have been added than the filter
+        was sized for, so that false hits are more common.'''
+        return (self.count > self.capacity)
+
+    def _header(self):
+        ''' Returns the header of the file for the filter.'''
+        return (BloomFilter.header.pack(
+            BloomFilter.magic, self.bits, BloomFilter.hashes, self.count,
+            self.capacity, self.watermark))
+
+    def _map(self):
+        ''' Maps the saved file into memory and uses it as the bit array,
+        so that changes to the bits are written to the file.'''
+        self.file = open(BloomFilter.file_name, 'r+b')
+        self.mapping = mmap.mmap(self.file.fileno(), 0)
+        self.array = np.frombuffer(self.mapping, dtype=np.uint8,
+                                   offset=BloomFilter.header.size)
+
+    def save(self, watermark):
+        ''' Saves the filter with the ingest watermark of the database. The
+        first time, the file is written in full and replaced in one step, so
+        it is never left half written, and is then mapped into memory. After
+        that only the changed parts of the file and the header are written.
+        '''
+        self.watermark = watermark
+        if self.mapping is not None:
+            # bits first, so the header never has a watermark for bits
+            # which are not in the file yet
+            self.mapping.flush()
+            self.mapping[:BloomFilter.header.size] = self._header()
+            self.mapping.flush(0, mmap.PAGESIZE)
+            return
+
+        temporary = BloomFilter.file_name + '.tmp'
+        with open(temporary, 'wb') as bloom_file:
+            bloom_file.write(self._header())
+            bloom_file.write(self.array.tobytes())
+        os.replace(temporary, BloomFilter.file_name)
+        self._map()
+
+    @staticmethod
+    def load():
+        ''' Returns the saved filter, mapped into memory, or None if there
+        is no file or it cannot be read.'''
+        try:
+            with open(BloomFilter.file_name, 'rb') as bloom_file:
+                magic, bits, hashes, count, capacity, watermark = \
+                    BloomFilter.header.unpack(
+                        bloom_file.read(BloomFilter.header.size))
+            size = os.path.getsize(BloomFilter.file_name)
+        except (OSError, struct.error):
+            return (None)
+        if magic != BloomFilter.magic or hashes != BloomFilter.hashes or \
+                size != BloomFilter.header.size + (bits + 7) // 8:
+            return (None)
+
+        bloom_filter = BloomFilter.__new__(BloomFilter)
+        bloom_filter.capacity = capacity
+        bloom_filter.bits = bits
+        bloom_filter.count = count
+        bloom_filter.watermark = watermark
+        bloom_filter._map()
+        return (bloom_filter)
+
+    def close(self):
+        ''' Closes the saved file. The filter cannot be used after this.'''
+        if self.mapping is None:
+            return
+        self.array = None
+        self.mapping.close()
+        self.file.close()
+        self.mapping = None
+        self.file = None
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+check_import_time.py
+
+Checks the time taken to import database.py, the entry point for adding
+readings (e.g. python database.py -r from a scheduled task), and
+databaseplot.py, which queryservice.py and analytics.py import, against a
+budget. The HTTP, password, and plotting modules are only imported by
+scraper.py and databaseplot.py when they are first used, so importing either
+should not load them.
+
+Each import is timed in a new Python process, so nothing is already loaded,
+and the best of a few runs is compared with the budget. From the directory
+containing database.py enter:
+
+    python check_import_time.py
+
+It exits with status 1 if the import takes longer than the budget or loads
+one of the modules it should not.
+
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+# most seconds each import may take (best of the runs)
+budget_seconds = 0.6
+
+# modules to time
+checked_modules = ['database', 'databaseplot']
+
+# modules which the checked modules must not load
+deferred_modules = ['matplotlib', 'requests', 'aiohttp']
+
+
+def import_time(module='database'):
+    ''' Imports 'module' in a new Python process. Returns the seconds taken
+    and the list of deferred modules which were loaded.'''
+
+    code = ('import sys, time\n'
+            'start = time.perf_counter()\n'
+            'import {}\n'
+            'print(time.perf_counter() - start)\n'
+            'print(",".join(name for name in {!r} if name in sys.modules))'
+            .format(module, deferred_modules))
+    result = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds, loaded = result.stdout.splitlines()[-2:]
+    return (float(seconds), [name for name in loaded.split(',') if name])
+
+
+def check(runs=3, budget=budget_seconds):
+    ''' Times importing each of 'checked_modules' 'runs' times and prints
+    the results. Returns True if the best time of each is within the budget
+    and no deferred modules were loaded.'''
+
+    passed = True
+    for module in checked_modules:
+        times = []
+        loaded = set()
+        for _ in range(runs):
+            seconds, modules = import_time(module)
+            times.append(seconds)
+            loaded.update(modules)
+
+        print('import {}: best {:.3f} s of {} runs (budget {:.3f} s).'
+              .format(module, min(times), runs, budget))
+        if loaded:
+            print('import {} loaded {}, which should only be imported '
+                  'when first used.'.format(module, ', '.join(sorted(loaded))))
+        passed = passed and min(times) <= budget and not loaded
+    return (passed)
+
+
+# %% Program starts here
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', dest='runs', type=int, default=3,
+                        help="Number of times to import each module")
+    parser.add_argument('-b', '--budget', dest='budget', type=float,
+                        default=budget_seconds,
+                        help="Most seconds the import may take")
+    args = parser.parse_args()
+
+    if not check(args.runs, args.budget):
+        sys.exit(1)
@@ -0,0 +1,109 @@
+-- Convert 'database.db' to the compact storage layout.
+-- Run this once on a database created with create_database.sql (new or
+-- already populated) using the following command on the command-line:
+--     sqlite3 database.db < compact_database.sql
+-- or from python with:
+--     python database.py -c
+--
+-- In the compact layout each reading is stored as a small integer sensor key,
+-- the integer ms time of the reading, and the numeric measurements. Names and
+-- sensor location ids are resolved by a join against 'sensors'. A view called
+-- 'sensor_readings' with the original columns replaces the old table so that
+-- existing queries (e.g. in databaseplot.py) keep working.
+
+BEGIN;
+
+-- Give every sensor a small integer key. Sensors which only appear in the
+-- readings (metadata never inserted) are added first so none are lost.
+ALTER TABLE sensors ADD COLUMN sensor_key INTEGER;
+
+INSERT OR IGNORE INTO sensors (sensor_id, sensor_number, sensor_name)
+	SELECT sensorlocation, MAX(sensor_number), MAX(sensor_name)
+	FROM sensor_readings
+	WHERE sensorlocation IS NOT NULL
+	GROUP BY sensorlocation;
+
+UPDATE sensors SET sensor_key = rowid;
+
+CREATE UNIQUE INDEX sensors_sensor_key ON sensors(sensor_key);
+
+-- New sensors are given the next free key when they are inserted
+CREATE TRIGGER sensors_assign_key AFTER INSERT ON sensors
+WHEN NEW.sensor_key IS NULL
+BEGIN
+	UPDATE sensors
+	SET sensor_key = (SELECT IFNULL(MAX(sensor_key), 0) + 1 FROM sensors)
+	WHERE sensor_id = NEW.sensor_id;
+END;
+
+-- The compact table. The primary key means one reading per sensor per ms
+-- time, and keeps the readings for each sensor together in time order.
+CREATE TABLE sensor_readings_compact(
+	sensor_key INTEGER NOT NULL,
+	timestampms INTEGER NOT NULL, -- THIS IS TIME OF SENSOR READING
+	co2 INTEGER,
+	humidity FLOAT,
+	lux INTEGER,
+	noise INTEGER,
+	occupancy INTEGER,
+	pressure INTEGER,
+	temperature FLOAT,
+	voc INTEGER,
+	PRIMARY KEY (sensor_key, timestampms),
+	FOREIGN KEY (sensor_key) REFERENCES sensors(sensor_key)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO sensor_readings_compact (sensor_key, timestampms, co2,
+	humidity, lux, noise, occupancy, pressure, temperature, voc)
+	SELECT s.sensor_key, CAST(r.timestampms AS INTEGER), r.co2, r.humidity,
+		r.lux, r.noise, r.occupancy, r.pressure, r.temperature, r.voc
+	FROM sensor_readings r
+	JOIN sensors s ON s.sensor_id = r.sensorlocation;
+
+DROP TABLE sensor_readings;
+
+-- Compatibility view with the columns of the original table. 'time' (the
+-- time of the API call) is not kept in the compact layout. Once the database
+-- is partitioned by month (python database.py -p) the view only shows the
+-- readings still in database.db, as views cannot refer to the partition
+-- files, and inserts through it are refused.
+CREATE VIEW sensor_readings AS
+	SELECT
+		s.sensor_number AS sensor_number,
+		s.sensor_name AS sensor_name,
+		r.co2 AS co2,
+		r.humidity AS humidity,
+		r.lux AS lux,
+		r.noise AS noise,
+		r.occupancy AS occupancy,
+		r.pressure AS pressure,
+		s.sensor_id AS sensorlocation,
+		r.temperature AS temperature,
+		strftime('%Y-%m-%d %H:%M:%f+00:00', r.timestampms / 1000.0,
+			'unixepoch') AS timestamputc,
+		r.timestampms AS timestampms,
+		r.voc AS voc,
+		NULL AS time
+	FROM sensor_readings_compact r
+	JOIN sensors s ON s.sensor_key = r.sensor_key;
+
+-- Inserts into the view are written to the compact table
+CREATE TRIGGER sensor_readings_insert INSTEAD OF INSERT ON sensor_readings
+BEGIN
+	INSERT OR IGNORE INTO sensors (sensor_id, sensor_number, sensor_name)
+		VALUES (NEW.sensorlocation, NEW.sensor_number, NEW.sensor_name);
+	INSERT OR IGNORE INTO sensor_readings_compact (sensor_key, timestampms,
+		co2, humidity, lux, noise, occupancy, pressure, temperature, voc)
+		VALUES ((SELECT sensor_key FROM sensors
+				 WHERE sensor_id = NEW.sensorlocation),
+			CAST(NEW.timestampms AS INTEGER), NEW.co2, NEW.humidity, NEW.lux,
+			NEW.noise, NEW.occupancy, NEW.pressure, NEW.temperature, NEW.voc);
+END;
+
+COMMIT;
+
+-- Give the space used by the old table back to the file system. Incremental
+-- vacuum lets space from deleted readings be given back in small steps later
+-- (see Database.downsample_database() in database.py).
+PRAGMA auto_vacuum = INCREMENTAL;
+VACUUM;
@@ -58,6 +58,95 @@ CREATE TABLE sensor_readings(
 	FOREIGN KEY (sensorlocation) REFERENCES sensors(sensor_id)
 );
 
+-- Used to look up possible duplicates when readings are inserted
+CREATE INDEX sensor_readings_location_time 
+	ON sensor_readings(sensorlocation, timestampms);
 
+-- A table for managed space readings (occupancy of each managed space). The 
+-- primary key means one reading per space per ms time, so repeated readings 
+-- are ignored.
 
+CREATE TABLE managed_space_readings(
+	space_id VARCHAR(255) NOT NULL,
+	space_number INTEGER,
+	space_name VARCHAR(255),
+	occupancy INTEGER,
+	timestamputc VARCHAR(255),
+	timestampms INTEGER NOT NULL, -- THIS IS TIME OF READING
+	time INT, -- THIS IS TIME OF CALL
+	PRIMARY KEY (space_id, timestampms)
+);
+
+CREATE INDEX managed_space_readings_number
+	ON managed_space_readings(space_number, timestampms);
+CREATE INDEX managed_space_readings_time
+	ON managed_space_readings(timestampms);
+
+-- The times covered by the readings of each sensor, kept up to date by 
+-- database.py as readings are inserted. Each row is an interval over which 
+-- the sensor has readings no more than 5 minutes apart, so gaps can be found 
+-- without reading the readings (python database.py -g FROM TO).
+
+CREATE TABLE sensor_coverage(
+	sensorlocation VARCHAR(255) NOT NULL,
+	time_from INTEGER NOT NULL, -- FIRST READING
+	time_to INTEGER NOT NULL, -- LAST READING
+	PRIMARY KEY (sensorlocation, time_from)
+) WITHOUT ROWID;
+
+CREATE INDEX sensor_coverage_time_to
+	ON sensor_coverage(sensorlocation, time_to);
+
+-- Moving statistics of each sensor and parameter, and the events for unusual 
+-- readings found as readings are inserted (see anomalies.py).
+
+CREATE TABLE sensor_statistics(
+	sensorlocation VARCHAR(255) NOT NULL,
+	parameter VARCHAR(255) NOT NULL,
+	mean FLOAT,
+	variance FLOAT,
+	count INTEGER, -- READINGS INCLUDED
+	timestampms INTEGER, -- TIME OF LAST READING
+	breach VARCHAR(255), -- BREACH OF LAST READING, IF ANY
+	PRIMARY KEY (sensorlocation, parameter)
+) WITHOUT ROWID;
+
+CREATE TABLE events(
+	event_id INTEGER PRIMARY KEY,
+	sensorlocation VARCHAR(255) NOT NULL,
+	sensor_number INTEGER,
+	parameter VARCHAR(255) NOT NULL,
+	timestampms INTEGER NOT NULL, -- TIME OF READING
+	kind VARCHAR(255) NOT NULL, -- 'above', 'below' OR 'z'
+	value FLOAT,
+	limit_value FLOAT, -- THRESHOLD, OR THE Z-SCORE LIMIT
+	mean FLOAT, -- MOVING MEAN BEFORE THE READING
+	std FLOAT, -- MOVING STANDARD DEVIATION
+	UNIQUE (sensorlocation, parameter, timestampms, kind)
+);
+
+CREATE INDEX events_time ON events(timestampms);
+CREATE INDEX events_sensor ON events(sensor_number, timestampms);
+
+-- Quantile sketches of the readings of each sensor, parameter, and hour, kept 
+-- up to date as readings are inserted (see sketches.py).
+
+CREATE TABLE sensor_sketches(
+	sensorlocation VARCHAR(255) NOT NULL,
+	parameter VARCHAR(255) NOT NULL,
+	hour INTEGER NOT NULL, -- MS TIME OF START OF THE HOUR
+	keys BLOB, -- INT16 BUCKET KEYS
+	counts BLOB, -- INT32 READINGS IN EACH BUCKET
+	PRIMARY KEY (sensorlocation, parameter, hour)
+) WITHOUT ROWID;
+
+-- Total occupancy and minutes with readings of each sensor for each hour of 
+-- the week (UTC, 0 is Monday 00:00), kept up to date as readings are inserted.
 
+CREATE TABLE occupancy_cube(
+	sensorlocation VARCHAR(255) NOT NULL,
+	hour_of_week INTEGER NOT NULL, -- DAY OF WEEK * 24 + HOUR
+	occupancy_sum FLOAT, -- SUM OF THE MEAN OCCUPANCY OF EACH MINUTE
+	minutes INTEGER, -- MINUTES WITH AN OCCUPANCY READING
+	PRIMARY KEY (sensorlocation, hour_of_week)
+) WITHOUT ROWID;
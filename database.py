@@ -21,10 +21,19 @@ https://docs.python.org/3/library/sqlite3.html
 
 """
 
+from anomalies import AnomalyDetector
+from archive import Archive
+from bloomfilter import BloomFilter
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 from scraper import Scraper
+from partitions import Partitions
+import numpy as np
 import pandas as pd
+from sketches import QuantileSketch
 import argparse
+import datetime as dt
+import sys
 
 
 # %%
@@ -32,10 +41,36 @@ class Database():
     '''Obtains details of existing database entries.
     '''
 
+    # measurements stored for each reading
+    param_list = ['occupancy', 'voc', 'co2', 'temperature', 'pressure',
+                  'humidity', 'lux', 'noise']
+
+    # readings further apart than this (ms) leave a gap in the coverage of a
+    # sensor (readings are usually one minute apart)
+    max_reading_gap = 300000
+
     def __init__(self):
 
         self.conn, self.c = Database._connect_to_database()
-        self.existing_readings = Database._retrieve_existing_readings(self)
+        self.compact = Database._is_compact(self.c)
+        self.partitions = None
+        if self.compact:
+            self.sensor_keys = self._retrieve_sensor_keys()
+            if Partitions.enabled(self.conn):
+                self.partitions = Partitions(self.conn)
+                Database._stop_view_inserts(self.c)
+        if not self.compact:
+            Database._create_reading_index(self.c)
+        Database._create_managed_space_table(self.c)
+        Database._create_storage_info(self.c)
+        self.archive = None
+        self.dedup_filter = self._load_dedup_filter()
+        if Database._create_coverage_table(self.c):
+            self._build_coverage()
+        self.detector = AnomalyDetector(self.conn)
+        QuantileSketch.create_table(self.c)
+        if Database._create_occupancy_cube(self.c):
+            Database.build_occupancy_cube(self.conn, self.partitions)
         self.smart_building = Scraper()
 
     @staticmethod
@@ -47,62 +82,743 @@ class Database():
         c = conn.cursor()
         return(conn, c)
 
-    def _retrieve_existing_readings(self):
-        '''Obtains details of existing database entries to check against.
-        Returns a dataframe containing a list of existing time readings and
-        corresponding sensor numbers
-        '''
+    @staticmethod
+    def _is_compact(c):
+        '''Returns True if the database uses the compact layout (see
+        compact_database.sql), where 'sensor_readings' is a view over
+        'sensor_readings_compact'.'''
+        c.execute("SELECT type FROM sqlite_master "
+                  "WHERE name = 'sensor_readings';")
+        result = c.fetchone()
+        return(result is not None and result[0] == 'view')
 
-        try:
-            existing_readings = pd.read_sql('SELECT timestampms, '
-                                            'sensorlocation '
-                                            'FROM sensor_readings '
-                                            'ORDER BY timestamputc;',
-                                            self.conn)
-            # TODO: Check functioning properly and checking the right thing
-            if any(existing_readings.applymap(type) == bytes):
-                print("Database contains timestamps in 'bytes' format when "
-                      "they should be int64.")
-            return(existing_readings)
-        except Exception as e:
-            print("Error: ", e)
-
-    def insert_row(self, row):
-        try:
-            check = self.c.execute('INSERT INTO sensor_readings (time, '
-                                   'timestampms, timestamputc, sensor_number, '
-                                   'sensor_name, co2, humidity, lux, noise, '
-                                   'occupancy, pressure, sensorlocation, '
-                                   'temperature, voc) VALUES'
-                                   '(strftime(?,?),?,?,?,?,?,?,?,?,?,?,?,?,?)',
-                                   ['%s', 'now', row['timestampms'], 
-                                    str(row['timestamputc']),
-                                        row['sensornumber'],
-                                        row['name'],
-                                        row['co2'], row['humid'], row['lux'], 
-                                        row['noise'],
-                                        row['occupancy'], row['pressure'], 
-                                        row['sensorlocation'],
-                                        row['temperature'], row['voc']])
-        except Exception as e:
-            print("Error: ", e)
-
-    def check_for_duplicates(self, row):
-        ''''Check whether sensor reading exists in database for this sensor 
-        and time (ms).'''
-        if self.existing_readings is None:
-            return(0)
+    @staticmethod
+    def compact_database(script='./compact_database.sql'):
+        '''Converts database.db to the compact layout by running
+        compact_database.sql. Existing readings are copied over, and a
+        'sensor_readings' view keeps the old columns available for queries.
+        '''
+        conn, c = Database._connect_to_database()
+        if Database._is_compact(c):
+            print('Database already uses the compact layout.')
         else:
-            test = self.existing_readings.loc[
-                (self.existing_readings['timestampms'] == \
-                 row['timestampms']) &
-                (self.existing_readings['sensorlocation'] == \
-                 row['sensorlocation'])]
-
-        if len(test) > 0:
-            return(1)
+            with open(script) as sql_file:
+                conn.executescript(sql_file.read())
+            print('Database converted to the compact layout.')
+        conn.close()
+
+    @staticmethod
+    def partition_database():
+        '''Turns on time-partitioned storage (see partitions.py). Readings in
+        the compact table of database.db are moved to one file per month in
+        './partitions/', and new readings are routed to these files by
+        timestampms. Requires the compact layout.
+        '''
+        conn, c = Database._connect_to_database()
+        if not Database._is_compact(c):
+            conn.close()
+            sys.exit('Database must use the compact layout before it can be '
+                     'partitioned. Run: python database.py -c')
+
+        Partitions.create_catalog(conn)
+        Database._stop_view_inserts(c)
+        conn.commit()
+        partitions = Partitions(conn)
+
+        # months which have readings in database.db
+        c.execute("SELECT DISTINCT 'readings_' || strftime('%Y_%m', "
+                  "timestampms / 1000, 'unixepoch') "
+                  "FROM sensor_readings_compact;")
+        partition_names = [row[0] for row in c.fetchall()]
+
+        for partition_name in sorted(partition_names):
+            time_from, time_to = Partitions.bounds(partition_name)
+            c.execute('SELECT COUNT(*) FROM sensor_readings_compact '
+                      'WHERE timestampms >= ? AND timestampms < ?;',
+                      [time_from, time_to])
+            count = c.fetchone()[0]
+            schema = partitions.attach(partition_name, create=True)
+            c.execute('INSERT OR IGNORE INTO {}.sensor_readings_compact '
+                      'SELECT * FROM sensor_readings_compact '
+                      'WHERE timestampms >= ? AND timestampms < ?;'
+                      .format(schema), [time_from, time_to])
+            c.execute('DELETE FROM sensor_readings_compact '
+                      'WHERE timestampms >= ? AND timestampms < ?;',
+                      [time_from, time_to])
+            conn.commit()
+            partitions.detach(partition_name)
+            print('Moved {} readings to partition {}.'
+                  .format(count, partition_name))
+
+        conn.commit()
+        conn.execute('VACUUM;')
+        conn.close()
+        print('Database partitioned by month.')
+
+    @staticmethod
+    def _stop_view_inserts(c):
+        '''Replaces the trigger which writes inserts into the 'sensor_readings'
+        view to the compact table in database.db, once the database is
+        partitioned. SQLite views and triggers cannot refer to the attached
+        partition files, so the view only shows the readings still in
+        database.db, and readings inserted through it would not be read.
+        Inserts through the view are refused instead (use database.py).'''
+        c.execute("SELECT sql FROM sqlite_master "
+                  "WHERE name = 'sensor_readings_insert';")
+        result = c.fetchone()
+        if result is not None and 'RAISE' in result[0]:
+            return
+        c.execute('DROP TRIGGER IF EXISTS sensor_readings_insert;')
+        c.execute("CREATE TRIGGER sensor_readings_insert "
+                  "INSTEAD OF INSERT ON sensor_readings "
+                  "BEGIN SELECT RAISE(ABORT, 'The database is partitioned by "
+                  "month, so readings cannot be inserted through the "
+                  "sensor_readings view. Insert them with database.py.'); "
+                  "END;")
+
+    @staticmethod
+    def _create_hourly_table(c):
+        '''Creates the table of hourly summaries used by downsample_database()
+        (if it does not exist), and the 'storage_info' table which records
+        the time before which readings have been summarised.'''
+        summary_columns = ''
+        for param in Database.param_list:
+            summary_columns += '{0}_min FLOAT, {0}_mean FLOAT, {0}_max FLOAT, ' \
+                .format(param)
+        c.execute('CREATE TABLE IF NOT EXISTS sensor_readings_hourly('
+                  'sensor_key INTEGER NOT NULL, '
+                  'timestampms INTEGER NOT NULL, '  # start of the hour
+                  'readings INTEGER, '  # number of raw readings summarised
+                  '{}'
+                  'PRIMARY KEY (sensor_key, timestampms)) WITHOUT ROWID;'
+                  .format(summary_columns))
+        Database._create_storage_info(c)
+
+    @staticmethod
+    def _create_storage_info(c):
+        '''Creates the 'storage_info' table of keys and integer values (if it 
+        does not exist). It records 'compacted_before' (see 
+        downsample_database()), 'archived_before' (see archive_database()),
+        and 'ingest_watermark', the ms time of the last insert of readings.
+        '''
+        c.execute('CREATE TABLE IF NOT EXISTS storage_info ('
+                  'key VARCHAR(255) PRIMARY KEY, value INTEGER);')
+
+    def _mark_ingest(self):
+        '''Records the time of the last insert of readings as 
+        'ingest_watermark' in 'storage_info' and commits. Readers (e.g. 
+        queryservice.py) can compare it to tell whether the data has 
+        changed. The duplicate filter is saved with the new watermark 
+        (only the parts of the file which changed are written), unless 
+        readings were inserted by something else since it was loaded. Then 
+        the file keeps its old watermark, so it is rebuilt next time.'''
+        up_to_date = self._ingest_watermark() == self.dedup_filter.watermark
+        self.c.execute("INSERT INTO storage_info (key, value) "
+                       "VALUES('ingest_watermark', ?) "
+                       "ON CONFLICT (key) DO UPDATE "
+                       "SET value = MAX(value, excluded.value);",
+                       [Scraper._time_now()])
+        self.conn.commit()
+        if up_to_date:
+            self.dedup_filter.save(self._ingest_watermark())
+
+    @staticmethod
+    def _create_reading_index(c):
+        '''Creates an index on the sensor and time of 'sensor_readings' in 
+        the original layout (if it does not exist), so that possible 
+        duplicates can be looked up without reading the whole table.'''
+        c.execute('CREATE INDEX IF NOT EXISTS sensor_readings_location_time '
+                  'ON sensor_readings(sensorlocation, timestampms);')
+
+    @staticmethod
+    def _create_managed_space_table(c):
+        '''Creates the table of managed space readings and its indexes (if 
+        they do not exist), for databases created before it was added to 
+        create_database.sql.'''
+        c.execute('CREATE TABLE IF NOT EXISTS managed_space_readings('
+                  'space_id VARCHAR(255) NOT NULL, '
+                  'space_number INTEGER, '
+                  'space_name VARCHAR(255), '
+                  'occupancy INTEGER, '
+                  'timestamputc VARCHAR(255), '
+                  'timestampms INTEGER NOT NULL, '  # time of reading
+                  'time INT, '  # time of call
+                  'PRIMARY KEY (space_id, timestampms));')
+        c.execute('CREATE INDEX IF NOT EXISTS managed_space_readings_number '
+                  'ON managed_space_readings(space_number, timestampms);')
+        c.execute('CREATE INDEX IF NOT EXISTS managed_space_readings_time '
+                  'ON managed_space_readings(timestampms);')
+
+    @staticmethod
+    def _create_coverage_table(c):
+        '''Creates the 'sensor_coverage' table and its index if they do not 
+        exist. Each row is a time interval (ms) over which a sensor has 
+        readings no more than Database.max_reading_gap apart, so the gaps are 
+        the times between the intervals. Returns True if the table was 
+        created.'''
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                  "AND name = 'sensor_coverage';")
+        if c.fetchone() is not None:
+            return(False)
+        c.execute('CREATE TABLE sensor_coverage('
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'time_from INTEGER NOT NULL, '  # first reading
+                  'time_to INTEGER NOT NULL, '  # last reading
+                  'PRIMARY KEY (sensorlocation, time_from)) WITHOUT ROWID;')
+        c.execute('CREATE INDEX sensor_coverage_time_to '
+                  'ON sensor_coverage(sensorlocation, time_to);')
+        return(True)
+
+    @staticmethod
+    def _create_occupancy_cube(c):
+        '''Creates the 'occupancy_cube' table if it does not exist. For each 
+        sensor and hour of the week (0 = Monday 00:00 to 01:00 UTC), it holds 
+        the sum of the mean occupancy in each minute with a reading, and the 
+        number of those minutes. Returns True if the table was created.'''
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                  "AND name = 'occupancy_cube';")
+        if c.fetchone() is not None:
+            return(False)
+        c.execute('CREATE TABLE occupancy_cube('
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'hour_of_week INTEGER NOT NULL, '
+                  'occupancy_sum FLOAT, '
+                  'minutes INTEGER, '
+                  'PRIMARY KEY (sensorlocation, hour_of_week)) WITHOUT ROWID;')
+        return(True)
+
+    @staticmethod
+    def _enable_incremental_vacuum(conn, schema='main'):
+        '''Turns on incremental vacuum for a database file so that space can
+        be given back in small steps. This takes one full VACUUM of the file,
+        so is only done the first time.'''
+        if conn.execute('PRAGMA {}.auto_vacuum;'.format(schema))\
+                .fetchone()[0] != 2:
+            print('Enabling incremental vacuum for {} (one-off VACUUM)...'
+                  .format(schema))
+            conn.commit()
+            conn.execute('PRAGMA {}.auto_vacuum = INCREMENTAL;'.format(schema))
+            conn.execute('VACUUM {};'.format(schema))
+
+    @staticmethod
+    def downsample_database(age_days, batch_hours=24, vacuum_pages=1000):
+        '''Rolls raw readings older than 'age_days' days into hourly
+        summaries (min, mean and max of each parameter, per sensor) in the
+        'sensor_readings_hourly' table, then deletes the raw readings.
+        Requires the compact layout.
+
+        Each sensor is processed in batches of 'batch_hours' hours. Every
+        batch is summarised, deleted, and committed on its own so the write
+        lock is only held briefly, and up to 'vacuum_pages' free pages are
+        given back to the file system after each batch. The summaries are
+        used by DatabasePlotter.retrieve_data() for times before the cut-off.
+        Running the job again with a later cut-off merges any readings 
+        inserted since into the summaries. Readings from before the cut-off 
+        are not inserted again by database.py (see _find_duplicates()), so 
+        backfilling cannot count them twice.
+        '''
+        conn, c = Database._connect_to_database()
+        if not Database._is_compact(c):
+            conn.close()
+            sys.exit('Database must use the compact layout before it can be '
+                     'downsampled. Run: python database.py -c')
+
+        Database._create_hourly_table(c)
+        conn.commit()
+
+        # cut-off rounded down to the start of the hour
+        cutoff = Scraper._time_now() - int(age_days * 86400000)
+        cutoff -= cutoff % 3600000
+        print('Summarising readings from before {} (ms: {}).'
+              .format(dt.datetime.utcfromtimestamp(cutoff / 1000)
+                      .isoformat(), cutoff))
+
+        # tables of raw readings: database.db, then any monthly partitions
+        # which start before the cut-off
+        sources = [('main', None)]
+        if Partitions.enabled(conn):
+            partitions = Partitions(conn)
+            sources += [(None, partition_name) for partition_name
+                        in partitions.overlapping(0, cutoff - 1)]
+
+        # hourly summary of one batch, merged with any existing summary
+        select_columns = ''
+        update_columns = ''
+        for param in Database.param_list:
+            select_columns += ', MIN({0}), AVG({0}), MAX({0})'.format(param)
+            update_columns += (
+                ', {0}_min = MIN(IFNULL({0}_min, excluded.{0}_min), '
+                'IFNULL(excluded.{0}_min, {0}_min))'
+                ', {0}_max = MAX(IFNULL({0}_max, excluded.{0}_max), '
+                'IFNULL(excluded.{0}_max, {0}_max))'
+                ', {0}_mean = IFNULL(({0}_mean * readings + '
+                'excluded.{0}_mean * excluded.readings) / '
+                '(readings + excluded.readings), '
+                'IFNULL({0}_mean, excluded.{0}_mean))'.format(param))
+        summarise = ('INSERT INTO sensor_readings_hourly '
+                     'SELECT sensor_key, timestampms / 3600000 * 3600000, '
+                     'COUNT(*){} FROM {{0}}.sensor_readings_compact '
+                     'WHERE sensor_key = ? AND timestampms >= ? '
+                     'AND timestampms < ? GROUP BY 1, 2 '
+                     'ON CONFLICT (sensor_key, timestampms) DO UPDATE SET '
+                     '{}, readings = readings + excluded.readings;'
+                     .format(select_columns, update_columns[2:]))
+
+        c.execute('SELECT sensor_key FROM sensors ORDER BY sensor_key;')
+        sensor_keys = [row[0] for row in c.fetchall()]
+
+        total = 0
+        for schema, partition_name in sources:
+            if partition_name is not None:
+                schema = partitions.attach(partition_name)
+            Database._enable_incremental_vacuum(conn, schema)
+
+            for sensor_key in sensor_keys:
+                while True:
+                    c.execute('SELECT MIN(timestampms) FROM '
+                              '{}.sensor_readings_compact '
+                              'WHERE sensor_key = ? AND timestampms < ?;'
+                              .format(schema), [sensor_key, cutoff])
+                    batch_from = c.fetchone()[0]
+                    if batch_from is None:
+                        break
+                    batch_from -= batch_from % 3600000
+                    batch_to = min(cutoff,
+                                   batch_from + batch_hours * 3600000)
+
+                    c.execute(summarise.format(schema),
+                              [sensor_key, batch_from, batch_to])
+                    c.execute('DELETE FROM {}.sensor_readings_compact '
+                              'WHERE sensor_key = ? AND timestampms >= ? '
+                              'AND timestampms < ?;'.format(schema),
+                              [sensor_key, batch_from, batch_to])
+                    total += c.rowcount
+                    conn.commit()
+                    c.execute('PRAGMA {}.incremental_vacuum({});'
+                              .format(schema, vacuum_pages)).fetchall()
+
+            print('Finished summarising readings in {}.'
+                  .format(partition_name or 'database.db'))
+
+        # record how far the summaries go, for DatabasePlotter
+        c.execute("INSERT INTO storage_info (key, value) "
+                  "VALUES('compacted_before', ?) "
+                  "ON CONFLICT (key) DO UPDATE "
+                  "SET value = MAX(value, excluded.value);", [cutoff])
+        conn.commit()
+        conn.close()
+        print('{} raw readings summarised into hourly readings.'
+              .format(total))
+
+    @staticmethod
+    def archive_database(age_days, vacuum_pages=1000):
+        '''Moves raw readings older than 'age_days' days (rounded down to
+        the start of the UTC day) into compressed blocks in archive.db, one
+        block per sensor per day (see archive.py), then deletes them from
+        database.db or its partitions. Requires the compact layout.
+
+        Each day of each sensor is written to the archive and committed
+        before its readings are deleted, and 'archived_before' is recorded
+        before the first delete, so if the job stops part way through no
+        readings are missing and it can be run again. Readings are kept in full, and are read
+        from the blocks by DatabasePlotter.retrieve_data(). Readings
+        inserted later for archived days are merged into the blocks the next
+        time the job is run.
+        '''
+        conn, c = Database._connect_to_database()
+        if not Database._is_compact(c):
+            conn.close()
+            sys.exit('Database must use the compact layout before it can be '
+                     'archived. Run: python database.py -c')
+
+        # cut-off rounded down to the start of the day
+        cutoff = Archive.day_of(Scraper._time_now() -
+                                int(age_days * 86400000))
+        print('Archiving readings from before {} (ms: {}).'
+              .format(dt.datetime.utcfromtimestamp(cutoff / 1000)
+                      .isoformat(), cutoff))
+
+        # tables of raw readings: database.db, then any monthly partitions
+        # which start before the cut-off
+        sources = [('main', None)]
+        if Partitions.enabled(conn):
+            partitions = Partitions(conn)
+            sources += [(None, partition_name) for partition_name
+                        in partitions.overlapping(0, cutoff - 1)]
+
+        archive = Archive()
+        c.execute('SELECT sensor_key, sensor_id FROM sensors '
+                  'ORDER BY sensor_key;')
+        sensors = c.fetchall()
+
+        # record how far the archive goes before any readings are deleted, 
+        # so DatabasePlotter reads the blocks even if the job stops part way
+        Database._create_storage_info(c)
+        c.execute("INSERT INTO storage_info (key, value) "
+                  "VALUES('archived_before', ?) "
+                  "ON CONFLICT (key) DO UPDATE "
+                  "SET value = MAX(value, excluded.value);", [cutoff])
+        conn.commit()
+
+        total = 0
+        for schema, partition_name in sources:
+            if partition_name is not None:
+                schema = partitions.attach(partition_name)
+            Database._enable_incremental_vacuum(conn, schema)
+
+            for sensor_key, sensor_id in sensors:
+                while True:
+                    c.execute('SELECT MIN(timestampms) FROM '
+                              '{}.sensor_readings_compact '
+                              'WHERE sensor_key = ? AND timestampms < ?;'
+                              .format(schema), [sensor_key, cutoff])
+                    batch_from = c.fetchone()[0]
+                    if batch_from is None:
+                        break
+                    batch_from = Archive.day_of(batch_from)
+                    batch_to = batch_from + Archive.ms_per_day
+
+                    readings = pd.read_sql(
+                        'SELECT timestampms, {} FROM '
+                        '{}.sensor_readings_compact WHERE sensor_key = ? '
+                        'AND timestampms >= ? AND timestampms < ?;'
+                        .format(', '.join(Database.param_list), schema),
+                        conn, params=[sensor_key, batch_from, batch_to])
+                    archive.write(sensor_id, readings)
+                    c.execute('DELETE FROM {}.sensor_readings_compact '
+                              'WHERE sensor_key = ? AND timestampms >= ? '
+                              'AND timestampms < ?;'.format(schema),
+                              [sensor_key, batch_from, batch_to])
+                    total += c.rowcount
+                    conn.commit()
+                    c.execute('PRAGMA {}.incremental_vacuum({});'
+                              .format(schema, vacuum_pages)).fetchall()
+
+            print('Finished archiving readings in {}.'
+                  .format(partition_name or 'database.db'))
+
+        conn.close()
+
+        blocks, readings, size = archive.size()
+        archive.close()
+        print('{} raw readings moved to archive.db, which holds {} readings '
+              'in {} blocks ({:.1f} bytes per reading).'
+              .format(total, readings, blocks, size / max(readings, 1)))
+
+    @staticmethod
+    def build_sketches(chunksize=100000):
+        '''Builds the quantile sketches (see sketches.py) from the raw 
+        readings already in the database, replacing any stored. After this 
+        they are kept up to date as readings are inserted. Readings in 
+        archive.db are included, but readings which have been replaced by 
+        hourly summaries are not.'''
+
+        conn, c = Database._connect_to_database()
+        QuantileSketch.create_table(c)
+        c.execute('DELETE FROM sensor_sketches;')
+        conn.commit()
+
+        columns = ('r.timestampms, r.co2, r.humidity AS humid, r.lux, '
+                   'r.noise, r.occupancy, r.pressure, r.temperature, r.voc')
+        compact_query = ('SELECT s.sensor_id AS sensorlocation, {} '
+                         'FROM {{}}sensor_readings_compact r '
+                         'JOIN sensors s ON s.sensor_key = r.sensor_key;'
+                         .format(columns))
+
+        # partitions (None for database.db) to read the readings from
+        partition_names = [None]
+        if Database._is_compact(c) and Partitions.enabled(conn):
+            c.execute('SELECT partition_name FROM partitions '
+                      'ORDER BY time_from;')
+            partition_names += [row[0] for row in c.fetchall()]
+        partitions = Partitions(conn)
+
+        total = 0
+        for partition_name in partition_names:
+            if not Database._is_compact(c):
+                query = ('SELECT sensorlocation, {} FROM sensor_readings r;'
+                         .format(columns))
+            elif partition_name is None:
+                query = compact_query.format('')
+            else:
+                query = compact_query.format(
+                    partitions.attach(partition_name) + '.')
+            for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+                QuantileSketch.update(conn, chunk)
+                total += len(chunk)
+
+        # readings moved to archive.db (see archive_database())
+        if Archive.exists():
+            archive = Archive(read_only=True)
+            for sensorlocation, timestamps, values in archive.blocks():
+                values['humid'] = values.pop('humidity')
+                QuantileSketch.update(conn, pd.DataFrame(
+                    dict(values, sensorlocation=sensorlocation, 
+                         timestampms=timestamps)))
+                total += len(timestamps)
+            archive.close()
+
+        conn.close()
+        print('Quantile sketches built from {} readings.'.format(total))
+
+    def _retrieve_sensor_keys(self):
+        '''Returns a dict of sensor id (sensorlocation) to the integer
+        sensor_key used by the compact layout.'''
+        self.c.execute('SELECT sensor_id, sensor_key FROM sensors;')
+        return(dict(self.c.fetchall()))
+
+    def _sensor_key(self, row):
+        '''Returns the sensor_key for the sensor in 'row', adding the sensor
+        to the 'sensors' table first if it is not there yet.'''
+        sensor_id = row['sensorlocation']
+        if sensor_id not in self.sensor_keys:
+            self.c.execute('INSERT OR IGNORE INTO sensors (sensor_id, '
+                           'sensor_number, sensor_name) VALUES(?,?,?)',
+                           [sensor_id, row['sensornumber'], row['name']])
+            self.c.execute('SELECT sensor_key FROM sensors '
+                           'WHERE sensor_id = ?;', [sensor_id])
+            self.sensor_keys[sensor_id] = self.c.fetchone()[0]
+        return(self.sensor_keys[sensor_id])
+
+    def _existing_reading_chunks(self, chunksize=100000):
+        '''Yields dataframes of the timestampms and sensorlocation of the
+        readings in the database, its partitions, and archive.db, 
+        'chunksize' rows (or one archive block) at a time.'''
+
+        compact_query = ('SELECT r.timestampms, s.sensor_id AS sensorlocation '
+                         'FROM {}sensor_readings_compact r '
+                         'JOIN sensors s ON s.sensor_key = r.sensor_key;')
+
+        if self.compact:
+            queries = [(None, compact_query.format(''))]
+            if self.partitions is not None:
+                self.c.execute('SELECT partition_name FROM partitions '
+                               'ORDER BY time_from;')
+                queries += [(partition_name, compact_query)
+                            for (partition_name,) in self.c.fetchall()]
         else:
+            queries = [(None, 'SELECT timestampms, sensorlocation '
+                              'FROM sensor_readings;')]
+
+        for partition_name, query in queries:
+            if partition_name is not None:
+                query = query.format(
+                    self.partitions.attach(partition_name) + '.')
+            for chunk in pd.read_sql(query, self.conn, chunksize=chunksize):
+                yield(chunk)
+
+        # readings moved to archive.db are still in the database
+        if Archive.exists():
+            archive = Archive(read_only=True)
+            for sensorlocation, timestamps, _ in archive.blocks(
+                    parameters=[]):
+                yield(pd.DataFrame({'timestampms': timestamps, 
+                                    'sensorlocation': sensorlocation}))
+            archive.close()
+
+    def _ingest_watermark(self):
+        '''Returns the 'ingest_watermark' in 'storage_info', or 0.'''
+        self.c.execute("SELECT value FROM storage_info "
+                       "WHERE key = 'ingest_watermark';")
+        result = self.c.fetchone()
+        return(0 if result is None else result[0])
+
+    def _reading_count(self):
+        '''Returns the number of readings in the database, its partitions, 
+        and archive.db, counted by SQLite.'''
+
+        if not self.compact:
+            self.c.execute('SELECT COUNT(*) FROM sensor_readings;')
+            return(self.c.fetchone()[0])
+
+        self.c.execute('SELECT COUNT(*) FROM sensor_readings_compact;')
+        count = self.c.fetchone()[0]
+        if self.partitions is not None:
+            self.c.execute('SELECT partition_name FROM partitions;')
+            for (partition_name,) in self.c.fetchall():
+                self.c.execute('SELECT COUNT(*) FROM '
+                               '{}.sensor_readings_compact;'.format(
+                                   self.partitions.attach(partition_name)))
+                count += self.c.fetchone()[0]
+        if Archive.exists():
+            archive = Archive(read_only=True)
+            count += archive.size()[1]
+            archive.close()
+        return(count)
+
+    def _compacted_before(self):
+        '''Returns the 'compacted_before' in 'storage_info', or 0 if the 
+        database has not been downsampled.'''
+        self.c.execute("SELECT value FROM storage_info "
+                       "WHERE key = 'compacted_before';")
+        result = self.c.fetchone()
+        return(0 if result is None else result[0])
+
+    def _load_dedup_filter(self):
+        '''Returns the Bloom filter of the readings in the database (see 
+        bloomfilter.py). The saved filter is used if it was saved at the 
+        current ingest watermark, otherwise it is rebuilt from the readings 
+        and saved.'''
+
+        watermark = self._ingest_watermark()
+        dedup_filter = BloomFilter.load()
+        if dedup_filter is not None:
+            if dedup_filter.watermark == watermark and \
+                    not dedup_filter.is_full():
+                return(dedup_filter)
+            dedup_filter.close()
+
+        # sized for twice the readings stored, so the readings are only read 
+        # once and there is room for new readings
+        dedup_filter = BloomFilter(2 * self._reading_count())
+        for chunk in self._existing_reading_chunks():
+            # timestamps stored as bytes cannot match new readings
+            timestamps = pd.to_numeric(chunk['timestampms'], errors='coerce')
+            valid = timestamps.notna().to_numpy()
+            dedup_filter.add(chunk['sensorlocation'].to_numpy()[valid], 
+                             timestamps.to_numpy()[valid])
+
+        dedup_filter.save(watermark)
+        print('Duplicate filter built from {} readings.'
+              .format(dedup_filter.count))
+        return(dedup_filter)
+
+    def _existing_timestamps(self, sensorlocation, time_from, time_to):
+        '''Returns the ms times of the readings of the sensor between 
+        'time_from' and 'time_to' (inclusive) which are in the database, its 
+        partitions, or archive.db, using the indexes on sensor and time.'''
+
+        timestamps = []
+        if not self.compact:
+            self.c.execute('SELECT timestampms FROM sensor_readings '
+                           'WHERE sensorlocation = ? '
+                           'AND timestampms BETWEEN ? AND ?;',
+                           [sensorlocation, time_from, time_to])
+            timestamps += [row[0] for row in self.c.fetchall()]
+        elif sensorlocation in self.sensor_keys:
+            partition_names = [None]
+            if self.partitions is not None:
+                partition_names += self.partitions.overlapping(time_from, 
+                                                               time_to)
+            for partition_name in partition_names:
+                # attached just before it is read, as only a few can be 
+                # attached at once
+                if partition_name is None:
+                    table = 'sensor_readings_compact'
+                else:
+                    table = '{}.sensor_readings_compact'.format(
+                        self.partitions.attach(partition_name))
+                self.c.execute('SELECT timestampms FROM {} '
+                               'WHERE sensor_key = ? '
+                               'AND timestampms BETWEEN ? AND ?;'
+                               .format(table), 
+                               [self.sensor_keys[sensorlocation], 
+                                time_from, time_to])
+                timestamps += [row[0] for row in self.c.fetchall()]
+
+        if Archive.exists():
+            if self.archive is None:
+                self.archive = Archive(read_only=True)
+            _, archived, _ = self.archive.read(
+                [sensorlocation], time_from, time_to, parameters=[])
+            timestamps += archived.tolist()
+        return(np.asarray(timestamps, dtype=np.int64))
+
+    def _find_duplicates(self, readings):
+        '''Returns a boolean array which is True for each reading (a 
+        dataframe from the API) which is already in the database, or 
+        repeats an earlier reading in 'readings'. Readings from before the 
+        downsampling cut-off count as already in the database, as they have 
+        been replaced by hourly summaries (see downsample_database()). 
+        Readings which are certainly not in the duplicate filter are new. 
+        The rest are looked up in the database with one query per sensor.'''
+
+        sensorlocations = readings['sensorlocation'].astype(str).to_numpy()
+        timestamps = readings['timestampms'].to_numpy(dtype='int64')
+        duplicate = readings.duplicated(
+            ['sensorlocation', 'timestampms']).to_numpy(copy=True)
+        duplicate |= timestamps < self._compacted_before()
+
+        possible = self.dedup_filter.might_contain(
+            sensorlocations, timestamps) & ~duplicate
+        for sensorlocation in np.unique(sensorlocations[possible]):
+            check = possible & (sensorlocations == sensorlocation)
+            existing = self._existing_timestamps(
+                sensorlocation, int(timestamps[check].min()), 
+                int(timestamps[check].max()))
+            duplicate[check] = np.isin(timestamps[check], existing)
+        return(duplicate)
+
+    def _insert_rows(self, readings):
+        '''Inserts readings from the API (a dataframe) which are not in the 
+        database yet, with one statement per table, and adds them to the 
+        duplicate filter. Returns the number of readings inserted.'''
+
+        if readings.empty:
             return(0)
+        columns = ['co2', 'humid', 'lux', 'noise', 'occupancy', 'pressure', 
+                   'temperature', 'voc']
+        values = readings[columns].astype(float).to_numpy().tolist()
+        timestamps = readings['timestampms'].to_numpy(dtype='int64')
+        changes_before = self.conn.total_changes
+
+        if not self.compact:
+            self.c.executemany(
+                'INSERT INTO sensor_readings (time, timestampms, '
+                'timestamputc, sensor_number, sensor_name, sensorlocation, '
+                'co2, humidity, lux, noise, occupancy, pressure, '
+                'temperature, voc) VALUES'
+                "(strftime('%s', 'now'),?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                [[int(timestamp), str(timestamputc), int(sensor_number), 
+                  name, sensorlocation] + row_values 
+                 for timestamp, timestamputc, sensor_number, name, 
+                 sensorlocation, row_values in zip(
+                     timestamps, readings['timestamputc'], 
+                     readings['sensornumber'], readings['name'], 
+                     readings['sensorlocation'], values)])
+        else:
+            # key of each sensor, adding new sensors to 'sensors' first
+            sensor_keys = {row['sensorlocation']: self._sensor_key(row) 
+                           for _, row in readings.drop_duplicates(
+                               'sensorlocation').iterrows()}
+            sensor_keys = readings['sensorlocation'].map(sensor_keys).tolist()
+            rows = [[sensor_key, int(timestamp)] + row_values 
+                    for sensor_key, timestamp, row_values 
+                    in zip(sensor_keys, timestamps, values)]
+
+            # with partitioning, write to the file for each reading's month. 
+            # Each file is attached just before it is written to, as only a 
+            # few can be attached at once.
+            if self.partitions is not None:
+                months = pd.to_datetime(timestamps, unit='ms').strftime(
+                    'readings_%Y_%m').tolist()
+            else:
+                months = [None] * len(rows)
+
+            for partition_name in sorted(set(months)):
+                if partition_name is None:
+                    table = 'sensor_readings_compact'
+                else:
+                    table = '{}.sensor_readings_compact'.format(
+                        self.partitions.attach(partition_name, create=True))
+                self.c.executemany(
+                    'INSERT OR IGNORE INTO {} '
+                    '(sensor_key, timestampms, co2, humidity, lux, noise, '
+                    'occupancy, pressure, temperature, voc) '
+                    'VALUES(?,?,?,?,?,?,?,?,?,?)'.format(table),
+                    [row for row, month in zip(rows, months) 
+                     if month == partition_name])
+
+        self.dedup_filter.add(readings['sensorlocation'].astype(str)
+                              .to_numpy(), timestamps)
+        inserted = self.conn.total_changes - changes_before
+        if inserted < len(readings):
+            # the filter missed readings inserted without it, so it is not 
+            # saved by _mark_ingest() and is rebuilt next time
+            print('{} reading(s) were already in the database. The duplicate '
+                  'filter will be rebuilt.'.format(len(readings) - inserted))
+            self.dedup_filter.watermark = None
+        return(inserted)
 
     # %% functions for getting and inserting data
 
@@ -113,25 +829,25 @@ class Database():
         print('\nTrying to insert "sensor_reading_latest_data"...')
 
         # For checking whether there is already a reading with same time index
-        duplicates = 0
-
-        # loop through the rows (sensor readings)
-        for sensor_number, row in sensor_reading_latest_data.iterrows():
-            # %% check whether there is already a sensor reading for this 
-            #sensor at this time and pass continue if there is
-            if self.check_for_duplicates(row) == 1:
-                print('Sensor {}: {} already has reading for time {}.'
-                      .format(sensor_number,
-                              self.smart_building.sensor_location_info['name']\
-                                  .loc[sensor_number], row['timestamputc']))
-                duplicates += 1
-                continue
-
-            self.insert_row(row)
+        duplicate = self._find_duplicates(sensor_reading_latest_data)
+        for sensor_number, row in \
+                sensor_reading_latest_data[duplicate].iterrows():
+            print('Sensor {}: {} already has reading for time {}.'
+                  .format(sensor_number,
+                          self.smart_building.sensor_location_info['name']\
+                              .loc[sensor_number], row['timestamputc']))
+
+        inserted = sensor_reading_latest_data[~duplicate]
+        self._insert_rows(inserted)
 
         print('Readings from {} sensor(s) skipped as sensor reading(s) '
               'already existed for that time.'
-              .format(duplicates))
+              .format(duplicate.sum()))
+        self._update_coverage(sensor_reading_latest_data)
+        self.detector.check(sensor_reading_latest_data)
+        QuantileSketch.update(self.conn, inserted)
+        Database._update_occupancy_cube(self.conn, inserted)
+        self._mark_ingest()
 
     def insert_sensor_readings_after(self, sensor_reading_after):
         ''' Tries to insert data from the API in to the database using output 
@@ -139,24 +855,32 @@ class Database():
 
         print('\nTrying to insert "sensor_reading_after_data"...')
 
+        # readings which were not in the database before
+        inserted = []
+
         # Loop through each index (sensor) in sensor_reading_after
         for sensor_dataframe in sensor_reading_after:
             print('Trying to insert readings from sensor {}...'
                   .format(sensor_dataframe['sensornumber'].loc[1]))
-            # to check for existing readings with same time index
-            duplicates = 0
-
-            for sensor_number, row in sensor_dataframe.iterrows():
-                # %% continue if already a sensor reading in database 
-                # with same time index
-                if self.check_for_duplicates(row) == 1:
-                    duplicates += 1
-                    continue
-
-                self.insert_row(row)
+            # readings already in database with same time index are skipped
+            duplicate = self._find_duplicates(sensor_dataframe)
+            inserted.append(sensor_dataframe[~duplicate])
+            self._insert_rows(inserted[-1])
 
             print('{} duplicate readings sensor readings not inserted for '
-                  'sensor {}.' .format(duplicates, row['sensornumber']))
+                  'sensor {}.' .format(duplicate.sum(), 
+                                       sensor_dataframe['sensornumber']
+                                       .iloc[-1]))
+
+        if sensor_reading_after:
+            new_readings = pd.concat(sensor_reading_after)
+            self._update_coverage(new_readings)
+            self.detector.check(new_readings)
+        if inserted:
+            inserted = pd.concat(inserted)
+            QuantileSketch.update(self.conn, inserted)
+            Database._update_occupancy_cube(self.conn, inserted)
+        self._mark_ingest()
 
     def find_earliest_time(self):
         '''' Checks earliest reading for each sensor by calling 
@@ -215,21 +939,534 @@ class Database():
                     timestamp_epoch_millisec=input_time)
             self.insert_sensor_readings_after(sensor_reading_after_data)
 
+    # %% functions for the coverage of each sensor and finding gaps
+
+    @staticmethod
+    def _coverage_intervals(readings):
+        '''Returns a dataframe of the intervals (sensorlocation, time_from,
+        time_to) covered by 'readings', a dataframe with the same columns
+        (time_from and time_to are the same for a single reading). Readings
+        no more than Database.max_reading_gap apart are in one interval.'''
+
+        readings = readings.sort_values(['sensorlocation', 'time_from'])
+        sensors = readings['sensorlocation'].to_numpy()
+        starts = readings['time_from'].to_numpy(dtype='int64')
+        # latest end so far for each sensor, as intervals can overlap
+        ends = readings['time_to'].astype('int64').groupby(
+            readings['sensorlocation']).cummax().to_numpy()
+
+        # a new interval starts at each new sensor and after each gap
+        new_interval = np.ones(len(readings), dtype=bool)
+        new_interval[1:] = ((sensors[1:] != sensors[:-1]) |
+                            (starts[1:] - ends[:-1] > 
+                             Database.max_reading_gap))
+
+        return(readings.groupby(np.cumsum(new_interval)).agg(
+            sensorlocation=('sensorlocation', 'first'),
+            time_from=('time_from', 'min'),
+            time_to=('time_to', 'max')))
+
+    def _update_coverage(self, readings):
+        '''Adds the times of new readings (a dataframe with sensorlocation
+        and timestampms) to 'sensor_coverage', joining them to the intervals
+        they are next to. Only the intervals next to the new readings are
+        read, so the time taken depends on the new readings only.'''
+
+        if readings is None or readings.empty:
+            return
+        readings = readings[['sensorlocation', 'timestampms']].dropna()
+        intervals = Database._coverage_intervals(pd.DataFrame({
+            'sensorlocation': readings['sensorlocation'].astype(str),
+            'time_from': readings['timestampms'].astype('int64'),
+            'time_to': readings['timestampms'].astype('int64')}))
+
+        gap = Database.max_reading_gap
+        with self.conn:
+            for sensorlocation, time_from, time_to in \
+                    intervals.itertuples(index=False):
+                # intervals which overlap or are close enough to join
+                touching = [sensorlocation, int(time_from) - gap,
+                            int(time_to) + gap]
+                self.c.execute('SELECT MIN(time_from), MAX(time_to) '
+                               'FROM sensor_coverage '
+                               'WHERE sensorlocation = ? AND time_to >= ? '
+                               'AND time_from <= ?;', touching)
+                joined_from, joined_to = self.c.fetchone()
+                if joined_from is not None:
+                    time_from = min(time_from, joined_from)
+                    time_to = max(time_to, joined_to)
+                    self.c.execute('DELETE FROM sensor_coverage '
+                                   'WHERE sensorlocation = ? AND time_to >= ? '
+                                   'AND time_from <= ?;', touching)
+                self.c.execute('INSERT INTO sensor_coverage (sensorlocation, '
+                               'time_from, time_to) VALUES(?,?,?)',
+                               [sensorlocation, int(time_from), int(time_to)])
+
+    def _build_coverage(self):
+        '''Fills 'sensor_coverage' from the readings already in the database
+        (and the hours summarised by downsample_database()), when the table
+        is first created. After this it is kept up to date as readings are
+        inserted. The readings are read in chunks, and each chunk is reduced 
+        to its intervals before the intervals are joined.'''
+
+        readings = []
+        for chunk in self._existing_reading_chunks():
+            # timestamps stored as bytes are not counted
+            timestamps = pd.to_numeric(chunk['timestampms'], errors='coerce')
+            valid = timestamps.notna()
+            if valid.any():
+                readings.append(Database._coverage_intervals(pd.DataFrame({
+                    'sensorlocation': 
+                        chunk['sensorlocation'][valid].astype(str),
+                    'time_from': timestamps[valid].astype('int64'),
+                    'time_to': timestamps[valid].astype('int64')})))
+        try:
+            readings.append(pd.read_sql(
+                'SELECT s.sensor_id AS sensorlocation, '
+                'h.timestampms AS time_from, '
+                'h.timestampms + 3599999 AS time_to '
+                'FROM sensor_readings_hourly h '
+                'JOIN sensors s ON s.sensor_key = h.sensor_key;', self.conn))
+        except Exception:
+            # not downsampled
+            pass
+
+        readings = [dataframe for dataframe in readings if not dataframe.empty]
+        if not readings:
+            return
+        intervals = Database._coverage_intervals(pd.concat(readings))
+        with self.conn:
+            self.c.executemany('INSERT INTO sensor_coverage (sensorlocation, '
+                               'time_from, time_to) VALUES(?,?,?)',
+                               [(sensorlocation, int(time_from), int(time_to))
+                                for sensorlocation, time_from, time_to
+                                in intervals.itertuples(index=False)])
+        print('Coverage of {} sensor(s) recorded in {} interval(s).'
+              .format(intervals['sensorlocation'].nunique(), len(intervals)))
+
+    @staticmethod
+    def find_gaps(time_from, time_to, sensor_numbers=None, conn=None):
+        '''Returns the gaps in the readings of each sensor between 'time_from'
+        and 'time_to' (ms time epoch), found from 'sensor_coverage' without
+        reading the readings. Gaps are times longer than
+        Database.max_reading_gap without a reading.
+
+        Returns a dataframe with columns sensor_number, sensor_name,
+        sensorlocation, gap_from and gap_to (the last reading before the gap
+        and the first after it, or the ends of the range) and minutes.'''
+
+        close = conn is None
+        if close:
+            conn, _ = Database._connect_to_database()
+        if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                        "AND name = 'sensor_coverage';").fetchone() is None:
+            sys.exit('The coverage of the sensors has not been recorded yet. '
+                     'It is recorded the next time readings are added (e.g. '
+                     'python database.py -r).')
+        sensors = pd.read_sql('SELECT sensor_id AS sensorlocation, '
+                              'sensor_number, sensor_name FROM sensors;',
+                              conn)
+        # the intervals which overlap the range, cut to the range
+        coverage = pd.read_sql('SELECT sensorlocation, '
+                               'MAX(time_from, ?) AS time_from, '
+                               'MIN(time_to, ?) AS time_to '
+                               'FROM sensor_coverage '
+                               'WHERE time_to >= ? AND time_from <= ?;',
+                               conn, params=[time_from, time_to, time_from,
+                                             time_to])
+        if close:
+            conn.close()
+
+        if sensor_numbers is not None:
+            if isinstance(sensor_numbers, int):
+                sensor_numbers = [sensor_numbers]
+            sensors = sensors.loc[sensors['sensor_number'].isin(
+                sensor_numbers)]
+
+        # an empty interval at each end of the range, so that there are gaps
+        # before the first and after the last interval of each sensor
+        coverage = pd.concat([
+            sensors[['sensorlocation']].assign(time_from=time_from,
+                                               time_to=time_from),
+            coverage,
+            sensors[['sensorlocation']].assign(time_from=time_to,
+                                               time_to=time_to)])
+        coverage = coverage.merge(sensors, on='sensorlocation').sort_values(
+            ['sensor_number', 'time_from'], kind='stable')
+
+        # a gap is from the end of one interval to the start of the next
+        coverage['gap_from'] = coverage.groupby('sensorlocation')[
+            'time_to'].shift()
+        coverage['gap_to'] = coverage['time_from']
+        gaps = coverage.loc[coverage['gap_to'] - coverage['gap_from'] >
+                            Database.max_reading_gap].copy()
+        gaps['gap_from'] = gaps['gap_from'].astype('int64')
+        gaps['minutes'] = ((gaps['gap_to'] - gaps['gap_from']) / 60000)\
+            .round(1)
+
+        return(gaps[['sensor_number', 'sensor_name', 'sensorlocation',
+                     'gap_from', 'gap_to', 'minutes']]
+               .reset_index(drop=True))
+
+    @staticmethod
+    def report_gaps(time_from, time_to, sensor_numbers=None):
+        '''Prints the gaps from Database.find_gaps() and the total missing
+        time for each sensor.'''
+
+        gaps = Database.find_gaps(time_from, time_to, sensor_numbers)
+        if gaps.empty:
+            print('No gaps between {} and {}.'.format(time_from, time_to))
+            return(gaps)
+
+        report = gaps.copy()
+        for column in ['gap_from', 'gap_to']:
+            report[column] = pd.to_datetime(
+                report[column], unit='ms').dt.strftime('%Y-%m-%d %H:%M:%S')
+        print(report.to_string(index=False))
+        print('\nMissing minutes per sensor:')
+        print(gaps.groupby(['sensor_number', 'sensor_name'])['minutes']
+              .sum().to_string())
+        print('{} gap(s) in {} sensor(s) between {} and {}.'
+              .format(len(gaps), gaps['sensor_number'].nunique(), time_from,
+                      time_to))
+        return(gaps)
+
+    def refetch_gaps(self, time_from, time_to, sensor_numbers=None):
+        '''Calls the API only for the gaps from Database.find_gaps() between
+        'time_from' and 'time_to' (ms time epoch), in steps of 1000 minutes
+        through each gap, and inserts the readings. Sensors which were off
+        will still have the gap afterwards.'''
+
+        gaps = Database.find_gaps(time_from, time_to, sensor_numbers,
+                                  self.conn)
+        api_sensors = set(self.smart_building.sensor_location_info.index)
+        gaps = gaps.loc[gaps['sensor_number'].isin(api_sensors)]
+        print('Refetching {} gap(s) ({} minutes) from the API...'
+              .format(len(gaps), gaps['minutes'].sum()))
+
+        for sensor_number, gap_from, gap_to in zip(
+                gaps['sensor_number'], gaps['gap_from'], gaps['gap_to']):
+            for input_time in range(int(gap_from), int(gap_to), 60000000):
+                sensor_reading_after_data, _ = \
+                    self.smart_building.sensor_reading_after(
+                        sensor_numbers=int(sensor_number),
+                        timestamp_epoch_millisec=input_time)
+                self.insert_sensor_readings_after(sensor_reading_after_data)
+
+    # %% functions for the hour of week occupancy cube
+
+    @staticmethod
+    def _add_to_occupancy_cube(conn, rows):
+        '''Adds rows of (sensorlocation, hour_of_week, occupancy_sum, 
+        minutes) to the totals in 'occupancy_cube'.'''
+        with conn:
+            conn.executemany('INSERT INTO occupancy_cube (sensorlocation, '
+                             'hour_of_week, occupancy_sum, minutes) '
+                             'VALUES(?,?,?,?) '
+                             'ON CONFLICT (sensorlocation, hour_of_week) '
+                             'DO UPDATE SET '
+                             'occupancy_sum = occupancy_sum + '
+                             'excluded.occupancy_sum, '
+                             'minutes = minutes + excluded.minutes;', rows)
+
+    @staticmethod
+    def _update_occupancy_cube(conn, readings):
+        '''Adds new readings (a dataframe from the API) to 'occupancy_cube': 
+        the mean occupancy of each sensor in each minute is added to the 
+        total for its hour of the week. Only readings which were not in the 
+        database before should be added.'''
+
+        if readings is None or readings.empty or \
+                'occupancy' not in readings.columns:
+            return
+
+        readings = pd.DataFrame({
+            'sensorlocation': readings['sensorlocation'].astype(str)
+            .to_numpy(),
+            'minute': readings['timestampms'].to_numpy(dtype='int64') // 60000,
+            'occupancy': pd.to_numeric(readings['occupancy'], errors='coerce')
+            .to_numpy(dtype=float)}).dropna()
+        minutes = readings.groupby(['sensorlocation', 'minute'])[
+            'occupancy'].mean().reset_index()
+        time = pd.to_datetime(minutes['minute'] * 60000, unit='ms')
+        minutes['hour_of_week'] = time.dt.dayofweek * 24 + time.dt.hour
+        cube = minutes.groupby(['sensorlocation', 'hour_of_week'])[
+            'occupancy'].agg(['sum', 'count'])
+
+        Database._add_to_occupancy_cube(
+            conn, [(sensorlocation, int(hour_of_week), float(total), 
+                         int(count)) 
+                        for (sensorlocation, hour_of_week), total, count 
+                        in zip(cube.index, cube['sum'], cube['count'])])
+
+    @staticmethod
+    def build_occupancy_cube(conn=None, partitions=None):
+        '''Fills 'occupancy_cube' from the readings already in the database 
+        (replacing what is there), with one grouped query per table. Hourly 
+        summaries (see downsample_database()) are counted as the number of 
+        readings they summarise at their mean occupancy, and readings in 
+        archive.db are added block by block. 'partitions' is the 
+        Partitions() of 'conn', if it already has one.'''
+
+        close = conn is None
+        if close:
+            conn, _ = Database._connect_to_database()
+        c = conn.cursor()
+        Database._create_occupancy_cube(c)
+        c.execute('DELETE FROM occupancy_cube;')
+        conn.commit()
+
+        # hour of the week (Monday 00:00 UTC = 0) of a ms time
+        hour_of_week = ("((CAST(strftime('%w', {0} / 1000, 'unixepoch') "
+                        "AS INTEGER) + 6) % 7) * 24 + "
+                        "CAST(strftime('%H', {0} / 1000, 'unixepoch') "
+                        "AS INTEGER)")
+        minute_query = ('SELECT sensorlocation, {}, TOTAL(occupancy), '
+                        'COUNT(*) FROM ('
+                        'SELECT {{}} AS sensorlocation, '
+                        'CAST(r.timestampms AS INTEGER) / 60000 * 60000 '
+                        'AS minute, AVG(r.occupancy) AS occupancy '
+                        'FROM {{}} WHERE r.occupancy IS NOT NULL '
+                        'GROUP BY 1, 2) GROUP BY 1, 2;'
+                        .format(hour_of_week.format('minute')))
+
+        if not Database._is_compact(c):
+            queries = [minute_query.format('r.sensorlocation', 
+                                           'sensor_readings r')]
+        else:
+            compact_table = ('{}sensor_readings_compact r JOIN sensors s '
+                             'ON s.sensor_key = r.sensor_key')
+            queries = [minute_query.format('s.sensor_id', 
+                                           compact_table.format(''))]
+            if Partitions.enabled(conn):
+                if partitions is None:
+                    partitions = Partitions(conn)
+                c.execute('SELECT partition_name FROM partitions '
+                          'ORDER BY time_from;')
+                for (partition_name,) in c.fetchall():
+                    queries.append((partition_name, minute_query.format(
+                        's.sensor_id', compact_table.format('{}.'))))
+            c.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                      "AND name = 'sensor_readings_hourly';")
+            if c.fetchone() is not None:
+                queries.append('SELECT s.sensor_id, {}, '
+                               'TOTAL(h.occupancy_mean * h.readings), '
+                               'SUM(h.readings) '
+                               'FROM sensor_readings_hourly h '
+                               'JOIN sensors s ON s.sensor_key = h.sensor_key '
+                               'WHERE h.occupancy_mean IS NOT NULL '
+                               'GROUP BY 1, 2;'
+                               .format(hour_of_week.format('h.timestampms')))
+
+        for query in queries:
+            if isinstance(query, tuple):
+                partition_name, query = query
+                query = query.format(partitions.attach(partition_name))
+            c.execute(query)
+            Database._add_to_occupancy_cube(conn, c.fetchall())
+
+        # readings moved to archive.db (see archive_database())
+        if Archive.exists():
+            archive = Archive(read_only=True)
+            for sensorlocation, timestamps, values in archive.blocks(
+                    parameters=['occupancy']):
+                Database._update_occupancy_cube(conn, pd.DataFrame({
+                    'sensorlocation': sensorlocation, 
+                    'timestampms': timestamps, 
+                    'occupancy': values['occupancy']}))
+            archive.close()
+
+        c.execute('SELECT COUNT(DISTINCT sensorlocation) '
+                  'FROM occupancy_cube;')
+        print('Hour of week occupancy recorded for {} sensor(s).'
+              .format(c.fetchone()[0]))
+        if close:
+            conn.close()
+
+    def _managed_space_rows(self, managed_space_data, time_of_call):
+        '''Returns the rows to insert into 'managed_space_readings' from a 
+        dataframe from scraper.managed_space_after() or 
+        scraper.managed_space_latest().'''
+
+        managed_space_data = managed_space_data.reset_index()
+        space_numbers = managed_space_data['spacenumber'].astype(int).tolist()
+        space_names = self.smart_building.managed_space_info['name'].loc[
+            space_numbers].tolist()
+
+        # the 'after' and 'latest' API functions name their times differently
+        if 'rxtimestamputc' in managed_space_data.columns:
+            timestamputc = managed_space_data['rxtimestamputc']
+        else:
+            timestamputc = managed_space_data['timestamputc']
+        if 'rxepochmillisec' in managed_space_data.columns:
+            timestampms = managed_space_data['rxepochmillisec']
+        else:
+            timestampms = (pd.to_datetime(timestamputc, utc=True) -
+                           pd.Timestamp(0, tz='UTC')) // \
+                pd.Timedelta(milliseconds=1)
+
+        if 'occupancy' in managed_space_data.columns:
+            occupancy = managed_space_data['occupancy'].astype(object).where(
+                managed_space_data['occupancy'].notna(), None).tolist()
+        else:
+            occupancy = [None] * len(managed_space_data)
+
+        return (list(zip(managed_space_data['managedspace'].astype(str),
+                         space_numbers, space_names, occupancy,
+                         timestamputc.astype(str), 
+                         timestampms.astype('int64').tolist(),
+                         [time_of_call] * len(managed_space_data))))
+
+    def insert_managed_space_readings(self, managed_space_data):
+        '''Inserts the readings from a list of dataframes from 
+        scraper.managed_space_after() (or one dataframe from 
+        scraper.managed_space_latest()) in one transaction. Readings which 
+        are already in the database are skipped by the primary key, so no 
+        separate check for duplicates is needed.'''
+
+        if isinstance(managed_space_data, pd.DataFrame):
+            managed_space_data = [managed_space_data]
+
+        time_of_call = Scraper._time_now() // 1000
+        rows = []
+        for dataframe in managed_space_data:
+            if isinstance(dataframe, pd.DataFrame) and not dataframe.empty:
+                rows += self._managed_space_rows(dataframe, time_of_call)
+
+        changes_before = self.conn.total_changes
+        with self.conn:
+            self.c.executemany('INSERT OR IGNORE INTO managed_space_readings '
+                               '(space_id, space_number, space_name, '
+                               'occupancy, timestamputc, timestampms, time) '
+                               'VALUES(?,?,?,?,?,?,?)', rows)
+        inserted = self.conn.total_changes - changes_before
+        self._mark_ingest()
+
+        print('{} managed space reading(s) inserted, {} already existed.'
+              .format(inserted, len(rows) - inserted))
+
+    def populate_managed_spaces_from(self, time_from, workers=8):
+        '''Populates the managed space readings from 'time_from' until now. 
+        As for sensor readings, API calls are made in steps of 1000 minutes, 
+        but calls for different spaces and times are made concurrently by 
+        'workers' threads. Readings are inserted in bulk as each step is 
+        returned. Only a few steps are submitted ahead of the one being 
+        inserted, and if a call fails the calls not started yet are 
+        cancelled.'''
+
+        time_now = Scraper._time_now()
+        space_numbers = list(self.smart_building.managed_space_info.index)
+        input_times = iter(range(time_from, time_now, 60000000))
+
+        # one task per space per step so the calls are spread evenly over 
+        # the threads, with about two calls per thread waiting. Steps are 
+        # inserted in time order as they complete.
+        steps_ahead = max(2, -(-2 * workers // max(len(space_numbers), 1)))
+        steps = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+                    for input_time in input_times:
+                        steps.append([executor.submit(
+                            self.smart_building.managed_space_after,
+                            managed_space_numbers=space_number,
+                            timestamp_epoch_millisec=input_time)
+                            for space_number in space_numbers])
+                        if len(steps) >= steps_ahead:
+                            break
+                    if not steps:
+                        break
+                    tasks = steps.pop(0)
+                    self.insert_managed_space_readings(
+                        [dataframe for task in tasks 
+                         for dataframe in task.result()[0]])
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    def update_metadata(self):
+        '''Adds the building, room, and sensor info from the API to the 
+        database, or updates it if it has changed. Rows which are already up 
+        to date are skipped, and the rest are written together in one 
+        transaction, so this can be run every time the database is 
+        populated. Only the columns from the API are updated, so the 
+        sensor_key of each sensor in the compact layout is kept.'''
+
+        building_info = self.smart_building.building_info
+        room_info = self.smart_building.room_info
+        sensor_location_info = self.smart_building.sensor_location_info
+
+        # (table, primary key, columns, rows from the API)
+        tables = [
+            ('buildings', 'building_id',
+             ['building_id', 'building_number', 'building_name'],
+             zip(building_info['id'].tolist(), building_info.index.tolist(),
+                 building_info['name'].tolist())),
+            ('rooms', 'room_id',
+             ['room_id', 'room_number', 'room_name', 'building_id',
+              'building_name'],
+             zip(room_info['id'].tolist(), room_info.index.tolist(),
+                 room_info['name'].tolist(), room_info['building'].tolist(),
+                 room_info['buildingname'].tolist())),
+            ('sensors', 'sensor_id',
+             ['sensor_id', 'sensor_number', 'sensor_name', 'room_id',
+              'room_name'],
+             zip(sensor_location_info['id'].tolist(),
+                 sensor_location_info.index.tolist(),
+                 sensor_location_info['name'].tolist(),
+                 sensor_location_info['room'].tolist(),
+                 sensor_location_info['roomname'].tolist()))]
+
+        with self.conn:
+            for table, key, columns, rows in tables:
+                column_string = ', '.join(columns)
+                self.c.execute('SELECT {} FROM {};'.format(column_string,
+                                                           table))
+                existing = set(self.c.fetchall())
+                # missing values are NaN from the API but None from SQLite
+                rows = [tuple(None if isinstance(value, float) and 
+                              np.isnan(value) else value for value in row)
+                        for row in rows]
+                changed = [row for row in rows if row not in existing]
+
+                self.c.executemany(
+                    'INSERT INTO {0} ({1}) VALUES({2}) '
+                    'ON CONFLICT({3}) DO UPDATE SET {4};'
+                    .format(table, column_string,
+                            ', '.join('?' * len(columns)), key,
+                            ', '.join('{0} = excluded.{0}'.format(column)
+                                      for column in columns if column != key)),
+                    changed)
+                print('{} row(s) added or updated in {}.'
+                      .format(len(changed), table))
+
     def __del__(self):
         '''Destructor commits any remaining data to the database and closes 
         the connection'''
         print("Closing connection to the database")
         self.conn.commit()
         self.conn.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.dedup_filter.close()
 
 
 # %% Program starts here
 if __name__ == '__main__':
 
-    # Parse command line arguments. Currently three options (must choose one):
+    # Parse command line arguments. Currently eleven options (must choose one):
     #  - recent: get the latest data from the API
     #  - all : get all available data from the API
     #  - from: get all data from a certain point
+    #  - compact: convert the database to the compact layout
+    #  - partition: store readings in one database file per month
+    #  - downsample: replace old readings with hourly summaries
+    #  - archive: move old readings to compressed blocks in archive.db
+    #  - gaps: report the gaps in the readings of each sensor
+    #  - refetch gaps: get the readings missing from the gaps from the API
+    #  - sketches: build the quantile sketches from the existing readings
+    #  - occupancy cube: rebuild the hour of week occupancy of each sensor
+    # and -m (managed spaces) can be added to recent, all, or from.
     parser = argparse.ArgumentParser()
 
     # The 'group' means that only one argument can be called. #
@@ -250,9 +1487,88 @@ if __name__ == '__main__':
     group.add_argument('-f', '--from', dest='_from', nargs=1, type=int,
                        help="Get all data from a certain point")
 
+    # Convert the database to the compact layout (no API calls needed)
+    group.add_argument('-c', '--compact', dest='compact', action='store_true',
+                       help="Convert database.db to the compact layout")
+
+    # Move readings to one database file per month (no API calls needed)
+    group.add_argument('-p', '--partition', dest='partition',
+                       action='store_true',
+                       help="Store readings in one database file per month")
+
+    # Summarise readings older than a number of days into hourly readings
+    group.add_argument('-d', '--downsample', dest='downsample', nargs=1,
+                       type=float, metavar='DAYS',
+                       help="Replace readings older than DAYS days with "
+                            "hourly summaries")
+
+    # Move readings older than a number of days to archive.db
+    group.add_argument('-A', '--archive', dest='archive', nargs=1,
+                       type=float, metavar='DAYS',
+                       help="Move readings older than DAYS days to "
+                            "compressed blocks in archive.db")
+
+    # Report the gaps in the readings of each sensor (no API calls needed)
+    group.add_argument('-g', '--gaps', dest='gaps', nargs=2, type=int,
+                       metavar=('FROM', 'TO'),
+                       help="Report gaps in the readings between two ms "
+                            "times")
+
+    # Call the API for the gaps only
+    group.add_argument('-G', '--refetch-gaps', dest='refetch_gaps', nargs=2,
+                       type=int, metavar=('FROM', 'TO'),
+                       help="Get the readings missing between two ms times "
+                            "from the API")
+
+    # Build the quantile sketches from the readings in the database
+    group.add_argument('-s', '--sketches', dest='sketches',
+                       action='store_true',
+                       help="Build the quantile sketches from the readings "
+                            "already in database.db")
+
+    # Build the hour of week occupancy cube from the readings in the database
+    group.add_argument('-o', '--occupancy-cube', dest='occupancy_cube',
+                       action='store_true',
+                       help="Rebuild the hour of week occupancy of each "
+                            "sensor from the readings in database.db")
+
+    # Also get managed space readings for the same time (with -r, -a, -f)
+    parser.add_argument('-m', '--managed-spaces', dest='managed_spaces',
+                        action='store_true',
+                        help="Also get managed space readings (with -r, -a, "
+                             "or -f)")
+
     # Parse the command line arguments
     args = parser.parse_args()
 
+    if args.compact:
+        Database.compact_database()
+        sys.exit()
+
+    if args.partition:
+        Database.partition_database()
+        sys.exit()
+
+    if args.downsample:
+        Database.downsample_database(args.downsample[0])
+        sys.exit()
+
+    if args.archive:
+        Database.archive_database(args.archive[0])
+        sys.exit()
+
+    if args.gaps:
+        Database.report_gaps(*args.gaps)
+        sys.exit()
+
+    if args.sketches:
+        Database.build_sketches()
+        sys.exit()
+
+    if args.occupancy_cube:
+        Database.build_occupancy_cube()
+        sys.exit()
+
     try:
         # Connect to the database
         database = Database()
@@ -260,49 +1576,38 @@ if __name__ == '__main__':
         if args.recent:
             print("Getting most recent data from the API")
             database.populate_from(Scraper._time_now())
+            if args.managed_spaces:
+                managed_space_latest_data, _ = \
+                    database.smart_building.managed_space_latest()
+                database.insert_managed_space_readings(
+                    managed_space_latest_data)
 
         elif args.all:
             print("Getting all data from the api")
             database.populate_database()
+            if args.managed_spaces:
+                # from before the first sensor reading
+                database.populate_managed_spaces_from(1580920305102)
 
         elif args._from:
             time_from = args._from[0]
             print("Getting all data from time point {}", time_from)
             database.populate_from(time_from)
+            if args.managed_spaces:
+                database.populate_managed_spaces_from(time_from)
+
+        elif args.refetch_gaps:
+            print("Getting readings missing between {} and {}"
+                  .format(*args.refetch_gaps))
+            database.refetch_gaps(*args.refetch_gaps)
 
         else:
             raise Exception(
                 "No arguments provided! Should not have gotten here.")
 
 
-        #%%
-        # Try to add data for building, room, and sensor info. Will skip if 
-        # same data already exists in database
-        
-        #building_info
-        for i, row in database.smart_building.building_info.iterrows():
-            database.c.execute('INSERT INTO buildings (building_id, '
-                               'building_number, '
-                               'building_name) VALUES(?,?,?)',
-                               [row['id'], i, row['name']])
-        
-        
-        #room_info
-        for i, row in database.smart_building.room_info.iterrows():
-            database.c.execute('INSERT INTO rooms (room_id, room_number, '
-                               'room_name, building_id, building_name) '
-                               'VALUES(?,?,?,?,?)', 
-                               [row['id'], i, row['name'], row['building'], 
-                                row['buildingname']])
-        
-        
-        #sensor_info
-        for i, row in database.smart_building.sensor_location_info.iterrows():
-            database.c.execute('INSERT INTO sensors (sensor_id, '
-                               'sensor_number, sensor_name, room_id, '
-                               'room_name) VALUES(?,?,?,?,?)', 
-                               [row['id'], i, row['name'], row['room'],
-                                row['roomname']])
+        # Add or update the building, room, and sensor info
+        database.update_metadata()
 
     finally:
         # Whatever happens, try to commit data to database and close up 
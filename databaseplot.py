@@ -9,15 +9,64 @@ Created on Thu Mar 12 18:04:38 2020
 
 @author: medtcri
 """
+from archive import Archive
+from concurrent.futures import ProcessPoolExecutor
 import datetime as dt
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-from pandas.plotting import register_matplotlib_converters
+import numpy as np
+import os
 import pandas as pd
+from partitions import Partitions
 from scraper import Scraper
+from sketches import QuantileSketch
 import sqlite3
 import sys
-register_matplotlib_converters()
+from types import MappingProxyType
+
+
+class _RollingBuffer():
+    """Times and values of one series in DatabasePlotter.plot_live(). They 
+    are kept in arrays with spare room at the end, so new points are added 
+    in place and old points are dropped by moving the start. The arrays are 
+    only copied when they are full, so adding a point takes constant time on 
+    average.
+    """
+
+    def __init__(self, capacity=1024):
+
+        self.x = np.empty(capacity)
+        self.y = np.empty(capacity)
+        self.start = 0
+        self.end = 0
+
+    def append(self, x, y):
+        ''' Adds points to the end. x must not be before the last point.'''
+
+        n = len(x)
+        if self.end + n > len(self.x):
+            # move the kept points to the front, making the arrays bigger if 
+            # they would be more than half full
+            kept = self.end - self.start
+            capacity = len(self.x)
+            while kept + n > capacity // 2:
+                capacity *= 2
+            for name in ('x', 'y'):
+                values = np.empty(capacity)
+                values[:kept] = getattr(self, name)[self.start:self.end]
+                setattr(self, name, values)
+            self.start, self.end = 0, kept
+
+        self.x[self.end:self.end + n] = x
+        self.y[self.end:self.end + n] = y
+        self.end += n
+
+    def drop_before(self, x_min):
+        ''' Drops the points before x_min from the start.'''
+        self.start += int(np.searchsorted(self.x[self.start:self.end], 
+                                          x_min))
+
+    def data(self):
+        ''' Returns views of the times and values kept.'''
+        return (self.x[self.start:self.end], self.y[self.start:self.end])
 
 
 class DatabasePlotter():
@@ -27,10 +76,22 @@ class DatabasePlotter():
     created.
     """
 
-    def __init__(self):
+    def __init__(self, read_only=False):
 
         # connect to database
-        self.conn, self.c = self.connect_to_database()
+        self.conn, self.c = self.connect_to_database(read_only)
+
+        # monthly partition files, if the database has been partitioned
+        if Partitions.enabled(self.conn):
+            self.partitions = Partitions(self.conn)
+        else:
+            self.partitions = None
+
+        # compressed blocks of old readings, if any have been archived
+        if Archive.exists():
+            self.archive = Archive(read_only=True)
+        else:
+            self.archive = None
         
         # get sensor info
         self.sensor_location_info = \
@@ -46,6 +107,9 @@ class DatabasePlotter():
         self.all_room_names = self.room_info['room_name'].tolist()
         print("Room information retrieved successfully.")
 
+        # lookups for resolving sensor and room names and numbers
+        self._build_lookups()
+
         # lists of plot parameters and plot labels
         self.param_list = ['occupancy', 'voc', 'co2', 'temperature',
                            'pressure', 'humidity', 'lux', 'noise']
@@ -74,10 +138,19 @@ class DatabasePlotter():
         self.overlay = None
         self.aggregate = None
         self.seperate = None
+        self.decimate = None
+        self.chunksize = None
 
-    def connect_to_database(self):
+    def connect_to_database(self, read_only=False):
+        ''' Connects to database.db. With 'read_only', the connection cannot
+        write to the database and can be passed between threads (used one at
+        a time, e.g. from a pool as in queryservice.py).'''
         # connect to database
-        self.conn = sqlite3.connect("./database.db")
+        if read_only:
+            self.conn = sqlite3.connect('file:./database.db?mode=ro', 
+                                        uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect("./database.db")
 
         # Create a cursor to operate on the database
         self.c = self.conn.cursor()
@@ -88,6 +161,37 @@ class DatabasePlotter():
         dataframe = dataframe.set_index(index_col)
         return (dataframe)
 
+    def _build_lookups(self):
+        ''' Builds read-only lookups from the sensor and room tables, so that 
+        names and numbers can be resolved without searching the dataframes:
+            - sensor_name_by_number and sensor_number_by_name
+            - room_name_by_number and room_number_by_name
+            - room_name_by_sensor_number
+            - sensors_by_room: room name to tuple of sorted sensor numbers
+        '''
+        sensor_numbers = self.all_sensor_numbers
+        room_names = self.sensor_location_info['room_name'].tolist()
+
+        self.sensor_name_by_number = MappingProxyType(
+            dict(zip(sensor_numbers, self.all_sensor_names)))
+        self.sensor_number_by_name = MappingProxyType(
+            dict(zip(self.all_sensor_names, sensor_numbers)))
+        self.room_name_by_number = MappingProxyType(
+            dict(zip(self.all_room_numbers, self.all_room_names)))
+        self.room_number_by_name = MappingProxyType(
+            dict(zip(self.all_room_names, self.all_room_numbers)))
+        self.room_name_by_sensor_number = MappingProxyType(
+            dict(zip(sensor_numbers, room_names)))
+
+        sensors_by_room = {room_name: [] for room_name in self.all_room_names}
+        for sensor_number, room_name in sorted(zip(sensor_numbers, 
+                                                   room_names), 
+                                               key=lambda x: x[0]):
+            sensors_by_room.setdefault(room_name, []).append(sensor_number)
+        self.sensors_by_room = MappingProxyType(
+            {room_name: tuple(numbers) 
+             for room_name, numbers in sensors_by_room.items()})
+
     @staticmethod
     def _choose_time():
         ''' Take user input to choose a time in ms time epoch. 
@@ -162,8 +266,191 @@ class DatabasePlotter():
 
             return (values_string)
 
+    @staticmethod
+    def _build_sql_params(sensor_numbers, time_from, time_to):
+        ''' Builds list of parameters to match the string from
+        DatabasePlotter._build_values_string() for use in pd.read_sql. '''
+
+        if isinstance(sensor_numbers, int):
+            return ([time_from, time_to, sensor_numbers])
+
+        sql_params = []
+        for i in sensor_numbers:
+            sql_params = sql_params + [time_from, time_to, i]
+        return (sql_params)
+
+    def get_compacted_before(self):
+        ''' Returns the ms time before which raw readings have been replaced
+        by hourly summaries, or 0 if the database has not been downsampled.
+        '''
+        try:
+            self.c.execute("SELECT value FROM storage_info "
+                           "WHERE key = 'compacted_before';")
+        except sqlite3.OperationalError:
+            return (0)
+        result = self.c.fetchone()
+        if result is None:
+            return (0)
+        return (result[0])
+
+    def get_archived_before(self):
+        ''' Returns the ms time before which raw readings have been moved to
+        archive.db, or 0 if the database has not been archived.'''
+        try:
+            self.c.execute("SELECT value FROM storage_info "
+                           "WHERE key = 'archived_before';")
+        except sqlite3.OperationalError:
+            return (0)
+        result = self.c.fetchone()
+        if result is None:
+            return (0)
+        return (result[0])
+
+    def get_ingest_watermark(self):
+        ''' Returns the ms time of the last insert of readings by database.py,
+        or 0 if it has not been recorded.'''
+        try:
+            self.c.execute("SELECT value FROM storage_info "
+                           "WHERE key = 'ingest_watermark';")
+        except sqlite3.OperationalError:
+            return (0)
+        result = self.c.fetchone()
+        if result is None:
+            return (0)
+        return (result[0])
+
+    def _queries(self, sensor_numbers, time_from, time_to, param_string,
+                 columns_only=False, weighted=False):
+        ''' Builds the queries needed to retrieve data for the sensors and 
+        time range. Returns a list of tuples (partition_name, query, 
+        sql_params) in time order, where partition_name is the monthly 
+        partition file to attach first (see partitions.py), or None. The 
+        query for a partition has '{}' in place of its schema name, to be 
+        filled in with the name returned by Partitions.attach(). The 
+        queries are not ordered or terminated, so 'ORDER BY' can be added.
+        
+        Where the database has been downsampled (python database.py -d), 
+        hourly means are read for times before the cut-off (see 
+        Database.downsample_database() in database.py). If 'columns_only', 
+        only timestampms, sensor_number and the parameters are selected. If 
+        'weighted', a 'weight' column gives the number of readings in each 
+        row (1, or the number summarised by an hourly mean).'''
+
+        value_string = DatabasePlotter._build_values_string(sensor_numbers)
+
+        if columns_only:
+            view_columns = compact_columns = 'timestampms, sensor_number'
+        else:
+            view_columns = ('time, timestampms, timestamputc, sensor_name, '
+                            'sensor_number, sensorlocation')
+            compact_columns = ("NULL AS time, timestampms, "
+                               "strftime('%Y-%m-%d %H:%M:%f+00:00', "
+                               "timestampms / 1000.0, 'unixepoch') "
+                               "AS timestamputc, sensor_name, sensor_number, "
+                               "sensor_id AS sensorlocation")
+
+        # readings from before this time have been replaced by hourly
+        # summaries
+        compacted_before = self.get_compacted_before()
+
+        queries = []
+        if time_from < compacted_before:
+            summary_string = ', '.join('{0}_mean AS {0}'.format(param)
+                                       for param in param_string.split(', '))
+            if weighted:
+                summary_string += ', readings AS weight'
+            queries.append((None,
+                            'SELECT {}, {} '
+                            'FROM sensor_readings_hourly h '
+                            'JOIN sensors s ON s.sensor_key = h.sensor_key '
+                            '{}'
+                            .format(compact_columns, summary_string, 
+                                    value_string),
+                            DatabasePlotter._build_sql_params(
+                                sensor_numbers, time_from, 
+                                min(time_to, compacted_before - 1))))
+
+        if time_to < compacted_before:
+            return (queries)
+
+        time_from = max(time_from, compacted_before)
+        if weighted:
+            param_string += ', 1 AS weight'
+        sql_params = DatabasePlotter._build_sql_params(sensor_numbers, 
+                                                       time_from, time_to)
+
+        if self.partitions is None:
+            queries.append((None,
+                            'SELECT {}, {} '
+                            'FROM sensor_readings '
+                            '{}'
+                            .format(view_columns, param_string, value_string),
+                            sql_params))
+            return (queries)
+
+        # only partitions which overlap the time range are read
+        for partition_name in self.partitions.overlapping(time_from, time_to):
+            queries.append((partition_name,
+                            'SELECT {}, {} '
+                            'FROM {{}}.sensor_readings_compact r '
+                            'JOIN sensors s ON s.sensor_key = r.sensor_key '
+                            '{}'
+                            .format(compact_columns, param_string,
+                                    value_string),
+                            sql_params))
+        return (queries)
+
+    def retrieve_archive(self, sensor_numbers, time_from, time_to, 
+                         parameters, columns_only=False):
+        ''' Reads the readings which have been moved to archive.db (python 
+        database.py -A) for the sensors and time range, decoded from the 
+        blocks straight into NumPy arrays (see archive.py). 
+
+        Returns
+        -------
+        Dataframe in time order with the same columns as the queries from 
+        DatabasePlotter._queries() (timestampms, sensor_number and the 
+        parameters if 'columns_only'), or None if no readings in the time 
+        range have been archived.
+        '''
+
+        if self.archive is None or time_from >= self.get_archived_before():
+            return (None)
+        if isinstance(sensor_numbers, int):
+            sensor_numbers = [sensor_numbers]
+        sensor_numbers = np.asarray(sensor_numbers)
+
+        sensor_ids = self.sensor_location_info['sensor_id'].loc[
+            sensor_numbers].tolist()
+        sensors, timestamps, values = self.archive.read(
+            sensor_ids, time_from, time_to, parameters)
+        if not len(timestamps):
+            return (None)
+
+        order = np.argsort(timestamps, kind='stable')
+        sensors = sensors[order]
+        archived_data = {'timestampms': timestamps[order], 
+                         'sensor_number': sensor_numbers[sensors]}
+        if not columns_only:
+            sensor_names = np.asarray(
+                [self.sensor_name_by_number[sensor_number] 
+                 for sensor_number in sensor_numbers], dtype=object)
+            times = pd.to_datetime(archived_data['timestampms'], unit='ms')
+            archived_data = {
+                'time': None, 'timestampms': archived_data['timestampms'],
+                'timestamputc': times.strftime('%Y-%m-%d %H:%M:%S.%f')
+                .str[:-3] + '+00:00',
+                'sensor_name': sensor_names[sensors],
+                'sensor_number': archived_data['sensor_number'],
+                'sensorlocation': np.asarray(sensor_ids, 
+                                             dtype=object)[sensors]}
+        for parameter in parameters:
+            archived_data[parameter] = values[parameter][order]
+
+        return (pd.DataFrame(archived_data))
+
     def retrieve_data(self, sensor_numbers=None, time_from=None, time_to=None, 
-                      parameters=None):
+                      parameters=None, report=False):
         ''' Retrieve data from the database based on sensor number and 
         timeframe using pd.read_sql.
         https://stackoverflow.com/questions/24408557/pandas-read-sql-with-
@@ -179,10 +466,16 @@ class DatabasePlotter():
             Default will use current time
         parameters : str or list of str, optional
             Default will use all parameters
+        report : bool, optional
+            If True, prints the memory used by the dataframe before and 
+            after compacting its dtypes. Default is False.
 
         Returns
         -------
-        Dataframe of data to plot.
+        Dataframe of data to plot. Where the database has been downsampled
+        (python database.py -d), readings older than the cut-off are hourly
+        means. Parameters are float32 and names are categoricals (see 
+        Scraper._compact_dtypes()).
 
         '''
 
@@ -194,26 +487,41 @@ class DatabasePlotter():
         else:
             print('Format of input variable "parameters" not recognised.')
 
-        # string for parameter input to pd.read_sql
-        if isinstance(sensor_numbers, int):
-            sql_params = [time_from, time_to, sensor_numbers]
-        elif isinstance(sensor_numbers, list):
-            sql_params = []
-            for i in sensor_numbers:
-                sql_params = sql_params + [time_from, time_to, i]
-
-        # build string for input
-        value_string = DatabasePlotter._build_values_string(sensor_numbers)
-
-        # retrieve from database
-        data_to_plot = pd.read_sql('SELECT time, timestampms, timestamputc, '
-                                   'sensor_name, sensor_number, '
-                                   'sensorlocation, {} '
-                                   'FROM sensor_readings '
-                                   '{}'
-                                   'ORDER BY timestamputc;'
-                                   .format(param_string, value_string),
-                                   self.conn, params=sql_params)
+        if time_from is None:
+            time_from = 1580920305102  # from first sensor reading
+        if time_to is None:
+            time_to = Scraper._time_now()
+
+        # retrieve from database, and from archive.db for archived readings
+        data_to_plot = []
+        archived_data = self.retrieve_archive(sensor_numbers, time_from, 
+                                              time_to, 
+                                              param_string.split(', '))
+        if archived_data is not None:
+            data_to_plot.append(archived_data)
+        for partition_name, query, sql_params in self._queries(
+                sensor_numbers, time_from, time_to, param_string):
+            if partition_name is not None:
+                query = query.format(self.partitions.attach(partition_name))
+            data_to_plot.append(pd.read_sql(query + 'ORDER BY timestampms;',
+                                            self.conn, params=sql_params))
+
+        if data_to_plot:
+            # empty frames from read_sql have object columns, which would 
+            # make the joined columns object too
+            data_to_plot = [dataframe for dataframe in data_to_plot 
+                            if not dataframe.empty] or data_to_plot[:1]
+            data_to_plot = pd.concat(data_to_plot, ignore_index=True)
+            if archived_data is not None:
+                data_to_plot = data_to_plot.sort_values(
+                    'timestampms', kind='mergesort', ignore_index=True)
+            data_to_plot = Scraper._compact_dtypes(
+                data_to_plot, self.param_list, lossless=False, report=report)
+        else:
+            data_to_plot = pd.DataFrame(
+                columns=['time', 'timestampms', 'timestamputc', 
+                         'sensor_name', 'sensor_number', 'sensorlocation']
+                + param_string.split(', '))
 
         # error message if no data returned
         if data_to_plot.empty:
@@ -231,6 +539,74 @@ class DatabasePlotter():
 
         return (data_to_plot)
 
+    def retrieve_data_chunks(self, sensor_numbers=None, time_from=None, 
+                             time_to=None, parameters=None, chunksize=100000):
+        ''' Retrieve data from the database in chunks of 'chunksize' rows, 
+        so that very long time ranges can be processed in bounded memory. 
+        Takes the same inputs as DatabasePlotter.retrieve_data(). 
+
+        Returns
+        -------
+        Iterator of dataframes in time order, with columns timestampms 
+        (int64), sensor_number (int32), and the parameters (float32). Feed 
+        to DatabasePlotter.aggregate_data_chunks() or 
+        DatabasePlotter.decimate_data_chunks().
+        '''
+
+        if isinstance(parameters, str):
+            parameters = [parameters]
+        param_string = DatabasePlotter._build_param_string(parameters)
+
+        if time_from is None:
+            time_from = 1580920305102  # from first sensor reading
+        if time_to is None:
+            time_to = Scraper._time_now()
+
+        dtypes = {'timestampms': 'int64', 'sensor_number': 'int32'}
+        for parameter in parameters:
+            dtypes[parameter] = 'float32'
+
+        queries = self._queries(sensor_numbers, time_from, time_to, 
+                                param_string, columns_only=True)
+
+        # archived readings are older than the hourly summaries, unless they
+        # were archived after the database was downsampled
+        archived_before = self.get_archived_before()
+        compacted_before = self.get_compacted_before()
+        if archived_before > compacted_before > time_from:
+            first_queries, queries = queries[:1], queries[1:]
+        else:
+            first_queries = []
+
+        for partition_name, query, sql_params in first_queries:
+            for chunk in pd.read_sql(query + 'ORDER BY timestampms;', 
+                                     self.conn, params=sql_params, 
+                                     chunksize=chunksize):
+                yield (chunk.astype(dtypes))
+
+        # archived readings, a few days at a time (about 'chunksize' rows)
+        if self.archive is not None and time_from < archived_before:
+            n_sensors = 1 if isinstance(sensor_numbers, int) \
+                else len(sensor_numbers)
+            days = max(1, chunksize // (1440 * n_sensors))
+            for day in range(Archive.day_of(time_from), 
+                             min(time_to + 1, archived_before), 
+                             days * Archive.ms_per_day):
+                chunk = self.retrieve_archive(
+                    sensor_numbers, max(time_from, day), 
+                    min(time_to, day + days * Archive.ms_per_day - 1), 
+                    parameters, columns_only=True)
+                if chunk is not None:
+                    yield (chunk.astype(dtypes))
+
+        for partition_name, query, sql_params in queries:
+            if partition_name is not None:
+                query = query.format(self.partitions.attach(partition_name))
+            for chunk in pd.read_sql(query + 'ORDER BY timestampms;', 
+                                     self.conn, params=sql_params, 
+                                     chunksize=chunksize):
+                yield (chunk.astype(dtypes))
+
     def plot_setup(self, data_to_plot, aggregate=0):
         ''' Initialise dataframe and return variables required by 
         DatabasePlotter.plot_from_dataframe()'''
@@ -260,8 +636,8 @@ class DatabasePlotter():
 
             # generate plot title
             if len(room_numbers) == 1:
-                total_sensors_in_room = len(self.sensors_in_room(
-                    self.all_sensor_numbers, room_names[0]))
+                total_sensors_in_room = len(
+                    self.sensors_by_room[room_names[0]])
                 plot_title = str('Data from {}/{} sensors in {}'
                                  .format(len(sensor_numbers), 
                                          total_sensors_in_room, 
@@ -269,8 +645,7 @@ class DatabasePlotter():
             else:
                 total_num_sensors = 0
                 for room_name in room_names:
-                    total_num_sensors += len(self.sensors_in_room(
-                        self.all_sensor_numbers, room_name))
+                    total_num_sensors += len(self.sensors_by_room[room_name])
 
                 plot_title = str('Data from {}/{} sensors in {} rooms'
                                  .format(len(sensor_numbers), 
@@ -313,8 +688,8 @@ class DatabasePlotter():
 
             # generate plot title and legend series
             if len(room_numbers) == 1:
-                total_sensors_in_room = len(self.sensors_in_room(
-                    self.all_sensor_numbers, room_names[0]))
+                total_sensors_in_room = len(
+                    self.sensors_by_room[room_names[0]])
                 plot_title = str('Aggregated data from {}/{} sensors in {}'
                                  .format(len(sensor_numbers_ints), 
                                          total_sensors_in_room, 
@@ -325,13 +700,13 @@ class DatabasePlotter():
             else:
                 total_in_all_rooms = 0
                 legend_series = []
+                sensors_by_room = self.group_by_room(sensor_numbers_ints)
 
                 for room_number, room_name in zip(self.room_numbers,
                                                   self.room_names):
-                    total_in_room = len(self.sensors_in_room(
-                        self.all_sensor_numbers, room_name))
+                    total_in_room = len(self.sensors_by_room[room_name])
                     included_from_room = len(
-                        self.sensors_in_room(sensor_numbers_ints, room_name))
+                        sensors_by_room.get(room_name, []))
                     total_in_all_rooms += total_in_room
                     legend_str = str(
                         'Room number {}:\n        {} (n={}/{})'
@@ -383,7 +758,84 @@ class DatabasePlotter():
                 room_names, param_labels, plot_labels, legend_series, 
                 plot_title, file_name)
 
-    def plot_from_dataframe(self, data_to_plot, aggregate=0):
+    @staticmethod
+    def _lttb_indices(x, y, n_out):
+        ''' Returns positions of the 'n_out' points chosen from x and y by
+        the Largest-Triangle-Three-Buckets algorithm. The first and last
+        points are always kept. Each bucket in between keeps the point which
+        makes the largest triangle with the point kept from the previous
+        bucket and the mean of the next bucket, so peaks are kept.'''
+
+        n = len(x)
+        if n_out >= n or n_out < 3:
+            return (np.arange(n))
+
+        # n_out - 2 buckets between the first and last points
+        edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+        edges = np.append(edges, n)
+
+        selected = np.empty(n_out, dtype=int)
+        selected[0] = 0
+        selected[-1] = n - 1
+        a = 0
+        for i in range(n_out - 2):
+            start, end = edges[i], edges[i + 1]
+            next_start, next_end = edges[i + 1], edges[i + 2]
+            mean_x = x[next_start:next_end].mean()
+            mean_y = y[next_start:next_end].mean()
+            area = np.abs((x[a] - mean_x) * (y[start:end] - y[a]) -
+                          (x[a] - x[start:end]) * (mean_y - y[a]))
+            a = start + int(np.argmax(area))
+            selected[i + 1] = a
+
+        return (selected)
+
+    @staticmethod
+    def _minmax_indices(y, n_out):
+        ''' Returns positions of the minimum and maximum of y in each of
+        'n_out' / 2 equal buckets, in order, plus the first and last points.
+        '''
+
+        n = len(y)
+        n_buckets = n_out // 2
+        if n_out >= n or n_buckets < 1:
+            return (np.arange(n))
+
+        bucket = np.arange(n) * n_buckets // n
+
+        # sort by bucket then value: the first in each bucket is the minimum
+        # and the last is the maximum
+        order = np.lexsort((y, bucket))
+        firsts = np.flatnonzero(np.diff(bucket[order], prepend=-1))
+        lasts = np.append(firsts[1:] - 1, n - 1)
+
+        return (np.unique(np.concatenate(
+            ([0, n - 1], order[firsts], order[lasts]))))
+
+    @staticmethod
+    def _decimate(series, n_out, method='lttb'):
+        ''' Reduces a series with a datetime index to about 'n_out' points
+        using 'lttb' (Largest-Triangle-Three-Buckets) or 'minmax' (minimum
+        and maximum of each bucket). Missing values are dropped first.'''
+
+        series = series.dropna()
+        if len(series) <= n_out:
+            return (series)
+
+        y = series.to_numpy(dtype=float)
+        if method == 'lttb':
+            x = series.index.asi8.astype(float)
+            selected = DatabasePlotter._lttb_indices(x, y, n_out)
+        elif method == 'minmax':
+            selected = DatabasePlotter._minmax_indices(y, n_out)
+        else:
+            sys.exit("Unknown decimation method '{}'. Use 'lttb' or "
+                     "'minmax'.".format(method))
+
+        return (series.iloc[selected])
+
+    def plot_from_dataframe(self, data_to_plot, aggregate=0, decimate=None,
+                            show=True, dpi=500, file_format='png'):
         ''' Plot sensor data retrieved from database with 
         DatabasePlotter.retrieve_data(). Plots all types of data from one 
         sensor number. No upper limit on how many datapoints. This is called 
@@ -392,7 +844,20 @@ class DatabasePlotter():
         data_to_plot = dataframe from DatabasePlotter.retrieve_data()
         sensor_number = int which corresponds to index in 
             'scraper.sensor_location_info'.
+        decimate = None to plot every point, or 'lttb' or 'minmax' to reduce 
+            each series to about one point per pixel of the plot width before 
+            plotting (see DatabasePlotter._decimate()).
+        show = True to show the plot after saving it, False to close it (for 
+            batch use, see DatabasePlotter.export_plots()).
+        dpi = resolution of the saved file.
+        file_format = format of the saved file, e.g. 'png', 'pdf', 'svg'.
+
+        Returns the name of the saved file.
         '''
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
+        from pandas.plotting import register_matplotlib_converters
+        register_matplotlib_converters()
 
         # check there is data to plot and warn if none.
         if data_to_plot.empty:
@@ -416,12 +881,24 @@ class DatabasePlotter():
         if len(param_labels) == 1:
             axes = [axes]
 
+        # adjust position of plots so there is room for text in legend. 
+        # defaults: left = 0.125  right = 0.9
+        plt.subplots_adjust(left=0.125, right=0.75)
+
+        # number of points to keep in each series if decimating: one per 
+        # pixel of the width of the axes
+        points_per_series = int(axes[0].get_window_extent().width)
+
         # loops for plotting
         for j in range(0, len(param_labels)):
             for i, sensor_number in enumerate(sensor_numbers, start=0):
                 current_data = data_to_plot[param_labels[j]].loc[
                     data_to_plot['sensor_number'] == sensor_number]
 
+                if decimate is not None:
+                    current_data = DatabasePlotter._decimate(
+                        current_data, points_per_series, decimate)
+
                 axes[j].plot(current_data, label=legend_series[i],
                              marker='.', alpha=0.5,
                              linewidth=1.5,
@@ -434,10 +911,6 @@ class DatabasePlotter():
         # get handles and labels for legend
         handles, labels = axes[-1].get_legend_handles_labels()
 
-        # adjust position of plots so there is room for text in legend. 
-        # defaults: left = 0.125  right = 0.9
-        plt.subplots_adjust(left=0.125, right=0.75)
-
         # set legend
         leg = axes[0].legend(handles, labels, frameon=False, 
                              fontsize=fontsizeL, markerscale=3, 
@@ -461,12 +934,117 @@ class DatabasePlotter():
         axes[-1].xaxis.set_major_formatter(formatter)
 
         # save the plot
-        fig.savefig(file_name, dpi=500)
+        file_name = os.path.splitext(file_name)[0] + '.' + file_format
+        fig.savefig(file_name, dpi=dpi, format=file_format)
 
-        # show the plot
-        plt.show()
+        # show the plot, or free the memory if not showing it
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
 
-        return
+        return (file_name)
+
+    def get_occupancy_cube(self, by='room'):
+        '''
+        Returns the mean occupancy for each hour of the week (0 = Monday 
+        00:00 to 01:00 UTC) from the 'occupancy_cube' table kept by 
+        database.py, without reading the readings. As for 
+        DatabasePlotter.aggregate_data(), the occupancy of a room is the sum 
+        over its sensors, and of a floor the sum over its rooms. The floor 
+        is the start of the sensor name (e.g. '2' for '2-Desks:229-232').
+
+        Parameters
+        ----------
+        by : str, optional
+            'room' (default), 'floor', or 'sensor'.
+
+        Returns
+        -------
+        Dataframe with a row for each room, floor, or sensor, and a column 
+        for each of the 168 hours of the week.
+        '''
+
+        try:
+            cube = pd.read_sql('SELECT s.sensor_name AS sensor_name, '
+                               's.room_name AS room_name, '
+                               'c.hour_of_week AS hour_of_week, '
+                               'c.occupancy_sum / c.minutes AS occupancy '
+                               'FROM occupancy_cube c '
+                               'JOIN sensors s ON s.sensor_id = '
+                               'c.sensorlocation '
+                               'WHERE c.minutes > 0;', self.conn)
+        except Exception:
+            sys.exit('No hour of week occupancy in the database. Build it '
+                     'with: python database.py -o')
+
+        cube['floor'] = cube['sensor_name'].str.split('-').str[0]
+        group = {'room': 'room_name', 'floor': 'floor', 
+                 'sensor': 'sensor_name'}[by]
+
+        return (cube.groupby([group, 'hour_of_week'])['occupancy'].sum()
+                .unstack().reindex(columns=range(168)).sort_index())
+
+    def plot_occupancy_heatmap(self, by='room', show=True, dpi=500, 
+                               file_format='png'):
+        '''
+        Plots a heatmap of the mean occupancy of each room (or floor) for 
+        each hour of the week, from DatabasePlotter.get_occupancy_cube(), so 
+        it only reads the hour of week totals and takes the same time 
+        however long the history is. Rooms are in order of floor.
+
+        by = 'room' (default), 'floor', or 'sensor'.
+        show = True to show the plot after saving it, False to close it.
+        dpi = resolution of the saved file.
+        file_format = format of the saved file, e.g. 'png', 'pdf', 'svg'.
+
+        Returns the name of the saved file.
+        '''
+        import matplotlib.pyplot as plt
+        from pandas.plotting import register_matplotlib_converters
+        register_matplotlib_converters()
+
+        cube = self.get_occupancy_cube(by)
+        if cube.empty:
+            print('No data to plot.')
+            return
+
+        # size of small and large text
+        fontsizeL = 18
+        fontsizeS = 16
+
+        fig, ax = plt.subplots(figsize=(20, max(4, 0.4 * len(cube) + 2)))
+        image = ax.imshow(cube.to_numpy(dtype=float), aspect='auto', 
+                          cmap='viridis', interpolation='nearest')
+
+        ax.set_xticks(range(0, 168, 24))
+        ax.set_xticklabels(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+                           ha='left', fontsize=fontsizeS)
+        ax.set_xticks(range(0, 168, 6), minor=True)
+        ax.set_yticks(range(len(cube)))
+        if by == 'floor':
+            ax.set_yticklabels(['Floor {}'.format(floor) 
+                                for floor in cube.index], fontsize=fontsizeS)
+        else:
+            ax.set_yticklabels(cube.index, fontsize=fontsizeS)
+        ax.set_xlabel('Hour of the week (UTC)', fontsize=fontsizeL)
+
+        colorbar = fig.colorbar(image, ax=ax)
+        colorbar.set_label('Mean occupancy\n(n, sum)', fontsize=fontsizeL)
+        ax.set_title('Mean occupancy by {} and hour of the week'.format(by), 
+                     fontsize=fontsizeL * 1.5)
+        fig.tight_layout()
+
+        os.makedirs('./Plots', exist_ok=True)
+        file_name = './Plots/occupancy_heatmap_{}.{}'.format(by, file_format)
+        fig.savefig(file_name, dpi=dpi, format=file_format)
+
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
+
+        return (file_name)
 
     def aggregate_data(self, data_to_aggregate, parameters):
         ''' Aggregates the data from all sensors in the dataframe providing 
@@ -507,14 +1085,9 @@ class DatabasePlotter():
         sensor_numbers, sensor_names, room_number, room_name = \
             self.get_names_and_numbers(sensors=sensor_numbers)
 
-        # round times in data_to_aggregate to the nearest minute
-        data_to_aggregate['timestamputc'] = \
-            pd.to_datetime(data_to_aggregate['timestampms'], unit='ms')
-        data_to_aggregate['timestamputc'] = \
-            data_to_aggregate['timestamputc'].dt.floor('Min')
+        # round times in data_to_aggregate down to the minute
         data_to_aggregate['timestampms'] = \
-            data_to_aggregate[['timestamputc']].apply(
-                lambda x: x[0].timestamp(), axis=1).astype('int64') * 1000
+            data_to_aggregate['timestampms'] // 60000 * 60000
 
         # aggregate to get mean reading per sensor per minute
         mean_per_minute_per_sensor = data_to_aggregate.groupby(
@@ -538,9 +1111,9 @@ class DatabasePlotter():
         aggregated_data['timestampms'] = aggregated_data.index
 
         # add 1 ns to preserve time format. (could be better way to do this).
-        aggregated_data['timestamputc'] = aggregated_data['timestampms'] \
-            .apply(lambda t: dt.datetime.utcfromtimestamp(int(t / 1000))
-                   .isoformat() + '.000001+00:00')
+        aggregated_data['timestamputc'] = pd.to_datetime(
+            aggregated_data['timestampms'], unit='ms').dt.strftime(
+                '%Y-%m-%dT%H:%M:%S') + '.000001+00:00'
 
         #  set columns for the ouput dataframe from strings made earlier.
         aggregated_data['room_name'] = room_name[0]
@@ -550,6 +1123,397 @@ class DatabasePlotter():
 
         return (aggregated_data)
 
+    def aggregate_data_chunks(self, chunks, parameters):
+        ''' Incremental version of DatabasePlotter.aggregate_data() for the 
+        chunks from DatabasePlotter.retrieve_data_chunks(). Gives the same 
+        result: the mean per sensor per minute, then the sum of occupancy 
+        and mean of every other parameter over the sensors. Only the sums and 
+        counts for the minute at the end of each chunk are carried over to 
+        the next, so memory use depends on the number of minutes in the 
+        output rather than the number of readings. Sensors must be in the 
+        same room.
+
+        Parameters
+        ----------
+        chunks : iterator of panda dataframes
+            From DatabasePlotter.retrieve_data_chunks(), in time order.
+        parameters : list of str
+            List of parameter strs
+
+        Returns
+        -------
+        New dataframe of aggregated data, as DatabasePlotter.aggregate_data().
+        '''
+
+        if isinstance(parameters, str):
+            parameters = [parameters]
+
+        aggregated_data = []
+        sensor_numbers = set()
+
+        # sums and counts per sensor for the last minute of the last chunk
+        carried_sums = None
+        carried_counts = None
+
+        for chunk in chunks:
+            sensor_numbers.update(chunk['sensor_number'].unique().tolist())
+
+            # round times down to the minute
+            chunk['timestampms'] = chunk['timestampms'] // 60000 * 60000
+            grouped = chunk.groupby(['timestampms', 'sensor_number'])[
+                parameters]
+            sums = grouped.sum(min_count=1).astype('float64')
+            counts = grouped.count()
+
+            if carried_sums is not None:
+                sums = pd.concat([carried_sums, sums]).groupby(
+                    level=[0, 1]).sum(min_count=1)
+                counts = pd.concat([carried_counts, counts]).groupby(
+                    level=[0, 1]).sum()
+
+            # the last minute may continue in the next chunk
+            minutes = sums.index.get_level_values('timestampms')
+            unfinished = minutes == minutes.max()
+            carried_sums = sums[unfinished]
+            carried_counts = counts[unfinished]
+
+            aggregated_data.append(DatabasePlotter._combine_sensors(
+                sums[~unfinished] / counts[~unfinished]))
+
+        if carried_sums is None:
+            return (pd.DataFrame())
+
+        aggregated_data.append(DatabasePlotter._combine_sensors(
+            carried_sums / carried_counts))
+        aggregated_data = pd.concat(aggregated_data)
+
+        # find the room name and number from the sensor numbers
+        sensor_numbers, sensor_names, room_number, room_name = \
+            self.get_names_and_numbers(sensors=sorted(sensor_numbers))
+
+        # set the index to timestampms
+        aggregated_data['timestampms'] = aggregated_data.index
+
+        # add 1 ns to preserve time format, as DatabasePlotter.aggregate_data()
+        aggregated_data['timestamputc'] = pd.to_datetime(
+            aggregated_data['timestampms'], unit='ms').dt.strftime(
+                '%Y-%m-%dT%H:%M:%S') + '.000001+00:00'
+
+        #  set columns for the ouput dataframe
+        aggregated_data['room_name'] = room_name[0]
+        aggregated_data['room_number'] = room_number[0]
+        aggregated_data['sensor_name'] = str(', '.join(sensor_names))
+        aggregated_data['sensor_number'] = str(
+            ', '.join(str(x) for x in sensor_numbers))
+
+        return (aggregated_data)
+
+    @staticmethod
+    def _combine_sensors(mean_per_minute_per_sensor):
+        ''' Combines means per sensor per minute (indexed by timestampms and 
+        sensor_number) into the sum of occupancy and mean of every other 
+        parameter per minute.'''
+
+        combined = mean_per_minute_per_sensor.groupby(
+            level='timestampms').mean()
+        if 'occupancy' in combined.columns:
+            combined['occupancy'] = mean_per_minute_per_sensor.groupby(
+                level='timestampms')['occupancy'].sum()
+        return (combined)
+
+    def aggregate_data_sql(self, sensor_numbers, time_from=None,
+                           time_to=None, parameters=None, bucket_minutes=1):
+        ''' Aggregates in the database, so only the aggregated rows are read
+        into python. Gives the same result as DatabasePlotter.aggregate_data()
+        for one minute buckets: the mean per sensor per bucket, then the sum
+        of occupancy and mean of every other parameter over the sensors in
+        each room. Sensors from several rooms give one aggregated series per
+        room, from a single query.
+
+        Hourly means (python database.py -d) are weighted by the number of
+        readings they summarise. Buckets should divide a day (e.g. 5, 60 or
+        1440 minutes) so that they do not cross monthly partitions.
+
+        Parameters
+        ----------
+        sensor_numbers : int or list of ints
+        time_from : time from in ms format, optional
+            Default will use earliest sensor reading
+        time_to : time to in ms format, optional
+            Default will use current time
+        parameters : str or list of str, optional
+            Default will use all parameters
+        bucket_minutes : int, optional
+            Width of the time buckets in minutes. Default = 1.
+
+        Returns
+        -------
+        New dataframe of aggregated data, as DatabasePlotter.aggregate_data().
+        The sensor names and numbers are those requested in each room.
+        '''
+
+        if isinstance(sensor_numbers, int):
+            sensor_numbers = [sensor_numbers]
+        if parameters is None:
+            parameters = self.param_list
+        elif isinstance(parameters, str):
+            parameters = [parameters]
+        param_string = DatabasePlotter._build_param_string(parameters)
+
+        if time_from is None:
+            time_from = 1580920305102  # from first sensor reading
+        if time_to is None:
+            time_to = Scraper._time_now()
+
+        bucket_ms = int(bucket_minutes * 60000)
+
+        # mean per sensor per bucket, weighted by the readings in each row
+        sensor_means = ', '.join(
+            'TOTAL({0} * weight) / '
+            'SUM(CASE WHEN {0} IS NULL THEN 0 ELSE weight END) AS {0}'
+            .format(parameter) for parameter in parameters)
+
+        # sum of occupancy and mean of the rest over the sensors in each room
+        room_values = ', '.join(
+            ('TOTAL({0}) AS {0}' if parameter == 'occupancy'
+             else 'AVG({0}) AS {0}').format(parameter)
+            for parameter in parameters)
+
+        # the queries for one statement must have their partitions attached
+        # at the same time
+        statements = [[]]
+        attached = 0
+        for query in self._queries(sensor_numbers, time_from, time_to,
+                                   param_string, columns_only=True,
+                                   weighted=True):
+            if query[0] is not None:
+                if attached == Partitions.max_attached:
+                    statements.append([])
+                    attached = 0
+                attached += 1
+            statements[-1].append(query)
+
+        aggregated_data = []
+        for queries in statements:
+            if not queries:
+                continue
+            sql_params = []
+            union = []
+            for partition_name, query, query_params in queries:
+                if partition_name is not None:
+                    query = query.format(
+                        self.partitions.attach(partition_name))
+                union.append(query)
+                sql_params += query_params
+            aggregated_data.append(pd.read_sql(
+                'SELECT s.room_name AS room_name, b.bucket AS timestampms, {} '
+                'FROM (SELECT CAST(timestampms AS INTEGER) / {} * {} '
+                'AS bucket, sensor_number, {} '
+                'FROM ({}) GROUP BY bucket, sensor_number) b '
+                'JOIN sensors s ON s.sensor_number = b.sensor_number '
+                'GROUP BY s.room_name, b.bucket '
+                'ORDER BY s.room_name, b.bucket;'
+                .format(room_values, bucket_ms, bucket_ms, sensor_means,
+                        ' UNION ALL '.join(union)),
+                self.conn, params=sql_params))
+
+        # archived readings are aggregated in the same way from the decoded
+        # blocks
+        archived_data = self.retrieve_archive(sensor_numbers, time_from, 
+                                              time_to, parameters, 
+                                              columns_only=True)
+        if archived_data is not None:
+            archived_data['timestampms'] = \
+                archived_data['timestampms'] // bucket_ms * bucket_ms
+            sensor_means = archived_data.groupby(
+                ['timestampms', 'sensor_number']).mean().reset_index()
+            sensor_means['room_name'] = sensor_means['sensor_number'].map(
+                self.room_name_by_sensor_number)
+            rooms = sensor_means.groupby(['room_name', 'timestampms'])
+            room_means = rooms[parameters].mean()
+            if 'occupancy' in parameters:
+                room_means['occupancy'] = rooms['occupancy'].sum()
+            aggregated_data.insert(0, room_means.reset_index())
+
+        if not aggregated_data:
+            return (pd.DataFrame())
+        # empty frames from read_sql have object columns, which would make 
+        # the joined columns object too
+        aggregated_data = pd.concat(
+            [dataframe for dataframe in aggregated_data 
+             if not dataframe.empty] or aggregated_data[:1])
+        if aggregated_data.empty:
+            return (aggregated_data)
+        if archived_data is not None:
+            aggregated_data = aggregated_data.sort_values(
+                ['room_name', 'timestampms'], kind='mergesort')
+
+        # add 1 ns to preserve time format, as DatabasePlotter.aggregate_data()
+        aggregated_data['timestamputc'] = pd.to_datetime(
+            aggregated_data['timestampms'], unit='ms').dt.strftime(
+                '%Y-%m-%dT%H:%M:%S') + '.000001+00:00'
+
+        # set columns for the output dataframe from the sensors in each room
+        sensor_names = {}
+        sensor_numbers_str = {}
+        sensors_by_room = self.group_by_room(sensor_numbers)
+        for room_name in aggregated_data['room_name'].unique():
+            sensors_in_room = sensors_by_room.get(room_name, [])
+            sensor_names[room_name] = str(', '.join(
+                self.sensor_name_by_number[sensor_number]
+                for sensor_number in sensors_in_room))
+            sensor_numbers_str[room_name] = str(', '.join(
+                str(x) for x in sensors_in_room))
+        aggregated_data['room_number'] = aggregated_data['room_name'].map(
+            self.room_number_by_name)
+        aggregated_data['sensor_name'] = aggregated_data['room_name'].map(
+            sensor_names)
+        aggregated_data['sensor_number'] = aggregated_data['room_name'].map(
+            sensor_numbers_str)
+
+        return (aggregated_data.set_index('timestampms', drop=False))
+
+    def get_quantiles(self, parameter, quantiles=(0.5, 0.95), sensors=None,
+                      rooms=None, time_from=None, time_to=None, by=None,
+                      period_hours=None):
+        '''
+        Returns approximate percentiles of a parameter by merging the hourly
+        quantile sketches stored at ingest (see sketches.py), so the readings
+        are not read. Each percentile is within 1% of the value of the 
+        reading at that rank (QuantileSketch.relative_accuracy).
+
+        Parameters
+        ----------
+        parameter : str
+            e.g. 'co2'
+        quantiles : list of floats from 0 to 1, optional
+            Default = (0.5, 0.95), the median and 95th percentile.
+        sensors, rooms :
+            As for DatabasePlotter.plot_from_database(). Default is all.
+        time_from : time from in ms format, optional
+            Default will use earliest sensor reading
+        time_to : time to in ms format, optional
+            Default will use current time. Whole hours are used, from the 
+            hour containing time_from to the hour containing time_to.
+        by : str, optional
+            None (default) to merge all the sensors, 'sensor' for each 
+            sensor, or 'room' for each room.
+        period_hours : int, optional
+            Length of the periods to split the time range into, from the 
+            hour containing time_from, e.g. 168 for weeks. Default = None 
+            (one period).
+
+        Returns
+        -------
+        Dataframe with a row for each sensor or room and period (by 
+        'sensor_number' or 'room_name', and 'period_start' in ms), the 
+        number of readings, and a column for each percentile (e.g. 'p95').
+        '''
+
+        if parameter not in self.param_list:
+            sys.exit("Parameter '{}' not recognised.".format(parameter))
+        sensor_numbers, _, _, _ = self.get_names_and_numbers(
+            sensors=sensors, rooms=rooms)
+        if sensor_numbers is None:
+            sensor_numbers = self.all_sensor_numbers
+        if time_from is None:
+            time_from = 1580920305102  # from first sensor reading
+        if time_to is None:
+            time_to = Scraper._time_now()
+        first_hour = time_from // 3600000 * 3600000
+
+        try:
+            sketches = pd.read_sql(
+                'SELECT s.sensor_number AS sensor_number, '
+                's.room_name AS room_name, k.hour AS hour, k.keys AS keys, '
+                'k.counts AS counts FROM sensor_sketches k '
+                'JOIN sensors s ON s.sensor_id = k.sensorlocation '
+                'WHERE k.parameter = ? AND k.hour BETWEEN ? AND ? '
+                'AND s.sensor_number IN ({});'
+                .format(', '.join('?' * len(sensor_numbers))),
+                self.conn, params=[parameter, first_hour, time_to] + 
+                list(sensor_numbers))
+        except Exception:
+            sys.exit('No quantile sketches in the database. Build them with: '
+                     'python database.py -s')
+
+        groups = {None: [], 'sensor': ['sensor_number'], 
+                  'room': ['room_name']}[by]
+        if period_hours is not None:
+            period_ms = int(period_hours * 3600000)
+            sketches['period_start'] = first_hour + \
+                (sketches['hour'] - first_hour) // period_ms * period_ms
+            groups = groups + ['period_start']
+
+        names = ['p{:g}'.format(quantile * 100) for quantile in quantiles]
+        rows = []
+        for group, group_sketches in (sketches.groupby(groups) if groups 
+                                      else [((), sketches)]):
+            keys, counts = QuantileSketch.merge(
+                [np.frombuffer(blob, dtype=np.int16) 
+                 for blob in group_sketches['keys']],
+                [np.frombuffer(blob, dtype=np.int32) 
+                 for blob in group_sketches['counts']])
+            rows.append(list(group if isinstance(group, tuple) else (group,))
+                        + [int(counts.sum())] + 
+                        list(QuantileSketch.quantiles(keys, counts, 
+                                                      quantiles)))
+
+        return (pd.DataFrame(rows, columns=groups + ['readings'] + names))
+
+    def decimate_data_chunks(self, chunks, parameters, time_from, time_to, 
+                             points=1250):
+        ''' Reduces the chunks from DatabasePlotter.retrieve_data_chunks() to 
+        the minimum and maximum of each parameter for each sensor in each of 
+        'points' / 2 equal time buckets from 'time_from' to 'time_to'. Only 
+        the extremes found so far are kept between chunks, so memory use 
+        depends on 'points' and the number of sensors, not the number of 
+        readings. Peaks are kept. The default of 1250 points is about one 
+        per pixel of the plots made by DatabasePlotter.plot_from_dataframe().
+
+        Returns
+        -------
+        Dataframe which can be plotted with 
+        DatabasePlotter.plot_from_dataframe(). Each row holds the extreme of 
+        one parameter, so other parameters are missing (NaN) in that row.
+        '''
+
+        if isinstance(parameters, str):
+            parameters = [parameters]
+
+        n_buckets = max(points // 2, 1)
+        extremes = {parameter: [] for parameter in parameters}
+
+        for chunk in chunks:
+            chunk['bucket'] = (chunk['timestampms'] - time_from) * \
+                n_buckets // (time_to - time_from + 1)
+            for parameter in parameters:
+                current_data = pd.concat(
+                    extremes[parameter] + [chunk[['timestampms', 
+                                                  'sensor_number', 'bucket', 
+                                                  parameter]].dropna()], 
+                    ignore_index=True)
+                grouped = current_data.groupby(['sensor_number', 'bucket'])[
+                    parameter]
+                keep = pd.concat([grouped.idxmin(), 
+                                  grouped.idxmax()]).unique()
+                extremes[parameter] = [current_data.loc[keep]]
+
+        decimated_data = pd.concat(
+            [frame for frames in extremes.values() for frame in frames], 
+            ignore_index=True)
+        if decimated_data.empty:
+            return (decimated_data)
+
+        decimated_data = decimated_data.drop(columns='bucket').sort_values(
+            by=['sensor_number', 'timestampms'], ignore_index=True)
+        decimated_data['timestamputc'] = pd.to_datetime(
+            decimated_data['timestampms'], unit='ms', utc=True)
+        decimated_data['sensor_name'] = decimated_data['sensor_number'].map(
+            self.sensor_name_by_number)
+
+        return (decimated_data)
+
     def set_defaults(self):
         '''
         Sets plotting parameters of DatabasePlotter() class. Sets only those
@@ -796,10 +1760,6 @@ class DatabasePlotter():
 
         '''
 
-        # use these to simplify code in the following sections
-        sensor_info = self.sensor_location_info
-        room_info = self.room_info
-
         # put into a list if not already so function can deal with it
         if isinstance(sensors, int) or isinstance(sensors, str):
             sensors = [sensors]
@@ -809,48 +1769,44 @@ class DatabasePlotter():
         if sensors != None:
             # if sensor numbers, define sensor names and numbers
             if isinstance(sensors[0], int):
-                sensor_numbers = sensor_info.loc[sensors].sort_index(
-                ).index.unique().tolist()
-                sensor_names = sensor_info['sensor_name']\
-                    .loc[sensor_numbers].tolist()
+                sensor_numbers = sorted(
+                    {sensor for sensor in sensors 
+                     if sensor in self.sensor_name_by_number})
             # if sensor names, define sensor names and numbers
             elif isinstance(sensors[0], str):
-                sensor_names = \
-                    sensor_info.loc[sensor_info['sensor_name'].isin(
-                    sensors)]['sensor_name'].tolist()
-                sensor_numbers = \
-                    sensor_info.loc[sensor_info['sensor_name'].isin(
-                    sensor_names)].index.tolist()
-
-            # get a list of which room each sensor is in with no duplicates
-            room_names = sensor_info['room_name'].loc[sensor_numbers].unique(
-            ).tolist()
-            # sort these so they are in order of room number
-            room_names = room_info.loc[room_info['room_name'].isin(
-                room_names)]['room_name'].tolist()
-            # get corresponding numbers
-            room_numbers = room_info.loc[room_info['room_name'].isin(
-                room_names)].index.tolist()
+                sensor_numbers = sorted(
+                    {self.sensor_number_by_name[sensor] for sensor in sensors 
+                     if sensor in self.sensor_number_by_name})
+            sensor_names = [self.sensor_name_by_number[sensor_number] 
+                            for sensor_number in sensor_numbers]
+
+            # get the rooms containing these sensors, in order of room number
+            room_numbers = sorted(
+                {self.room_number_by_name[room_name] for room_name in 
+                 map(self.room_name_by_sensor_number.get, sensor_numbers) 
+                 if room_name in self.room_number_by_name})
+            room_names = [self.room_name_by_number[room_number] 
+                          for room_number in room_numbers]
         elif rooms != None:
             # if room numbers, define room names and numbers
             if isinstance(rooms[0], int):
-                room_numbers = room_info.loc[rooms].sort_index(
-                ).index.unique().tolist()
-                room_names = room_info['room_name'].loc[room_numbers].tolist()
-            # if sensor names, define sensor names and numbers
+                room_numbers = sorted(
+                    {room for room in rooms 
+                     if room in self.room_name_by_number})
+            # if room names, define room names and numbers
             elif isinstance(rooms[0], str):
-                room_names = room_info.loc[room_info['room_name'].isin(
-                    rooms)]['room_name'].tolist()
-                room_numbers = room_info.loc[room_info['room_name'].isin(
-                    room_names)].index.tolist()
-
-            sensor_numbers = sensor_info.loc[sensor_info['room_name'].isin(
-                room_names)].index.tolist()
-            # get a list of which room each sensor is in with no duplicates 
-            # and get room numbers from these
-            sensor_names = \
-                sensor_info['sensor_name'].loc[sensor_numbers].unique(
-                    ).tolist()
+                room_numbers = sorted(
+                    {self.room_number_by_name[room] for room in rooms 
+                     if room in self.room_number_by_name})
+            room_names = [self.room_name_by_number[room_number] 
+                          for room_number in room_numbers]
+
+            # get all the sensors in these rooms
+            sensor_numbers = sorted(
+                sensor_number for room_name in room_names 
+                for sensor_number in self.sensors_by_room[room_name])
+            sensor_names = [self.sensor_name_by_number[sensor_number] 
+                            for sensor_number in sensor_numbers]
         elif sensors == None and rooms == None:
             sensor_numbers = None
             sensor_names = None
@@ -870,7 +1826,7 @@ class DatabasePlotter():
                            rooms=None, time_from=None, 
                            time_to=None, parameters=None, 
                            overlay=None, aggregate=None, 
-                           seperate=None):
+                           seperate=None, decimate=None, chunksize=None):
         '''
         Evaluates inputs to plot from database. Determines whether user 
         to take user input to from command line, and if not, plots using the 
@@ -893,6 +1849,14 @@ class DatabasePlotter():
             If str: ['0-Café', '0-Exhibition-Area', '2-Open-Office']
             Can also read individual values not in lists. 
             Default collects all available.
+        decimate : STR, optional
+            'lttb' or 'minmax' to reduce each plotted series to about one 
+            point per pixel, which keeps peaks and makes plots of long time 
+            ranges much faster. Default (None) plots every point.
+        chunksize : INT, optional
+            Read the data in chunks of this many rows and aggregate or 
+            decimate ('minmax') as it is read, so that plots of the full 
+            history use bounded memory. Default (None) reads all data at once.
 
         See DatabasePlotter.set_defaults() docstring for further information 
         on parameters.
@@ -910,6 +1874,8 @@ class DatabasePlotter():
         self.overlay = overlay
         self.aggregate = aggregate
         self.seperate = seperate
+        self.decimate = decimate
+        self.chunksize = chunksize
 
         # retrieve room and sensor names and numbers from the list of ints 
         # or str input in sensors or rooms
@@ -926,125 +1892,476 @@ class DatabasePlotter():
                       '(all).')
             self.set_defaults()
 
+        for job in self._plot_jobs():
+            self._plot_job(job)
+
+        return
+
+    def _plot_jobs(self):
+        ''' Returns a list of the figures to plot with the current plotting 
+        parameters (see DatabasePlotter.set_defaults()). Each is a tuple of:
+            - description: str printed when the figure is plotted
+            - sensor_groups: list of lists of sensor numbers. If aggregating,
+              each list is aggregated (one per room), otherwise there is one 
+              list of all sensors in the figure.
+            - aggregate: 0 or 1
+        '''
+
+        jobs = []
+
         # %% aggregate = 0 overlay = 0
         if self.aggregate == 0 and self.overlay == 0:
             for sensor_number, sensor_name in zip(self.sensor_numbers, 
                                                   self.sensor_names):
-                data_to_plot = self.retrieve_data(sensor_number, 
-                                                  self.time_from, 
-                                                  self.time_to, 
-                                                  self.parameters)
-                if not data_to_plot.empty:
-                    print('Plotting data from sensor {}: {}...'.format(
-                        sensor_number, sensor_name))
-                    self.plot_from_dataframe(data_to_plot)
-                else:
-                    continue
-            return
+                jobs.append(('Plotting data from sensor {}: {}...'
+                             .format(sensor_number, sensor_name), 
+                             [[sensor_number]], 0))
 
         # %% aggregate = 0 overlay = 1
         elif self.aggregate == 0 and self.overlay == 1:
             if self.seperate == 1:
+                sensors_by_room = self.group_by_room(self.sensor_numbers)
                 for room_number, room_name in zip(self.room_numbers, 
                                                   self.room_names):
-                    sensors_in_current_room = self.sensors_in_room(
-                        self.sensor_numbers, room_name)
-                    data_to_plot = self.retrieve_data(sensors_in_current_room, 
-                                                      self.time_from, 
-                                                      self.time_to, 
-                                                      self.parameters)
-                    if not data_to_plot.empty:
-                        print('Plotting overlaid data from {} sensors from '
-                              'room {}: {}...'
-                             .format(len(sensors_in_current_room), 
-                                     room_number, room_name))
-                        self.plot_from_dataframe(data_to_plot)
-                    else:
-                        continue
+                    sensors_in_current_room = sensors_by_room.get(room_name, 
+                                                                  [])
+                    jobs.append(('Plotting overlaid data from {} sensors from '
+                                 'room {}: {}...'
+                                 .format(len(sensors_in_current_room), 
+                                         room_number, room_name), 
+                                 [sensors_in_current_room], 0))
             else:
-                data_to_plot = self.retrieve_data(self.sensor_numbers, 
-                                                  self.time_from, 
-                                                  self.time_to, 
-                                                  self.parameters)
-                if not data_to_plot.empty:
-                    print('Plotting overlaid data from {} sensors from {} '
-                          'room(s)...'
-                          .format(len(self.sensor_numbers), 
-                                  len(self.room_numbers)))
-                    self.plot_from_dataframe(data_to_plot)
-                    return
-                else:
-                    return
+                jobs.append(('Plotting overlaid data from {} sensors from {} '
+                             'room(s)...'
+                             .format(len(self.sensor_numbers), 
+                                     len(self.room_numbers)), 
+                             [self.sensor_numbers], 0))
 
         # %% aggregate = 1 overlay = 0
         elif self.aggregate == 1 and self.overlay == 0:
+            sensors_by_room = self.group_by_room(self.sensor_numbers)
             for room_number, room_name in zip(self.room_numbers, 
                                               self.room_names):
-                sensors_in_current_room = self.sensors_in_room(
-                    self.sensor_numbers, room_name)
-                data_to_plot = self.retrieve_data(sensors_in_current_room, 
-                                                  self.time_from, 
-                                                  self.time_to, 
-                                                  self.parameters)
-                if not data_to_plot.empty:
-                    print('Aggregating data for {} sensors in room {}: {}...'
-                          .format(len(sensors_in_current_room), room_number, 
-                                  room_name))
-                    aggregated_data = self.aggregate_data(
-                        data_to_plot, self.parameters)
-                    print('Plotting aggregated data from {} sensors from '
-                          'room {}: {}...'
-                          .format(len(sensors_in_current_room), room_number, 
-                                  room_name))
-                    self.plot_from_dataframe(aggregated_data, aggregate=1)
-                else:
-                    continue
-            return
+                sensors_in_current_room = sensors_by_room.get(room_name, [])
+                jobs.append(('Plotting aggregated data from {} sensors from '
+                             'room {}: {}...'
+                             .format(len(sensors_in_current_room), 
+                                     room_number, room_name), 
+                             [sensors_in_current_room], 1))
 
         # %% aggregate = 1 overlay = 1
         elif self.aggregate == 1 and self.overlay == 1:
-            aggregated_dfs = pd.DataFrame
-            for room_number, room_name in zip(self.room_numbers, 
-                                              self.room_names):
-                sensors_in_current_room = self.sensors_in_room(
-                    self.sensor_numbers, room_name)
-                data_to_plot = self.retrieve_data(sensors_in_current_room, 
+            sensors_by_room = self.group_by_room(self.sensor_numbers)
+            sensor_groups = [sensors_by_room.get(room_name, []) 
+                             for room_name in self.room_names]
+            jobs.append(('Plotting available data from {} sensors from {} '
+                         'rooms, aggregated and overlaid...'
+                         .format(len(self.sensor_numbers), 
+                                 len(self.room_numbers)), 
+                         sensor_groups, 1))
+
+        return (jobs)
+
+    def _plot_job(self, job, show=True, dpi=500, file_format='png'):
+        ''' Retrieves the data for one job from DatabasePlotter._plot_jobs(), 
+        aggregates it if required, and plots it. Returns the name of the 
+        saved file, or None if there was no data.'''
+
+        description, sensor_groups, aggregate = job
+
+        # %% not aggregated: all sensors on one plot
+        if aggregate == 0:
+            if self.chunksize is None:
+                data_to_plot = self.retrieve_data(sensor_groups[0], 
                                                   self.time_from, 
                                                   self.time_to, 
                                                   self.parameters)
-                if not data_to_plot.empty:
-                    print('Aggregating data for {} sensors in room {}: {}...'
-                          .format(len(sensors_in_current_room), room_number, 
-                                  room_name))
-                    aggregated_data = self.aggregate_data(
-                        data_to_plot, self.parameters)
-                    if aggregated_dfs.empty:
-                        aggregated_dfs = aggregated_data.copy()
-                    else:
-                        aggregated_dfs = pd.concat(
-                            [aggregated_dfs, aggregated_data], axis=0)
-                else:
-                    continue
-            print('Plotting available data from {} sensors from {} rooms, '
-                  'aggregated and overlaid...'
-                  .format(len(self.sensor_numbers), len(self.room_numbers)))
-            self.plot_from_dataframe(aggregated_dfs, aggregate=1)
+                decimate = self.decimate
+            else:
+                # read in chunks, keeping only the extremes for each pixel
+                data_to_plot = self.decimate_data_chunks(
+                    self.retrieve_data_chunks(sensor_groups[0], 
+                                              self.time_from, self.time_to, 
+                                              self.parameters, 
+                                              self.chunksize), 
+                    self.parameters, self.time_from, self.time_to)
+                decimate = 'minmax'
+            if data_to_plot.empty:
+                return
+            print(description)
+            return (self.plot_from_dataframe(data_to_plot, 
+                                             decimate=decimate, 
+                                             show=show, dpi=dpi, 
+                                             file_format=file_format))
+
+        # %% aggregated: one aggregated series per room
+        if self.chunksize is None:
+            # aggregate all rooms in the database with one grouped query
+            sensor_numbers = [sensor_number for sensors_in_current_room 
+                              in sensor_groups 
+                              for sensor_number in sensors_in_current_room]
+            print('Aggregating data for {} sensors in {} room(s)...'
+                  .format(len(sensor_numbers), len(sensor_groups)))
+            aggregated_dfs = self.aggregate_data_sql(
+                sensor_numbers, self.time_from, self.time_to, self.parameters)
+        else:
+            # read in chunks and aggregate as it goes, then join the rooms 
+            # once at the end
+            aggregated_dfs = []
+            for sensors_in_current_room in sensor_groups:
+                _, _, room_numbers, room_names = self.get_names_and_numbers(
+                    sensors=sensors_in_current_room)
+                print('Aggregating data for {} sensors in room {}: {} in '
+                      'chunks of {} rows...'
+                      .format(len(sensors_in_current_room), room_numbers[0], 
+                              room_names[0], self.chunksize))
+                aggregated_dfs.append(self.aggregate_data_chunks(
+                    self.retrieve_data_chunks(sensors_in_current_room, 
+                                              self.time_from, self.time_to, 
+                                              self.parameters, 
+                                              self.chunksize), 
+                    self.parameters))
+            aggregated_dfs = pd.concat(aggregated_dfs)
+
+        if aggregated_dfs.empty:
             return
+        print(description)
+        return (self.plot_from_dataframe(aggregated_dfs, aggregate=1, 
+                                         decimate=self.decimate, show=show, 
+                                         dpi=dpi, file_format=file_format))
+
+    def export_plots(self, sensors=None, rooms=None, time_from=None, 
+                     time_to=None, parameters=None, overlay=None, 
+                     aggregate=None, seperate=None, decimate=None, 
+                     chunksize=None, dpi=500, file_format='png', 
+                     processes=None):
+        '''
+        Saves the same plots as DatabasePlotter.plot_from_database() to 
+        './Plots/' without showing them, for batch use (e.g. a nightly report 
+        of every room and sensor). Plots are drawn with the non-interactive 
+        'Agg' backend by a pool of processes, each with its own connection to 
+        the database, so the time taken scales with the number of cores.
+
+        Parameters
+        ----------
+        sensors, rooms, time_from, time_to, parameters, overlay, aggregate, 
+        seperate, decimate, chunksize :
+            As for DatabasePlotter.plot_from_database(). Unset parameters 
+            use the defaults (no prompts).
+        dpi : INT, optional
+            Resolution of the saved files. Default = 500.
+        file_format : STR, optional
+            Format of the saved files, e.g. 'png', 'pdf', 'svg'. 
+            Default = 'png'.
+        processes : INT, optional
+            Number of processes to plot with. Default = number of cores. 
+            With 1, plots are drawn in this process.
+
+        Returns
+        -------
+        List of the names of the saved files.
+        '''
+
+        self.time_from = time_from
+        self.time_to = time_to
+        self.parameters = parameters
+        self.overlay = overlay
+        self.aggregate = aggregate
+        self.seperate = seperate
+        self.decimate = decimate
+        self.chunksize = chunksize
+        self.sensor_numbers, self.sensor_names, self.room_numbers, \
+            self.room_names = self.get_names_and_numbers(sensors=sensors,
+                                                         rooms=rooms)
+        self.set_defaults()
+
+        jobs = self._plot_jobs()
+        settings = (self.time_from, self.time_to, self.parameters, 
+                    self.decimate, self.chunksize, dpi, file_format)
+
+        print('Exporting {} plot(s)...'.format(len(jobs)))
+
+        if processes == 1:
+            import matplotlib.pyplot as plt
+            plt.switch_backend('Agg')
+            file_names = [self._plot_job(job, show=False, dpi=dpi, 
+                                         file_format=file_format) 
+                          for job in jobs]
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=processes, 
+                    initializer=DatabasePlotter._init_export_worker) as pool:
+                file_names = list(pool.map(DatabasePlotter._export_job, jobs, 
+                                           [settings] * len(jobs)))
+
+        file_names = [file_name for file_name in file_names 
+                      if file_name is not None]
+        print('Exported {} plot(s) to ./Plots/.'.format(len(file_names)))
+
+        return (file_names)
+
+    # DatabasePlotter used by each process of DatabasePlotter.export_plots()
+    _export_worker = None
+
+    @staticmethod
+    def _init_export_worker():
+        ''' Sets up a process for DatabasePlotter.export_plots(): switches to 
+        the non-interactive backend and opens its own connection to the 
+        database.'''
+        import matplotlib.pyplot as plt
+        plt.switch_backend('Agg')
+        DatabasePlotter._export_worker = DatabasePlotter()
+
+    @staticmethod
+    def _export_job(job, settings):
+        ''' Plots and saves one job from DatabasePlotter._plot_jobs() in a 
+        process set up by DatabasePlotter._init_export_worker(). '''
+        plotter = DatabasePlotter._export_worker
+        plotter.time_from, plotter.time_to, plotter.parameters, \
+            plotter.decimate, plotter.chunksize, dpi, file_format = settings
+        return (plotter._plot_job(job, show=False, dpi=dpi, 
+                                  file_format=file_format))
+
+    def plot_live(self, sensors=None, rooms=None, parameters=None, 
+                  window_minutes=360, interval_seconds=60, refreshes=None, 
+                  lateness_minutes=10):
+        '''
+        Plots the readings from the last 'window_minutes' and keeps the plot 
+        up to date as database.py adds readings. The figure and its lines are 
+        kept: every 'interval_seconds' only readings from 'lateness_minutes' 
+        before the newest reading seen onwards are read from the database, 
+        and those newer than the last timestampms seen for their sensor are 
+        added to the end of the lines. Readings older than the window are 
+        dropped from the start. Only the lines are redrawn (blitting), 
+        unless the newest reading passes the right of the time axis or a 
+        value falls outside the y axis, when the whole figure is redrawn 
+        with the axes moved on.
+
+        Parameters
+        ----------
+        sensors, rooms, parameters :
+            As for DatabasePlotter.plot_from_database(). Default is all.
+        window_minutes : FLOAT, optional
+            Length of the time window shown in minutes. Default = 360.
+        interval_seconds : FLOAT, optional
+            Time between checks for new readings. Default = 60.
+        refreshes : INT, optional
+            Number of checks before returning. Default = None (until the 
+            figure is closed or Ctrl+C is pressed).
+        lateness_minutes : FLOAT, optional
+            How far behind the newest reading a sensor's readings can reach 
+            the database and still be plotted. Sensors which send nothing 
+            do not hold the checks back. Default = 10.
+
+        Returns
+        -------
+        The figure.
+        '''
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
+        from pandas.plotting import register_matplotlib_converters
+        register_matplotlib_converters()
+
+        sensor_numbers, sensor_names, _, _ = self.get_names_and_numbers(
+            sensors=sensors, rooms=rooms)
+        if sensor_numbers is None:
+            sensor_numbers = self.all_sensor_numbers
+            sensor_names = self.all_sensor_names
+        if parameters is None:
+            parameters = self.param_list
+        elif isinstance(parameters, str):
+            parameters = [parameters]
+
+        window_ms = int(window_minutes * 60000)
+        lateness_ms = int(lateness_minutes * 60000)
+        # room on the right of the time axis, so it only moves now and then
+        margin_ms = max(window_ms // 10, int(interval_seconds * 1000))
+
+        # size of small and large text
+        fontsizeL = 18
+        fontsizeS = 16
+
+        fig, axes = plt.subplots(len(parameters), figsize=(20, 15), 
+                                 sharex=True, squeeze=False)
+        axes = axes[:, 0]
+        plt.subplots_adjust(left=0.125, right=0.75)
+
+        # one line and buffer for each parameter and sensor. Lines are 
+        # 'animated' so they are left out of the saved background.
+        lines = {}
+        buffers = {}
+        for ax, parameter in zip(axes, parameters):
+            for sensor_number, sensor_name in zip(sensor_numbers, 
+                                                  sensor_names):
+                lines[parameter, sensor_number], = ax.plot(
+                    [], [], label=sensor_name, marker='.', alpha=0.5, 
+                    linewidth=1.5, markersize=6, animated=True)
+                buffers[parameter, sensor_number] = _RollingBuffer()
+            ax.set_ylabel(self.plot_labels[self.param_list.index(parameter)], 
+                          rotation='horizontal', ha='right', va='baseline', 
+                          fontsize=fontsizeL, wrap=True)
+
+        handles, labels = axes[-1].get_legend_handles_labels()
+        leg = axes[0].legend(handles, labels, frameon=False, 
+                             fontsize=fontsizeL, markerscale=3, 
+                             bbox_to_anchor=(1, 1))
+        for line in leg.get_lines():
+            line.set_linewidth(3)
+        fig.suptitle('Live data from {} sensors'.format(len(sensor_numbers)), 
+                     y=.95, fontsize=fontsizeL * 2)
+        plt.xlabel('Time', fontsize=fontsizeL)
+        plt.rcParams.update({'font.size': fontsizeS + 2})
+        locator = mdates.AutoDateLocator(minticks=4, maxticks=8)
+        axes[-1].xaxis.set_major_locator(locator)
+        axes[-1].xaxis.set_major_formatter(
+            mdates.ConciseDateFormatter(locator))
+
+        # after every full draw, save the background without the lines and 
+        # draw the lines on top
+        background = {}
+
+        def on_draw(event):
+            background['figure'] = fig.canvas.copy_from_bbox(fig.bbox)
+            for line in lines.values():
+                line.axes.draw_artist(line)
+        fig.canvas.mpl_connect('draw_event', on_draw)
+
+        # the first check reads the whole window
+        last_seen = dict.fromkeys(sensor_numbers, 
+                                  Scraper._time_now() - window_ms)
+        x_max = None
+        refresh = 0
+
+        plt.show(block=False)
+        try:
+            while plt.fignum_exists(fig.number):
+                newest, out_of_range = self._append_live_readings(
+                    sensor_numbers, parameters, last_seen, window_ms, 
+                    lateness_ms, lines, buffers)
+
+                if x_max is None or newest > x_max or out_of_range:
+                    x_max = newest + margin_ms
+                    DatabasePlotter._rescale_live_axes(
+                        axes, parameters, sensor_numbers, buffers, 
+                        x_max - margin_ms - window_ms, x_max)
+                    fig.canvas.draw()
+                elif 'figure' in background:
+                    fig.canvas.restore_region(background['figure'])
+                    for line in lines.values():
+                        line.axes.draw_artist(line)
+                    fig.canvas.blit(fig.bbox)
+                fig.canvas.flush_events()
+
+                refresh += 1
+                if refreshes is not None and refresh >= refreshes:
+                    break
+                # keeps the window responsive without redrawing
+                fig.canvas.start_event_loop(interval_seconds)
+        except KeyboardInterrupt:
+            pass
+
+        return (fig)
+
+    def _append_live_readings(self, sensor_numbers, parameters, last_seen, 
+                              window_ms, lateness_ms, lines, buffers):
+        ''' Reads the readings newer than 'last_seen' (a dict of sensor 
+        number to the last ms time read, which is updated) and no more than 
+        'lateness_ms' older than the newest reading seen, for 
+        DatabasePlotter.plot_live(), adds them to the buffers, drops readings 
+        older than the window, and updates the lines. Returns the ms time of 
+        the newest reading and whether a new value is outside the y axis of 
+        its plot.'''
+        import matplotlib.dates as mdates
+
+        time_now = Scraper._time_now()
+        # from the newest reading of any sensor, so sensors which have 
+        # stopped sending do not make every check read the whole window
+        time_from = max(max(last_seen.values()) - lateness_ms, 
+                        time_now - window_ms) + 1
+
+        new_readings = list(self.retrieve_data_chunks(
+            sensor_numbers, time_from, time_now, parameters))
+        if new_readings:
+            new_readings = pd.concat(new_readings, ignore_index=True)
+            # sensors may be a little behind the others, so each is added 
+            # from its own last time
+            new_readings = new_readings.loc[
+                new_readings['timestampms'].to_numpy() > 
+                new_readings['sensor_number'].map(last_seen).to_numpy()]
+            last_seen.update(new_readings.groupby('sensor_number')
+                             ['timestampms'].max().to_dict())
+        else:
+            new_readings = pd.DataFrame(columns=['timestampms', 
+                                                 'sensor_number'])
+
+        newest = max(last_seen.values())
+        x_min = mdates.date2num(np.datetime64(newest - window_ms, 'ms'))
+
+        out_of_range = False
+        for sensor_number, readings in new_readings.groupby('sensor_number'):
+            x = mdates.date2num(readings['timestampms'].to_numpy()
+                                .astype('datetime64[ms]'))
+            for parameter in parameters:
+                y = readings[parameter].to_numpy(dtype=float)
+                keep = ~np.isnan(y)
+                buffers[parameter, sensor_number].append(x[keep], y[keep])
+                if keep.any():
+                    y_min, y_max = \
+                        lines[parameter, sensor_number].axes.get_ylim()
+                    out_of_range = (out_of_range or y[keep].min() < y_min 
+                                    or y[keep].max() > y_max)
+
+        for key, line in lines.items():
+            buffers[key].drop_before(x_min)
+            line.set_data(*buffers[key].data())
+
+        return (newest, out_of_range)
+
+    @staticmethod
+    def _rescale_live_axes(axes, parameters, sensor_numbers, buffers, 
+                           time_from, time_to):
+        ''' Sets the time axis of DatabasePlotter.plot_live() from 
+        'time_from' to 'time_to' (ms time epoch) and fits each y axis to the 
+        readings in the buffers, with some space above and below.'''
+        import matplotlib.dates as mdates
+
+        axes[-1].set_xlim(mdates.date2num(np.datetime64(time_from, 'ms')), 
+                          mdates.date2num(np.datetime64(time_to, 'ms')))
+        for ax, parameter in zip(axes, parameters):
+            values = [buffers[parameter, sensor_number].data()[1] 
+                      for sensor_number in sensor_numbers]
+            values = [y for y in values if len(y)]
+            if not values:
+                continue
+            y_min = min(y.min() for y in values)
+            y_max = max(y.max() for y in values)
+            space = (y_max - y_min) * 0.1 or 1
+            ax.set_ylim(y_min - space, y_max + space)
 
     def sensors_in_room(self, sensor_numbers, room_name):
-        ''' Returns all sensors in a list which are in a specified room. List 
-        does not have to be complete list of sensors.'''
+        ''' Returns all sensors in a list which are in a specified room, in 
+        order of sensor number. List does not have to be complete list of 
+        sensors, and is not changed. For several rooms, use 
+        DatabasePlotter.group_by_room() once instead.'''
+
+        return (self.group_by_room(sensor_numbers).get(room_name, []))
+
+    def group_by_room(self, sensor_numbers):
+        ''' Returns a dict of room name to the sensors in 'sensor_numbers' 
+        which are in that room, in order of sensor number. Each sensor's room 
+        is looked up once, so the time taken depends on the number of 
+        sensors given and not on the number of rooms.'''
 
-        sensor_numbers.sort()
-        sensors_in_current_room = []
-        for sensor_number in sensor_numbers:
-            if self.sensor_location_info['room_name'].loc[sensor_number] \
-                == room_name: 
-                    sensors_in_current_room.append(sensor_number)
-        return (sensors_in_current_room)
+        groups = {}
+        for sensor_number in sorted(set(sensor_numbers)):
+            groups.setdefault(self.room_name_by_sensor_number.get(
+                sensor_number), []).append(sensor_number)
+        return (groups)
 
     def __del__(self):
         '''Destructor commits any remaining data to the database and closes 
         the connection'''
         print("Closing connection to the database")
         self.conn.close()
+        if self.archive is not None:
+            self.archive.close()
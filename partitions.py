@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+partitions.py
+
+Time-partitioned storage for sensor readings. When partitioning is turned on
+(python database.py -p), readings are stored in one SQLite file per month in
+the 'partitions' folder, e.g. './partitions/readings_2020_05.db', instead of
+in database.db. Each file holds a 'sensor_readings_compact' table with the
+same columns as the compact layout (see compact_database.sql), and is attached
+to the connection to database.db only when it is needed. The 'partitions'
+table in database.db lists the files and the times they cover.
+
+Since each month is a separate file, old months can be vacuumed, backed up,
+or archived without touching the rest of the history.
+
+"""
+import calendar
+import datetime as dt
+import os
+
+
+class Partitions():
+    '''Routes readings to monthly partition files and attaches them to an
+    open connection to database.db on demand.
+    '''
+
+    # folder containing the partition files
+    path = './partitions/'
+
+    # SQLite allows 10 attached databases by default. Keep some spare.
+    max_attached = 8
+
+    create_table = ('CREATE TABLE IF NOT EXISTS {}.sensor_readings_compact('
+                    'sensor_key INTEGER NOT NULL, '
+                    'timestampms INTEGER NOT NULL, '
+                    'co2 INTEGER, humidity FLOAT, lux INTEGER, '
+                    'noise INTEGER, occupancy INTEGER, pressure INTEGER, '
+                    'temperature FLOAT, voc INTEGER, '
+                    'PRIMARY KEY (sensor_key, timestampms)) WITHOUT ROWID;')
+
+    def __init__(self, conn):
+
+        self.conn = conn
+        self.c = conn.cursor()
+
+        # names of the attached partitions, least recently used first
+        self.attached = []
+
+    @staticmethod
+    def enabled(conn):
+        ''' Returns True if the database has been partitioned (i.e. has a
+        'partitions' table).'''
+        result = conn.execute("SELECT name FROM sqlite_master "
+                              "WHERE type = 'table' "
+                              "AND name = 'partitions';").fetchone()
+        return (result is not None)
+
+    @staticmethod
+    def create_catalog(conn):
+        ''' Creates the 'partitions' table which lists the partition files.
+        '''
+        conn.execute('CREATE TABLE IF NOT EXISTS partitions ('
+                     'partition_name VARCHAR(255) PRIMARY KEY, '
+                     'file_name VARCHAR(255), '
+                     'time_from INTEGER, '  # first ms time in partition
+                     'time_to INTEGER);')  # first ms time of next partition
+
+    @staticmethod
+    def name_for(timestampms):
+        ''' Returns the name of the partition (e.g. 'readings_2020_05')
+        containing the ms time epoch 'timestampms'.'''
+        month = dt.datetime.utcfromtimestamp(int(timestampms) // 1000)
+        return ('readings_{:04d}_{:02d}'.format(month.year, month.month))
+
+    @staticmethod
+    def bounds(partition_name):
+        ''' Returns the first ms time in the partition and the first ms time
+        of the next partition.'''
+        year, month = map(int, partition_name.split('_')[1:])
+        if month == 12:
+            next_year, next_month = year + 1, 1
+        else:
+            next_year, next_month = year, month + 1
+        time_from = calendar.timegm((year, month, 1, 0, 0, 0)) * 1000
+        time_to = calendar.timegm((next_year, next_month, 1, 0, 0, 0)) * 1000
+        return (time_from, time_to)
+
+    def overlapping(self, time_from, time_to):
+        ''' Returns names of existing partitions which overlap the time range
+        from 'time_from' to 'time_to' (ms time epoch, inclusive).'''
+        self.c.execute('SELECT partition_name FROM partitions '
+                       'WHERE time_to > ? AND time_from <= ? '
+                       'ORDER BY time_from;', [time_from, time_to])
+        return ([row[0] for row in self.c.fetchall()])
+
+    def attach(self, partition_name, create=False):
+        ''' Attaches the partition file so that its table can be used as
+        '<schema>.sensor_readings_compact' and returns the schema name. With
+        'create', the file and its entry in 'partitions' are created if they
+        do not exist yet. Any open transaction is committed first, as SQLite
+        cannot attach or detach inside one.'''
+
+        schema = partition_name.replace('readings_', 'p_')
+
+        if partition_name in self.attached:
+            self.attached.remove(partition_name)
+            self.attached.append(partition_name)
+            return (schema)
+
+        file_name = os.path.join(Partitions.path, partition_name + '.db')
+        if not create and not os.path.exists(file_name):
+            raise IOError("Partition file '{}' not found.".format(file_name))
+
+        self.conn.commit()
+        if len(self.attached) >= Partitions.max_attached:
+            self.detach(self.attached[0])
+
+        os.makedirs(Partitions.path, exist_ok=True)
+        self.c.execute('ATTACH DATABASE ? AS {};'.format(schema), [file_name])
+        self.attached.append(partition_name)
+
+        if create:
+            # lets old partitions give back space in small steps after
+            # readings are deleted (only takes effect on new files)
+            self.c.execute('PRAGMA {}.auto_vacuum = INCREMENTAL;'
+                           .format(schema))
+            self.c.execute(Partitions.create_table.format(schema))
+            time_from, time_to = Partitions.bounds(partition_name)
+            self.c.execute('INSERT OR IGNORE INTO partitions (partition_name, '
+                           'file_name, time_from, time_to) VALUES(?,?,?,?)',
+                           [partition_name, file_name, time_from, time_to])
+            self.conn.commit()
+
+        return (schema)
+
+    def detach(self, partition_name):
+        ''' Detaches the partition file.'''
+        self.conn.commit()
+        self.c.execute('DETACH DATABASE {};'
+                       .format(partition_name.replace('readings_', 'p_')))
+        self.attached.remove(partition_name)
+
+    def detach_all(self):
+        ''' Detaches all attached partition files.'''
+        for partition_name in list(self.attached):
+            self.detach(partition_name)
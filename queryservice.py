@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+queryservice.py
+
+A local, read-only HTTP service for querying 'database.db', so that
+dashboards and notebooks can share one set of open connections instead of
+each loading the database. Run it from the directory containing database.db:
+
+    python queryservice.py --port 8050 --connections 4
+
+Requests are answered by a pool of read-only DatabasePlotter() instances (one
+per connection), so several queries can run at the same time. The endpoints
+are:
+
+    /readings   readings from DatabasePlotter.retrieve_data()
+    /aggregate  aggregated readings per room from
+                DatabasePlotter.aggregate_data_sql()
+
+and take the following query string arguments (all optional):
+
+    sensors         sensor numbers or names, comma separated (default: all)
+    rooms           room numbers or names, comma separated (instead of sensors)
+    time_from       ms time epoch (default: first reading)
+    time_to         ms time epoch (default: now)
+    parameters      comma separated (default: all)
+    bucket_minutes  width of the time buckets for /aggregate (default: 1)
+    format          'json' (default) or 'csv'
+
+For example:
+
+    http://127.0.0.1:8050/aggregate?rooms=0-Café&parameters=occupancy,co2
+        &time_from=1588590000000&bucket_minutes=60
+
+JSON is columnar: {"rows": n, "columns": {"occupancy": [...], ...}}, with
+null for missing values. Responses are gzip compressed if the client accepts
+it. Each response has a weak ETag made from the time of the last insert by
+database.py (weak, as the gzip and uncompressed bodies share it), so clients
+which send it back in 'If-None-Match' are answered with '304 Not Modified'
+until new readings are added.
+
+"""
+import argparse
+from databaseplot import DatabasePlotter
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+from urllib.parse import parse_qs, urlsplit
+
+
+class QueryService():
+    '''Holds the pool of read-only DatabasePlotter() instances and answers
+    queries for the HTTP handler.
+    '''
+
+    # responses smaller than this are not worth compressing
+    min_compress_bytes = 1024
+
+    def __init__(self, connections=4):
+
+        self.pool = queue.Queue()
+        for _ in range(connections):
+            self.pool.put(DatabasePlotter(read_only=True))
+
+    def etag(self, plotter):
+        ''' Returns the ETag for the current state of the database, from the
+        ingest watermark and the downsampling cut-off, or None if no insert
+        has been recorded. It is a weak ETag, as the same data is sent
+        compressed or not.'''
+        watermark = plotter.get_ingest_watermark()
+        if not watermark:
+            return (None)
+        return ('W/"{}-{}"'.format(watermark, plotter.get_compacted_before()))
+
+    @staticmethod
+    def _matches(etag, if_none_match):
+        ''' Returns True if the ETag is in the 'If-None-Match' header, which
+        is compared weakly (with or without the W/).'''
+        if etag is None or not if_none_match:
+            return (False)
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return ('*' in tags or etag in tags or etag[2:] in tags)
+
+    @staticmethod
+    def _split(values):
+        ''' Splits comma separated values, as ints if they are all digits.'''
+        values = [value.strip() for value in values.split(',')
+                  if value.strip()]
+        if all(value.isdigit() for value in values):
+            return ([int(value) for value in values])
+        return (values)
+
+    @staticmethod
+    def _arguments(plotter, query):
+        ''' Checks the query string arguments and returns the sensor numbers,
+        time from, time to, parameters, and bucket minutes. Raises a
+        ValueError if an argument is not recognised.'''
+
+        arguments = {key: values[-1] for key, values
+                     in parse_qs(query, keep_blank_values=True).items()}
+
+        sensors = arguments.get('sensors')
+        rooms = arguments.get('rooms')
+        if sensors:
+            sensor_numbers, _, _, _ = plotter.get_names_and_numbers(
+                sensors=QueryService._split(sensors))
+        elif rooms:
+            sensor_numbers, _, _, _ = plotter.get_names_and_numbers(
+                rooms=QueryService._split(rooms))
+        else:
+            sensor_numbers = plotter.all_sensor_numbers
+        if not sensor_numbers:
+            raise ValueError('No sensors found for the sensors or rooms.')
+
+        # parameters are put into the SQL, so only known names are allowed
+        parameters = arguments.get('parameters')
+        if parameters:
+            parameters = QueryService._split(parameters)
+            for parameter in parameters:
+                if parameter not in plotter.param_list:
+                    raise ValueError("Parameter '{}' not recognised. Choose "
+                                     "from: {}.".format(
+                                         parameter,
+                                         ', '.join(plotter.param_list)))
+        else:
+            parameters = plotter.param_list
+
+        time_from = arguments.get('time_from')
+        time_to = arguments.get('time_to')
+        time_from = int(time_from) if time_from else None
+        time_to = int(time_to) if time_to else None
+
+        bucket_minutes = float(arguments.get('bucket_minutes') or 1)
+        if bucket_minutes <= 0:
+            raise ValueError('bucket_minutes must be greater than 0.')
+
+        return (sensor_numbers, time_from, time_to, parameters,
+                bucket_minutes)
+
+    @staticmethod
+    def to_json(dataframe):
+        ''' Returns the dataframe as columnar JSON bytes. Each column is
+        written by pandas in one go, with null for missing values.'''
+        columns = ', '.join(
+            '{}: {}'.format(json.dumps(str(column)),
+                            dataframe[column].to_json(orient='values'))
+            for column in dataframe.columns)
+        return ('{{"rows": {}, "columns": {{{}}}}}'
+                .format(len(dataframe), columns).encode('utf-8'))
+
+    def query(self, path, query, if_none_match=None):
+        ''' Runs the query for the endpoint at 'path'. Returns the status
+        code, content type, body (bytes), and ETag.'''
+
+        if path not in ('/readings', '/aggregate'):
+            return (404, 'text/plain', b'Not found. Use /readings or '
+                    b'/aggregate.', None)
+
+        plotter = self.pool.get()
+        try:
+            etag = self.etag(plotter)
+            if QueryService._matches(etag, if_none_match):
+                return (304, None, b'', etag)
+
+            try:
+                sensor_numbers, time_from, time_to, parameters, \
+                    bucket_minutes = QueryService._arguments(plotter, query)
+                if path == '/readings':
+                    dataframe = plotter.retrieve_data(
+                        sensor_numbers, time_from, time_to, parameters)
+                else:
+                    dataframe = plotter.aggregate_data_sql(
+                        sensor_numbers, time_from, time_to, parameters,
+                        bucket_minutes)
+            # DatabasePlotter calls sys.exit() for inputs it cannot use
+            except (SystemExit, ValueError) as e:
+                return (400, 'text/plain', str(e).encode('utf-8'), None)
+        finally:
+            self.pool.put(plotter)
+
+        if parse_qs(query).get('format', ['json'])[-1] == 'csv':
+            return (200, 'text/csv; charset=utf-8',
+                    dataframe.to_csv(index=False).encode('utf-8'), etag)
+        return (200, 'application/json', QueryService.to_json(dataframe),
+                etag)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''Answers GET requests using the QueryService() of the server.'''
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            status, content_type, body, etag = self.server.service.query(
+                url.path, url.query, self.headers.get('If-None-Match'))
+        except Exception as e:
+            print("Error: ", e)
+            status, content_type, body, etag = \
+                500, 'text/plain', str(e).encode('utf-8'), None
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+            if (len(body) >= QueryService.min_compress_bytes and 'gzip' in
+                    self.headers.get('Accept-Encoding', '')):
+                body = gzip.compress(body, compresslevel=5)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=8050, connections=4):
+    ''' Serves queries on http://127.0.0.1:<port>/ until interrupted.'''
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), QueryHandler)
+    server.service = QueryService(connections)
+    print('Serving database.db on http://127.0.0.1:{}/ (readings and '
+          'aggregate). Press Ctrl+C to stop.'.format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# %% Program starts here
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', dest='port', type=int, default=8050,
+                        help="Port to serve on (default: 8050)")
+    parser.add_argument('--connections', dest='connections', type=int,
+                        default=4,
+                        help="Number of read-only connections to database.db "
+                             "(default: 4)")
+    args = parser.parse_args()
+
+    serve(args.port, args.connections)
@@ -18,16 +18,22 @@ Created on Thu Oct 17 16:11:16 2019
 @author: Thomas Richards
 
 """
-import getpass  # required to keep password invisible
-from matplotlib.ticker import MaxNLocator
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import json
 import pandas as pd
-import requests as r  # required to access API
 import sys
 import time
 import datetime as dt
-from dateutil.parser import parse
+
+# orjson decodes the API responses faster, if it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The HTTP (requests), password (getpass), date parsing (dateutil), and 
+# plotting (matplotlib) modules are imported by the functions which use them, 
+# so that importing this module (e.g. for Scraper._time_now() in 
+# databaseplot.py, or database.py -c/-p/-d) does not load them.
 
 
 class Scraper():
@@ -35,6 +41,10 @@ class Scraper():
     constant variables.
     '''
 
+    # measurements returned by the API for each sensor reading
+    param_list = ['occupancy', 'voc', 'co2', 'temperature', 'pressure',
+                  'humidity', 'lux', 'noise']
+
     def __init__(self, login=True):
 
         self.username, self.password, self.building_info = \
@@ -51,6 +61,12 @@ class Scraper():
         self.room_info = self.get_room_info()
         print("Room information retrieved successfully.")
 
+        # lookups of API ids to managed space and sensor numbers
+        self.space_number_by_id = dict(zip(
+            self.managed_space_info['id'], self.managed_space_info.index))
+        self.sensor_number_by_id = dict(zip(
+            self.sensor_location_info['id'], self.sensor_location_info.index))
+
     @staticmethod
     def _login(auto=True):
         '''Obtain and check username and password for Smart Building API.
@@ -70,6 +86,32 @@ class Scraper():
 
         '''
 
+        import requests as r  # required to access API
+
+        username, password = Scraper._ask_login(auto)
+
+        # Use 'building' API function to check username and password.
+        response = r.get(
+            'https://console.beringar.co.uk/api/building/',
+            auth=(username, password))
+        responsecheck = response.status_code
+
+        # Sucess code = 200, Failed = 400 (simplified).
+        if 200 <= responsecheck < 300:
+            building_info = Scraper._building_info(
+                Scraper._decode_json(response.content))
+            return (username, password, building_info)
+
+        # If here then we weren't able to log on.
+        raise Exception(
+            'Problem logging in. Response code: {} (success = 200).'
+            .format(responsecheck))
+
+    @staticmethod
+    def _ask_login(auto=True):
+        ''' Returns the username and password, from the parameters file if 
+        'auto', otherwise from user input (see Scraper._login()).'''
+
         username = ""
         password = ""
 
@@ -85,31 +127,26 @@ class Scraper():
             else:
                 # Enter password manually. Password is hidden (external only)
                 # console if using Spyder.'''
+                import getpass  # required to keep password invisible
                 password = getpass.getpass(prompt='Password:')
 
-        # Use 'building' API function to check username and password.
-        response = r.get(
-            'https://console.beringar.co.uk/api/building/',
-            auth=(username, password))
-        responsecheck = response.status_code
+        return (username, password)
 
-        # Sucess code = 200, Failed = 400 (simplified).
-        if 200 <= responsecheck < 300:
-            # Obtain building name from response
-            building_info = pd.DataFrame(response.json())
-            building_info['buildingnumber'] = list(
-                range(1, len(building_info) + 1))
-            building_info = building_info.set_index('buildingnumber')
-
-            print('Login successful.\nBuilding info aquired successfully '
-                  'from {} building(s). First building: {}.'
-                  .format(len(building_info), building_info['name'].loc[1]))
-            return (username, password, building_info)
+    @staticmethod
+    def _building_info(building_json):
+        ''' Returns the building info dataframe from the json returned by the 
+        'building' API function.'''
 
-        # If here then we weren't able to log on.
-        raise Exception(
-            'Problem logging in. Response code: {} (success = 200).'
-            .format(responsecheck))
+        # Obtain building name from response
+        building_info = pd.DataFrame(building_json)
+        building_info['buildingnumber'] = list(
+            range(1, len(building_info) + 1))
+        building_info = building_info.set_index('buildingnumber')
+
+        print('Login successful.\nBuilding info aquired successfully '
+              'from {} building(s). First building: {}.'
+              .format(len(building_info), building_info['name'].loc[1]))
+        return (building_info)
 
     @staticmethod
     def _get_login_info():
@@ -137,6 +174,8 @@ class Scraper():
         :return: the json returned by the response if successful (converted
         from a dict to a dataframe) or raise an IOError if the call failed.
         """
+        import requests as r  # required to access API
+
         url = 'https://console.beringar.co.uk/api/{}'.format(function_name)
         # print(url)
         response = r.get(url, auth=(self.username, self.password))
@@ -144,20 +183,35 @@ class Scraper():
 
         # Success code = 200, Failed = 400 (simplified).
         if 200 <= status_code < 300:
-            # Response as OK.
-            if response.json():
-                response_df = pd.DataFrame(pd.DataFrame(response.json()))
-                response_df['number'] = list(range(1, len(response_df) + 1))
-                response_df = response_df.set_index('number')
-            else:
-                response_df = response.json()
-        return (response_df)
+            # Response as OK. Decoded once, straight from the bytes.
+            return (Scraper._response_to_dataframe(
+                Scraper._decode_json(response.content)))
 
         # Failed if here
         print('API call failed with code: {}.'.format(status_code))
         raise IOError("Call to the API failed ({}) on url: '{}'".format(
             status_code, url))
 
+    @staticmethod
+    def _decode_json(content):
+        ''' Decodes the bytes of an API response, once, with orjson if it is 
+        installed.'''
+        if orjson is not None:
+            return (orjson.loads(content))
+        return (json.loads(content))
+
+    @staticmethod
+    def _response_to_dataframe(response_json):
+        ''' Converts the json returned by an API call to a dataframe with 
+        rows numbered from 1 (see Scraper._call_API()). Empty responses are 
+        returned as they are.'''
+        if not response_json:
+            return (response_json)
+        response_df = pd.DataFrame(response_json)
+        response_df['number'] = list(range(1, len(response_df) + 1))
+        response_df = response_df.set_index('number')
+        return (Scraper._compact_dtypes(response_df))
+
     def get_contract_info(self):
         '''Get all contract info associated with account.'''
         contract_info = self._call_API("contract")
@@ -267,6 +321,7 @@ class Scraper():
             function_name = "beta/managedspace/spacelocation/{}/after/{}" \
                 .format(space['id'], timestamp_epoch_millisec)
 
+            response = None
             try:
                 response = self._call_API(function_name)
             except Exception as e:
@@ -309,8 +364,6 @@ class Scraper():
 
         '''
 
-        all_possible_space_numbers = list(self.managed_space_info.index)
-
         # Construct the name of the function to be embedded into the
         # API URL
         function_name = "managedspace/latest/building/{}".format(
@@ -331,13 +384,19 @@ class Scraper():
                   .format(1, self.building_info['name'].loc[building_number],
                           str(e)))
 
-        """ Check the ids of the returned managed spaces against all those 
-        available and return a list of corresponding indices from 'self'"""
-        returned_space_numbers = []
-        for space_id in managed_space_latest_data['managedspace']:
-            returned_space_numbers.append(int(
-                self.managed_space_info[
-                    self.managed_space_info['id'] == space_id].index.values))
+        return (self._managed_space_latest_frame(managed_space_latest_data))
+
+    def _managed_space_latest_frame(self, managed_space_latest_data):
+        ''' Adds the managed space numbers to the dataframe returned by the 
+        API for Scraper.managed_space_latest(), and reports missing spaces. 
+        Returns the dataframe and the list of space numbers returned.'''
+
+        all_possible_space_numbers = list(self.managed_space_info.index)
+
+        """ Look up the ids of the returned managed spaces and return a list 
+        of corresponding indices from 'self'"""
+        returned_space_numbers = managed_space_latest_data['managedspace']\
+            .astype(object).map(self.space_number_by_id).astype(int).tolist()
 
         """ add new column in response which corresponds with indices from 
         self, sort, and make it the index column"""
@@ -348,10 +407,10 @@ class Scraper():
             'spacenumber'])
 
         # check for missing spaces and print names and numbers if one is found
-        for i in all_possible_space_numbers:
-            if i not in returned_space_numbers:
-                print('Managed space location number {}: {}. NO DATA RETURNED.'
-                      .format(i, self.managed_space_info['name'].loc[i]))
+        for i in sorted(set(all_possible_space_numbers) - 
+                        set(returned_space_numbers)):
+            print('Managed space location number {}: {}. NO DATA RETURNED.'
+                  .format(i, self.managed_space_info['name'].loc[i]))
 
         print('Latest managed space readings acquired successfully from: {} '
               'of {} possible sensors.'
@@ -434,6 +493,7 @@ class Scraper():
             function_name = "beta/sensorreading/sensorlocation/{}/after/{}" \
                 .format(sensor['id'], timestamp_epoch_millisec)
 
+            response = None
             try:
                 response = self._call_API(function_name)
             except Exception as e:
@@ -447,25 +507,8 @@ class Scraper():
                       .format(sensor_num, sensor['name']))
                 fail += 1
             else:
-
-                # Sort timestamp columns to match other functions
-                response = \
-                    response.rename(columns={'rxtimestamputc': 'timestamputc',
-                                             'rxepochmillisec': 'timestampms',
-                                             'sensorlocationcurrent':
-                                                 'sensorlocation'})
-                response['timestamputc'] = response['timestamputc'].apply(
-                    parse)
-
-                # add 'sensornumber' column
-                # TODO: Make sure sensornumber is correct.
-                response['sensornumber'] = sensor_num
-
-                # add 'name' column for room name
-                response['name'] = list(
-                    self.sensor_location_info['name']
-                    .loc[response['sensornumber']])
-
+                response = self._sensor_reading_after_frame(response, 
+                                                            sensor_num)
                 sensor_reading_after_data.append(response)
                 sensor_locations.append(sensor_num)
 
@@ -481,6 +524,31 @@ class Scraper():
 
         return (sensor_reading_after_data, sensor_locations)
 
+    def _sensor_reading_after_frame(self, response, sensor_num):
+        ''' Renames the columns of the dataframe returned by the API for one 
+        sensor to match other functions, and adds the sensor number and name.
+        '''
+        from dateutil.parser import parse
+
+        # Sort timestamp columns to match other functions
+        response = \
+            response.rename(columns={'rxtimestamputc': 'timestamputc',
+                                     'rxepochmillisec': 'timestampms',
+                                     'sensorlocationcurrent':
+                                         'sensorlocation'})
+        response['timestamputc'] = response['timestamputc'].apply(parse)
+
+        # add 'sensornumber' column
+        # TODO: Make sure sensornumber is correct.
+        response['sensornumber'] = sensor_num
+
+        # add 'name' column for room name
+        response['name'] = list(
+            self.sensor_location_info['name']
+            .loc[response['sensornumber']])
+
+        return (response)
+
     def sensor_reading_latest(self, building_number=1):
         ''' Get latest sensor readings from sensor locations of (default) 
         building number 1. Since the API call returns a list which excludes 
@@ -495,8 +563,6 @@ class Scraper():
 
         '''
 
-        all_possible_sensor_numbers = list(self.sensor_location_info.index)
-
         # Construct the name of the function to be embedded into the
         # API URL
         function_name = "sensorreading/latest/building/{}".format(
@@ -517,21 +583,27 @@ class Scraper():
                   .format(1, self.building_info['name'].loc[building_number],
                           str(e)))
 
-        """ Check the ids of the returned sensor locations against all those 
-        available and return a list of corresponding indices from 'self'"""
-        returned_sensor_numbers = []
-        for sensor_id in sensor_reading_latest_data['sensorlocation']:
-            # TODO: check this is correct:
-            returned_sensor_numbers.append(int(
-                self.sensor_location_info[self.sensor_location_info['id'] ==
-                                          sensor_id].index.values))
+        return (self._sensor_reading_latest_frame(sensor_reading_latest_data))
+
+    def _sensor_reading_latest_frame(self, sensor_reading_latest_data):
+        ''' Adds the sensor numbers and names to the dataframe returned by the 
+        API for Scraper.sensor_reading_latest(), and reports missing sensors. 
+        Returns the dataframe and the list of sensor numbers returned.'''
+        from dateutil.parser import parse
+
+        all_possible_sensor_numbers = list(self.sensor_location_info.index)
+
+        """ Look up the ids of the returned sensor locations and return a 
+        list of corresponding indices from 'self'"""
+        returned_sensor_numbers = sensor_reading_latest_data['sensorlocation']\
+            .astype(object).map(self.sensor_number_by_id).astype(int).tolist()
 
         # Sort timestamp columns to match other functions
         sensor_reading_latest_data['timestamputc'] = \
             sensor_reading_latest_data['timestamputc'].apply(parse)
         sensor_reading_latest_data['timestampms'] = sensor_reading_latest_data[[
-            'timestamputc']].apply(lambda x: x[0].timestamp(), axis=1)\
-            .astype('int64') * 1000
+            'timestamputc']].apply(lambda x: x.iloc[0].timestamp(), 
+                                   axis=1).astype('int64') * 1000
 
         """ add new column in response which corresponds with indices from 
         self, sort, and make it the index column"""
@@ -550,10 +622,10 @@ class Scraper():
             .loc[sensor_reading_latest_data['sensornumber']]
 
         # Check for missing spaces and print names and numbers if one is found
-        for i in all_possible_sensor_numbers:
-            if i not in returned_sensor_numbers:
-                print('Sensor number {}: {}. NO DATA RETURNED.'
-                      .format(i, self.sensor_location_info['name'].loc[i]))
+        for i in sorted(set(all_possible_sensor_numbers) - 
+                        set(returned_sensor_numbers)):
+            print('Sensor number {}: {}. NO DATA RETURNED.'
+                  .format(i, self.sensor_location_info['name'].loc[i]))
 
         print('Latest sensor readings acquired successfully from: {} of {} '
               'possible sensors.' .format(len(returned_sensor_numbers),
@@ -583,6 +655,9 @@ class Scraper():
         -------
         Plots overlays of occupancy of managed spaces on a single axis.
         '''
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
+        from matplotlib.ticker import MaxNLocator
 
         if managed_space_after_data is None and managed_spaces is None:
             managed_space_after_data, managed_spaces = \
@@ -668,6 +743,8 @@ class Scraper():
         A plot for each sensor displaying Occupancy, VOC, CO2, Temperature,
         Pressure, Humidity, Light Intensity, and Noise Levels.
         '''
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
 
         if sensor_reading_after_data is None and sensor_numbers is None:
             sensor_reading_after_data, sensor_numbers = \
@@ -743,6 +820,65 @@ class Scraper():
         ''' Get the current time as ms time epoch'''
         return (int(round(time.time() * 1000)))
 
+    @staticmethod
+    def _compact_dtypes(dataframe, parameters=None, lossless=True,
+                        report=False):
+        ''' Converts the columns of 'dataframe' to compact dtypes:
+            - ms times ('timestampms', 'rxepochmillisec') to int64
+            - parameters (default Scraper.param_list) to the smallest int or 
+              float type. With 'lossless', float32 is only used where no 
+              precision is lost, since these frames are written to the 
+              database. Otherwise all parameters are float32 (for plotting).
+            - other integer columns (e.g. numbers) to the smallest int type
+            - repeated strings (names and ids) to categoricals. Time strings 
+              are left as they are.
+        If 'report', prints the memory used before and after.'''
+
+        if parameters is None:
+            parameters = Scraper.param_list
+        memory_before = dataframe.memory_usage(deep=True).sum()
+
+        for column in dataframe.columns:
+            values = dataframe[column]
+            if column in ('timestampms', 'rxepochmillisec'):
+                if pd.api.types.is_numeric_dtype(values) and \
+                        not values.isna().any():
+                    dataframe[column] = values.astype('int64')
+            elif column in parameters:
+                if not pd.api.types.is_numeric_dtype(values) or \
+                        pd.api.types.is_bool_dtype(values):
+                    continue
+                if not lossless:
+                    dataframe[column] = values.astype('float32')
+                elif pd.api.types.is_integer_dtype(values):
+                    dataframe[column] = pd.to_numeric(values, 
+                                                      downcast='integer')
+                else:
+                    compact = values.astype('float32')
+                    if ((compact.astype('float64') == values) | 
+                            values.isna()).all():
+                        dataframe[column] = compact
+            elif pd.api.types.is_integer_dtype(values) and \
+                    not pd.api.types.is_bool_dtype(values):
+                dataframe[column] = pd.to_numeric(values, downcast='integer')
+            elif pd.api.types.is_object_dtype(values) or \
+                    pd.api.types.is_string_dtype(values):
+                # names and ids (not lists or dicts) which repeat
+                if 'time' in column or pd.api.types.infer_dtype(
+                        values, skipna=True) != 'string' or \
+                        values.nunique() > len(values) // 2:
+                    continue
+                dataframe[column] = values.astype('category')
+
+        if report:
+            memory_after = dataframe.memory_usage(deep=True).sum()
+            print('Memory used by {} rows: {:.1f} kB ({:.1f} kB before '
+                  'compacting dtypes).'.format(len(dataframe), 
+                                               memory_after / 1024, 
+                                               memory_before / 1024))
+
+        return (dataframe)
+
     @staticmethod
     def _make_empty_list(length):
         ''' Returns an empty list of length 'length'''
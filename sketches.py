@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+sketches.py
+
+Quantile sketches of the readings, so that percentiles over long time ranges
+(e.g. the 95th percentile of CO2 per room per week over a year) can be found
+without reading the readings. As readings are inserted by database.py, a
+sketch is kept for each sensor, parameter, and hour in the 'sensor_sketches'
+table. Sketches from any sensors, rooms, and hours can be merged by adding
+their counts, which is done by DatabasePlotter.get_quantiles().
+
+Each sketch counts the readings in buckets whose edges grow by a factor of
+gamma = (1 + a) / (1 - a), where a = QuantileSketch.relative_accuracy (1%),
+as in DDSketch (Masson et al., 2019). A percentile is given as the middle of
+the bucket holding the reading of that rank, so it is within 1% of the value
+of that reading (e.g. 1500 ppm CO2 is given as between 1485 and 1515 ppm).
+Merging sketches is exact, so the same bound holds for any sensors and time
+range. Values within 1e-9 of zero are counted as zero.
+
+"""
+import math
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch():
+    '''Builds, stores, and merges the quantile sketches. Each sketch is an
+    array of bucket keys (int16) and an array of the number of readings in
+    each bucket (int32).
+    '''
+
+    # largest relative error of a percentile
+    relative_accuracy = 0.01
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+    # values closer to zero than this are counted in the zero bucket (key 0)
+    min_value = 1e-9
+
+    # keys of positive values are 'offset' + ceil(log_gamma(value)), and of
+    # negative values the same but negative, so keys are in value order
+    offset = 4096
+
+    # parameters sketched, with their names in the API dataframes
+    parameters = {'occupancy': 'occupancy', 'voc': 'voc', 'co2': 'co2',
+                  'temperature': 'temperature', 'pressure': 'pressure',
+                  'humidity': 'humid', 'lux': 'lux', 'noise': 'noise'}
+
+    @staticmethod
+    def create_table(c):
+        ''' Creates the 'sensor_sketches' table (if it does not exist).'''
+        c.execute('CREATE TABLE IF NOT EXISTS sensor_sketches('
+                  'sensorlocation VARCHAR(255) NOT NULL, '
+                  'parameter VARCHAR(255) NOT NULL, '
+                  'hour INTEGER NOT NULL, '  # ms time of start of the hour
+                  'keys BLOB, '  # int16 bucket keys
+                  'counts BLOB, '  # int32 readings in each bucket
+                  'PRIMARY KEY (sensorlocation, parameter, hour)) '
+                  'WITHOUT ROWID;')
+
+    @staticmethod
+    def keys(values):
+        ''' Returns the bucket key of each value (float array).'''
+        magnitude = np.abs(values)
+        keys = np.zeros(len(values), dtype=np.int16)
+        nonzero = magnitude > QuantileSketch.min_value
+        keys[nonzero] = (QuantileSketch.offset + np.ceil(
+            np.log(magnitude[nonzero]) / math.log(QuantileSketch.gamma)))\
+            * np.sign(values[nonzero])
+        return (keys)
+
+    @staticmethod
+    def values(keys):
+        ''' Returns the value given for each bucket key: the middle of the
+        bucket, which is within the relative accuracy of every value in it.
+        '''
+        keys = np.asarray(keys, dtype=float)
+        magnitude = np.abs(keys) - QuantileSketch.offset
+        gamma = QuantileSketch.gamma
+        return (np.where(keys == 0, 0.0, np.sign(keys) * 2 *
+                         gamma ** magnitude / (gamma + 1)))
+
+    @staticmethod
+    def merge(keys, counts):
+        ''' Merges sketches given as lists of key arrays and count arrays, and
+        returns the keys (in order) and counts of the merged sketch.'''
+        if not len(keys):
+            return (np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int32))
+        keys = np.concatenate(keys).astype(np.int32)
+        counts = np.concatenate(counts)
+        lowest = keys.min()
+        totals = np.bincount(keys - lowest, weights=counts)
+        present = np.flatnonzero(totals)
+        return ((present + lowest).astype(np.int16),
+                totals[present].astype(np.int32))
+
+    @staticmethod
+    def quantiles(keys, counts, quantiles):
+        ''' Returns the approximate value of each quantile (0 to 1) of the
+        readings in a sketch with keys in order, or NaN if it is empty.'''
+        total = counts.sum()
+        if total == 0:
+            return (np.full(len(quantiles), np.nan))
+        # rank of the reading at each quantile, counting from 0
+        ranks = np.floor(np.asarray(quantiles) * (total - 1))
+        positions = np.searchsorted(np.cumsum(counts), ranks, side='right')
+        return (QuantileSketch.values(keys[positions]))
+
+    @staticmethod
+    def update(conn, readings):
+        ''' Adds readings (a dataframe from the API with sensorlocation,
+        timestampms, and the parameters) to the sketches of their sensors and
+        hours, merging with the sketches already stored. Only readings which
+        were not in the database before should be added.'''
+
+        if readings is None or readings.empty:
+            return
+
+        hours = readings['timestampms'].to_numpy(dtype='int64') // \
+            3600000 * 3600000
+        rows = []
+        for parameter, column in QuantileSketch.parameters.items():
+            if column not in readings.columns:
+                continue
+            values = pd.to_numeric(readings[column], errors='coerce')\
+                .to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            if not valid.any():
+                continue
+            counted = pd.DataFrame({
+                'sensorlocation': readings['sensorlocation'].astype(str)
+                .to_numpy()[valid],
+                'hour': hours[valid],
+                'key': QuantileSketch.keys(values[valid])})\
+                .groupby(['sensorlocation', 'hour', 'key']).size()
+            for (sensorlocation, hour), sketch in counted.groupby(
+                    level=['sensorlocation', 'hour']):
+                rows.append((sensorlocation, parameter, int(hour),
+                             sketch.index.get_level_values('key')
+                             .to_numpy(dtype=np.int16),
+                             sketch.to_numpy(dtype=np.int32)))
+
+        c = conn.cursor()
+        with conn:
+            for sensorlocation, parameter, hour, keys, counts in rows:
+                c.execute('SELECT keys, counts FROM sensor_sketches '
+                          'WHERE sensorlocation = ? AND parameter = ? '
+                          'AND hour = ?;', [sensorlocation, parameter, hour])
+                stored = c.fetchone()
+                if stored is not None:
+                    keys, counts = QuantileSketch.merge(
+                        [np.frombuffer(stored[0], dtype=np.int16), keys],
+                        [np.frombuffer(stored[1], dtype=np.int32), counts])
+                c.execute('INSERT OR REPLACE INTO sensor_sketches '
+                          '(sensorlocation, parameter, hour, keys, counts) '
+                          'VALUES(?,?,?,?,?)',
+                          [sensorlocation, parameter, hour, keys.tobytes(),
+                           counts.tobytes()])
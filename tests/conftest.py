@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the tests. Run from the directory containing database.py
+with:
+
+    python -m pytest tests
+
+The tests use a new database.db in a temporary directory and a scraper which
+makes up readings instead of calling the API, so no login is needed.
+
+"""
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database  # noqa: E402
+import scraper  # noqa: E402
+
+
+class FakeScraper(scraper.Scraper):
+    '''Scraper() with two sensors, which returns made up readings one minute
+    apart from sensor_reading_after().'''
+
+    sensor_location_info = pd.DataFrame(
+        {'id': ['s1', 's2'], 'name': ['0-Café-1', '0-Café-2']},
+        index=pd.Index([1, 2], name='sensornumber'))
+
+    def __init__(self):
+        pass
+
+    def sensor_reading_after(self, sensor_numbers=None,
+                             timestamp_epoch_millisec=None, readings=1000):
+        times = ((timestamp_epoch_millisec // 60000 + 1) * 60000 +
+                 60000 * np.arange(readings))
+        rng = np.random.default_rng(sensor_numbers)
+        dataframe = pd.DataFrame(
+            {'timestampms': times,
+             'timestamputc': pd.to_datetime(times, unit='ms').astype(str),
+             'sensorlocation': self.sensor_location_info['id']
+             .loc[sensor_numbers],
+             'sensornumber': sensor_numbers, 'name': 'x',
+             'co2': 450 + rng.normal(0, 10, readings), 'humid': 40.,
+             'lux': 1, 'noise': 30, 'occupancy': rng.integers(0, 3, readings),
+             'pressure': 1000, 'temperature': 21., 'voc': np.nan},
+            index=pd.RangeIndex(1, readings + 1))
+        return ([scraper.Scraper._compact_dtypes(dataframe)],
+                [sensor_numbers])
+
+
+@pytest.fixture
+def database_dir(tmp_path, monkeypatch):
+    '''Changes to a temporary directory holding a new database.db in the
+    compact layout, with database.py using FakeScraper().'''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, 'Scraper', FakeScraper)
+    conn = sqlite3.connect('database.db')
+    with open(os.path.join(ROOT, 'create_database.sql')) as sql_file:
+        conn.executescript(sql_file.read())
+    conn.close()
+    database.Database.compact_database(
+        script=os.path.join(ROOT, 'compact_database.sql'))
+    return (tmp_path)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from archive import Archive
+
+
+def day_of_readings(n=1440):
+    '''A day of readings one minute apart (with some late and missing), 
+    with a parameter of each kind of stream.'''
+    rng = np.random.default_rng(0)
+    timestamps = 1588291200000 + 60000 * np.arange(n) + \
+        rng.integers(0, 3, n) * 1000
+    timestamps = np.delete(timestamps, [100, 101, 700])
+
+    occupancy = np.zeros(len(timestamps))  # runs of zeros
+    occupancy[300:360] = 2
+    occupancy[500] = 1
+    occupancy[[10, 11, 12, 900]] = np.nan
+    co2 = np.round(450 + np.cumsum(rng.normal(0, 2, len(timestamps))))
+    temperature = np.round(21 + np.cumsum(
+        rng.normal(0, 0.01, len(timestamps))), 2)  # decimal
+    pressure = 1000 + rng.normal(0, 1, len(timestamps))  # XOR
+    pressure[::50] = np.nan
+    lux = np.full(len(timestamps), np.nan)  # all missing
+    return (timestamps, {'occupancy': occupancy, 'co2': co2,
+                         'temperature': temperature, 'pressure': pressure,
+                         'lux': lux})
+
+
+def test_round_trip():
+    timestamps, values = day_of_readings()
+    block = Archive.encode(timestamps, values)
+    decoded_timestamps, decoded = Archive.decode(block)
+
+    np.testing.assert_array_equal(decoded_timestamps, timestamps)
+    assert set(decoded) == set(Archive.param_list)
+    for parameter in Archive.param_list:
+        expected = values.get(parameter, np.full(len(timestamps), np.nan))
+        assert decoded[parameter].dtype == np.float64
+        np.testing.assert_array_equal(decoded[parameter], expected)
+
+
+def test_stream_kinds():
+    _, values = day_of_readings()
+    assert Archive._decimal_places(values['co2']) == 0
+    assert Archive._decimal_places(values['temperature']) == 2
+    pressure = values['pressure']
+    assert Archive._decimal_places(pressure[~np.isnan(pressure)]) is None
+
+
+def test_zero_runs_are_short():
+    timestamps = 1588291200000 + 60000 * np.arange(1440)
+    block = Archive.encode(timestamps, {'occupancy': np.zeros(1440)})
+    assert len(block) < 40
+    _, decoded = Archive.decode(block, parameters=['occupancy'])
+    assert list(decoded) == ['occupancy']
+    np.testing.assert_array_equal(decoded['occupancy'], np.zeros(1440))
+
+
+def test_empty_block():
+    timestamps, values = Archive.decode(Archive.encode([], {}))
+    assert len(timestamps) == 0
+    assert all(len(column) == 0 for column in values.values())
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from bloomfilter import BloomFilter
+
+# a time (ms) in May 2020
+time_start = 1588291200000
+
+
+def readings(sensors, minutes, first_minute=0):
+    '''Sensor ids and ms times of readings one minute apart.'''
+    sensorlocations = np.repeat(['sensor-{}'.format(i) 
+                                 for i in range(sensors)], minutes)
+    timestamps = np.tile(time_start + 60000 * np.arange(
+        first_minute, first_minute + minutes), sensors)
+    return (sensorlocations, timestamps)
+
+
+def test_no_false_negatives():
+    bloom_filter = BloomFilter()
+    sensorlocations, timestamps = readings(20, 50000)
+    bloom_filter.add(sensorlocations, timestamps)
+    assert bloom_filter.might_contain(sensorlocations, timestamps).all()
+    assert not bloom_filter.is_full()
+
+
+def test_false_positive_rate():
+    # filled to capacity, about 1% of other readings are false hits
+    bloom_filter = BloomFilter()
+    bloom_filter.add(*readings(20, BloomFilter.min_capacity // 20))
+    others = readings(20, 50000, first_minute=BloomFilter.min_capacity)
+    rate = bloom_filter.might_contain(*others).mean()
+    assert 0.005 < rate < 0.015
+
+
+def test_save_and_load(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bloom_filter = BloomFilter()
+    sensorlocations, timestamps = readings(2, 1000)
+    bloom_filter.add(sensorlocations[:1000], timestamps[:1000])
+    bloom_filter.save(1)
+    # added after saving, through the mapped file
+    bloom_filter.add(sensorlocations[1000:], timestamps[1000:])
+    bloom_filter.save(2)
+    bloom_filter.close()
+
+    loaded = BloomFilter.load()
+    assert loaded.watermark == 2
+    assert loaded.count == 2000
+    assert loaded.might_contain(sensorlocations, timestamps).all()
+    loaded.close()
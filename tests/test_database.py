@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import scraper
+from database import Database
+
+# a time (ms) in May 2020
+time_start = 1588291200000
+
+
+def hourly_summaries():
+    conn = sqlite3.connect('database.db')
+    rows = conn.execute('SELECT sensor_key, timestampms, readings '
+                        'FROM sensor_readings_hourly ORDER BY 1, 2;')\
+        .fetchall()
+    conn.close()
+    return (rows)
+
+
+def test_downsampled_readings_are_not_inserted_again(database_dir,
+                                                     monkeypatch):
+    database = Database()
+    readings, _ = database.smart_building.sensor_reading_after(1, time_start)
+    database.insert_sensor_readings_after(readings)
+    del database
+
+    monkeypatch.setattr(scraper.Scraper, '_time_now',
+                        staticmethod(lambda: time_start + 10 * 86400000))
+    Database.downsample_database(1)
+    summaries = hourly_summaries()
+    assert sum(row[2] for row in summaries) == 1000
+
+    # backfilling the same window skips the summarised readings
+    database = Database()
+    database.insert_sensor_readings_after(readings)
+    assert database.c.execute('SELECT COUNT(*) FROM '
+                              'sensor_readings_compact;').fetchone()[0] == 0
+    del database
+
+    Database.downsample_database(1)
+    assert hourly_summaries() == summaries
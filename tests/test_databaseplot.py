@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import sqlite3
+
+from databaseplot import DatabasePlotter
+
+
+def test_lttb_keeps_ends_and_peaks():
+    # noise, with a peak in every tenth of the 98 buckets between the ends
+    rng = np.random.default_rng(0)
+    n, n_out = 10000, 100
+    x = np.arange(n, dtype=float)
+    y = rng.normal(0, 0.01, n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    peaks = ((edges[:-1] + edges[1:]) // 2)[::10]
+    y[peaks] = 10
+    y[peaks[::2]] = -10
+
+    selected = DatabasePlotter._lttb_indices(x, y, n_out)
+    assert len(selected) == n_out
+    assert selected[0] == 0 and selected[-1] == n - 1
+    assert (np.diff(selected) > 0).all()
+    assert np.isin(peaks, selected).all()
+
+
+def test_minmax_keeps_ends_and_extremes_of_each_bucket():
+    rng = np.random.default_rng(0)
+    n, n_out = 10007, 200
+    y = np.cumsum(rng.normal(0, 1, n))
+
+    selected = DatabasePlotter._minmax_indices(y, n_out)
+    assert len(selected) <= n_out + 2
+    assert selected[0] == 0 and selected[-1] == n - 1
+    assert (np.diff(selected) > 0).all()
+    bucket = np.arange(n) * (n_out // 2) // n
+    for i in range(n_out // 2):
+        kept = y[selected[bucket[selected] == i]]
+        assert kept.min() == y[bucket == i].min()
+        assert kept.max() == y[bucket == i].max()
+
+
+def test_decimate_series():
+    index = pd.date_range('2020-05-01', periods=5000, freq='min')
+    series = pd.Series(np.sin(np.arange(5000) / 100), index=index)
+    series.iloc[[0, 10, 4999]] = np.nan
+    for method in ['lttb', 'minmax']:
+        decimated = DatabasePlotter._decimate(series, 100, method=method)
+        assert len(decimated) <= 102
+        assert not decimated.isna().any()
+        assert decimated.index[0] == index[1]
+        assert decimated.index[-1] == index[4998]
+        if method == 'minmax':
+            assert decimated.max() == series.max()
+            assert decimated.min() == series.min()
+    # short series are not changed
+    assert DatabasePlotter._decimate(series[:50], 100).equals(
+        series[:50].dropna())
+
+
+def test_aggregate_data_matches_chunks(monkeypatch):
+    # two sensors in a room, with readings at seconds past the minute
+    rng = np.random.default_rng(0)
+    times = 1588291200000 + np.sort(rng.integers(0, 600 * 60000, 2000))
+    readings = pd.DataFrame({
+        'timestampms': times, 'sensor_number': np.tile([1, 2], 1000),
+        'sensor_name': np.tile(['0-Café-1', '0-Café-2'], 1000),
+        'co2': rng.normal(450, 10, 2000), 
+        'occupancy': rng.integers(0, 3, 2000).astype(float)})
+    plotter = DatabasePlotter.__new__(DatabasePlotter)
+    plotter.conn = sqlite3.connect(':memory:')
+    plotter.archive = None
+    monkeypatch.setattr(plotter, 'get_names_and_numbers', 
+                        lambda sensors: (sensors, ['0-Café-1', '0-Café-2'], 
+                                         [1], ['Café']))
+
+    aggregated = plotter.aggregate_data(readings.copy(), ['co2', 'occupancy'])
+    chunks = plotter.aggregate_data_chunks(
+        [readings[:700].copy(), readings[700:].copy()], ['co2', 'occupancy'])
+    assert (aggregated['timestampms'] % 60000 == 0).all()
+    assert aggregated['timestamputc'].iloc[0] == \
+        '2020-05-01T00:00:00.000001+00:00'
+    pd.testing.assert_frame_equal(aggregated[chunks.columns], chunks,
+                                  check_dtype=False, check_index_type=False)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from sketches import QuantileSketch
+
+quantiles = np.linspace(0, 1, 101)
+
+
+def sketch(values):
+    '''Keys (in order) and counts of a sketch of the values.'''
+    keys, counts = np.unique(QuantileSketch.keys(values), return_counts=True)
+    return (keys, counts.astype(np.int32))
+
+
+def check_quantiles(keys, counts, values):
+    # the reading at each rank, as QuantileSketch.quantiles() counts them
+    exact = np.quantile(values, quantiles, method='lower')
+    approximate = QuantileSketch.quantiles(keys, counts, quantiles)
+    relative_error = np.abs(approximate - exact) / np.maximum(
+        np.abs(exact), QuantileSketch.min_value)
+    assert (relative_error <= QuantileSketch.relative_accuracy).all()
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(0)
+    for values in [rng.lognormal(6.2, 0.4, 100000),  # e.g. co2
+                   rng.normal(21, 2, 100000),  # e.g. temperature
+                   rng.normal(0, 5, 100000),  # either sign
+                   np.round(rng.exponential(0.5, 100000))]:  # many zeros
+        check_quantiles(*sketch(values), values)
+
+
+def test_merged_quantiles():
+    # e.g. hourly sketches of several sensors merged for one query
+    rng = np.random.default_rng(1)
+    hours = [rng.lognormal(6 + 0.1 * hour, 0.3, 1000) for hour in range(24)]
+    sketches = [sketch(values) for values in hours]
+    keys, counts = QuantileSketch.merge([keys for keys, _ in sketches],
+                                        [counts for _, counts in sketches])
+    assert (np.diff(keys) > 0).all()
+    assert counts.sum() == 24000
+    check_quantiles(keys, counts, np.concatenate(hours))
+
+
+def test_empty_sketch():
+    keys, counts = QuantileSketch.merge([], [])
+    assert np.isnan(QuantileSketch.quantiles(keys, counts, [0.5])).all()